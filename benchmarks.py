@@ -0,0 +1,395 @@
+# Benchmarks for Varithon. Run with: python benchmarks.py
+# The suite times parsing, collapsing, and emitting synthetic templates of increasing size, and compares the
+# results against the baseline stored in benchmarks_baseline.json, so that regressions show up. Each scenario is
+# timed alongside a fixed calibration workload, and timings are compared relative to it, so a baseline saved on one
+# machine still holds on a faster, slower, or busier one, and scenarios which regress are run again to rule out
+# noise. Use --save-baseline to replace the stored baseline, and --parse-scaling to compare the lexer against the
+# previous recursive parser.
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+import varithon as V
+from commands.var import Var
+from commands.get import Get
+from commands.collection import Collection
+from commands.rand import Rand
+
+
+############################################################################
+######################### Reference Implementation #########################
+############################################################################
+
+# The recursive parser that was replaced by the single-pass lexer in varithon.py, kept here
+# only so the benchmarks can show how both scale.
+
+def legacy_tokenize_command(string):
+    tokens = []
+
+    brace_level = 0
+    last_tokenized_index = 0
+    for i in range(len(string) + 1):
+        if i == len(string) or (string[i] == ' ' and brace_level == 0):
+            if i > last_tokenized_index:
+                tokens.append(string[last_tokenized_index:i])
+                last_tokenized_index = i + 1
+        elif string[i] == '{':
+            if brace_level == 0:
+                last_tokenized_index = i
+            brace_level += 1
+        elif string[i] == '}':
+            brace_level -= 1
+            if brace_level == 0:
+                tokens.append(legacy_parse_command(string[last_tokenized_index + 1:i]))
+                last_tokenized_index = i + 1
+
+    return tokens
+
+
+def legacy_parse_command(string):
+    tokens = legacy_tokenize_command(string)
+
+    match tokens.pop(0):
+        case "var":
+            return Var(tokens)
+        case "get":
+            return Get(tokens)
+        case "collection":
+            return Collection(tokens)
+        case "rand":
+            return Rand(tokens)
+
+
+def legacy_parse_line(line):
+    if len(line) == 0:
+        return []
+
+    if V.COMMAND_START in line:
+        command_start_index = line.index(V.COMMAND_START)
+
+        before_start, after_start = line[:command_start_index], line[command_start_index + len(V.COMMAND_START):]
+
+        if V.COMMAND_END in after_start:
+            command_end_index = after_start.index(V.COMMAND_END)
+
+            command, after_end = after_start[:command_end_index], after_start[command_end_index + len(V.COMMAND_END):]
+
+            line_list = [legacy_parse_command(command)]
+            if len(before_start) > 0:
+                line_list.insert(0, before_start)
+            line_list.extend(legacy_parse_line(after_end))
+
+            return line_list
+        else:
+            raise V.SyntaxException(f"'{V.COMMAND_START}' found, but no matching '{V.COMMAND_END}'")
+    else:
+        return [line]
+
+
+def legacy_parse_varithon_string(source):
+    return [legacy_parse_line(line) for line in source.splitlines(keepends=True)]
+
+
+############################################################################
+############################### Benchmarks #################################
+############################################################################
+
+def time_call(function, *args):
+    """ Times a single call of a function.
+
+        :param function the function to call
+        :param args the arguments to call the function with
+        :return the time taken in seconds, or None if the call exceeded the recursion limit """
+
+    start = time.perf_counter()
+    try:
+        function(*args)
+    except RecursionError:
+        return None
+
+    return time.perf_counter() - start
+
+
+def commands_per_line_source(command_count):
+    """ Builds a single line .vy source with the given number of commands on it.
+
+        :param command_count the number of commands on the line
+        :return the .vy source as a string """
+
+    return "x = " + " + ".join(["~[rand -i 0 {rand -i 1 9}]~"] * command_count) + "\n"
+
+
+def line_count_source(line_count):
+    """ Builds a .vy source with the given number of lines, each containing a few commands.
+
+        :param line_count the number of lines
+        :return the .vy source as a string """
+
+    return "~[var a]~ = ~[collection -b {rand -i 1 3} {rand -f 0 1}]~ + [~[rand -i 0 9]~]\n" * line_count
+
+
+def benchmark_parse():
+    """ Prints how the time to parse a template grows with the number of commands per line and with the
+        size of the template, for both the single-pass lexer and the previous recursive parser. """
+
+    print("Parse time by commands on one line")
+    print(f"{'commands':>10} {'lexer (s)':>12} {'recursive (s)':>14}")
+    for command_count in [250, 500, 1000, 2000, 4000, 8000]:
+        source = commands_per_line_source(command_count)
+
+        lexer_time = time_call(V.parse_varithon_string, source)
+        legacy_time = time_call(legacy_parse_varithon_string, source)
+
+        legacy_text = "recursion" if legacy_time is None else f"{legacy_time:.4f}"
+        print(f"{command_count:>10} {lexer_time:>12.4f} {legacy_text:>14}")
+
+    print()
+    print("Parse time by template size")
+    print(f"{'size (MB)':>10} {'lexer (s)':>12} {'recursive (s)':>14}")
+    for line_count in [5000, 10000, 20000, 40000]:
+        source = line_count_source(line_count)
+
+        lexer_time = time_call(V.parse_varithon_string, source)
+        legacy_time = time_call(legacy_parse_varithon_string, source)
+
+        legacy_text = "recursion" if legacy_time is None else f"{legacy_time:.4f}"
+        print(f"{len(source) / 1e6:>10.2f} {lexer_time:>12.4f} {legacy_text:>14}")
+
+
+############################################################################
+################################# Suite ####################################
+############################################################################
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmarks_baseline.json")
+
+# the fraction a timing may grow by over the baseline before it is reported as a regression
+DEFAULT_TOLERANCE = 0.5
+
+# timings which grow by less than this many seconds are never reported, as such small differences are mostly noise
+NOISE_FLOOR_SECONDS = 0.001
+
+# the number of iterations of the calibration workload
+CALIBRATION_ITERATIONS = 20000
+
+# the number of times the scenarios which regressed are run again, a regression is only reported if it shows up in
+# every run, as a busy machine can slow down any single timing
+CONFIRM_RUNS = 2
+
+
+def synthetic_source(line_count=10, commands_per_line=1, nesting_depth=0, build_size=2):
+    """ Builds a synthetic .vy source. Every line builds a list with a collection command, nested within itself
+        nesting_depth times, followed by a list literal of rand commands, and is then printed.
+
+        :param line_count the number of statements, each statement is two lines
+        :param commands_per_line the number of top level commands on each statement line
+        :param nesting_depth the number of times the collection command is nested within itself
+        :param build_size the size given to every 'collection -b'
+        :return the .vy source as a string """
+
+    element = "{rand -i 0 9}"
+    for _ in range(nesting_depth):
+        element = f"{{collection -b {build_size} {element}}}"
+
+    rands = ", ".join(["~[rand -i 0 9]~"] * (commands_per_line - 1))
+
+    lines = []
+    for i in range(line_count):
+        lines.append(f"x{i} = ~[collection -b {build_size} {element}]~ + [{rands}]\n")
+        lines.append(f"print(len(x{i}))\n")
+
+    return "".join(lines)
+
+
+# the scenarios of the suite, each varying a single dimension of synthetic_source
+SCENARIOS = {
+    **{f"lines_{n}": dict(line_count=n) for n in [10, 100, 1000]},
+    **{f"commands_per_line_{n}": dict(commands_per_line=n) for n in [1, 10, 100]},
+    **{f"nesting_depth_{n}": dict(nesting_depth=n) for n in [0, 2, 4, 6]},
+    **{f"build_size_{n}": dict(line_count=1, build_size=n) for n in [10, 1000, 100000]},
+}
+
+
+def calibrate():
+    """ Times a fixed workload of plain python, which does not use Varithon at all, so it only changes with the
+        speed of the machine and how busy it is, never with changes to Varithon. The workload is timed as the
+        fastest of three repeats.
+
+        :return the time taken in seconds """
+
+    calibration_seconds = None
+    for _ in range(3):
+        start = time.perf_counter()
+
+        rng = random.Random(0)
+        lines = []
+        for i in range(CALIBRATION_ITERATIONS):
+            state = {"name": f"x{i}", "value": rng.random()}
+            lines.append([state["name"], " = ", str(state["value"]), "\n"])
+        "".join([item for line in lines for item in line])
+
+        elapsed = time.perf_counter() - start
+        calibration_seconds = elapsed if calibration_seconds is None else min(calibration_seconds, elapsed)
+
+    return calibration_seconds
+
+
+def run_scenario(source, variants, seed=0):
+    """ Times the parse, collapse, and emit stages of compiling a source, and measures peak memory. Each
+        stage is timed as the fastest of three repeats.
+
+        :param source the .vy source as a string
+        :param variants the number of variations to compile
+        :param seed an integer seed for the variations
+        :return a dictionary of the results """
+
+    # parsing is only timed once per run, so the fastest of a few runs is taken to reduce noise
+    parse_seconds = None
+    for _ in range(3):
+        start = time.perf_counter()
+        parsed = V.parse_varithon_string(source)
+        elapsed = time.perf_counter() - start
+        parse_seconds = elapsed if parse_seconds is None else min(parse_seconds, elapsed)
+
+    # every repeat compiles the same variations, so the fastest repeat is the one least affected by noise
+    collapse_seconds = None
+    emit_seconds = None
+    for _ in range(3):
+        repeat_collapse_seconds = 0.0
+        repeat_emit_seconds = 0.0
+        output_bytes = 0
+        for index in range(variants):
+            rng = V.variant_rng(seed, index)
+
+            start = time.perf_counter()
+            line_list = V.collapse_line_list(parsed, rng)
+            repeat_collapse_seconds += time.perf_counter() - start
+
+            start = time.perf_counter()
+            output = "".join([str(item) for line in line_list for item in line])
+            repeat_emit_seconds += time.perf_counter() - start
+
+            output_bytes += len(output)
+
+        if collapse_seconds is None or repeat_collapse_seconds + repeat_emit_seconds < collapse_seconds + emit_seconds:
+            collapse_seconds, emit_seconds = repeat_collapse_seconds, repeat_emit_seconds
+
+    # memory is measured separately, as tracing slows down every allocation
+    tracemalloc.start()
+    V.compile_variant(V.parse_varithon_string(source), seed, 0)
+    peak_memory_bytes = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {
+        "parse_seconds": parse_seconds,
+        "collapse_seconds": collapse_seconds / variants,
+        "emit_seconds": emit_seconds / variants,
+        "variants_per_second": variants / (collapse_seconds + emit_seconds),
+        "output_bytes": output_bytes // variants,
+        "peak_memory_bytes": peak_memory_bytes,
+    }
+
+
+def run_suite(variants=10, scenarios=None):
+    """ Runs every scenario of the suite, printing the results of each.
+
+        :param variants the number of variations to compile per scenario
+        :param scenarios a list of the names of the scenarios to run, every scenario if this is None
+        :return a dictionary of the results of each scenario """
+
+    print(f"{'scenario':<24} {'parse (s)':>10} {'collapse (s)':>13} {'emit (s)':>10} {'variants/s':>11} "
+          f"{'peak (KB)':>10}")
+
+    results = {}
+    for name in scenarios or SCENARIOS:
+        # calibrated both before and after each scenario, so both are timed under the same load even as it changes
+        calibration_seconds = calibrate()
+        result = run_scenario(synthetic_source(**SCENARIOS[name]), variants)
+        result["calibration_seconds"] = (calibration_seconds + calibrate()) / 2
+        results[name] = result
+
+        print(f"{name:<24} {result['parse_seconds']:>10.5f} {result['collapse_seconds']:>13.5f} "
+              f"{result['emit_seconds']:>10.5f} {result['variants_per_second']:>11.1f} "
+              f"{result['peak_memory_bytes'] / 1024:>10.1f}")
+
+    return results
+
+
+def compare_to_baseline(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """ Compares the results of the suite against a baseline. Timings are scaled by how much longer the calibration
+        took in this run than in the baseline, see calibrate, so only a timing which grew relative to the speed of
+        the machine is a regression.
+
+        :param results a dictionary of the results of each scenario
+        :param baseline a dictionary of the baseline results of each scenario
+        :param tolerance the fraction a timing or peak memory may grow by before it is a regression
+        :return a list of strings, each describing a single regression """
+
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+
+        scale = 1.0
+        if "calibration_seconds" in baseline[name]:     # not measured by baselines saved before calibration
+            scale = result["calibration_seconds"] / baseline[name]["calibration_seconds"]
+
+        for key in ["parse_seconds", "collapse_seconds", "emit_seconds", "peak_memory_bytes"]:
+            before, after = baseline[name][key], result[key]
+            if key.endswith("_seconds"):
+                before *= scale
+            if key.endswith("_seconds") and after - before < NOISE_FLOOR_SECONDS:
+                continue
+            if before > 0 and after > before * (1 + tolerance):
+                regressions.append(f"{name} {key}: {before:.6g} -> {after:.6g} (+{after / before - 1:.0%})")
+
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks Varithon.")
+    parser.add_argument("--parse-scaling", action="store_true", help="compare the lexer against the recursive parser")
+    parser.add_argument("--variants", type=int, default=10, help="the number of variations per scenario")
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS), help="a scenario to run")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="the baseline file to compare against")
+    parser.add_argument("--save-baseline", action="store_true", help="store the results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE, help="the allowed fractional slowdown")
+    args = parser.parse_args()
+
+    if args.parse_scaling:
+        benchmark_parse()
+        sys.exit()
+
+    results = run_suite(args.variants, args.scenario)
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=4, sort_keys=True)
+        print(f"Saved baseline to {args.baseline}")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+        for _ in range(CONFIRM_RUNS):
+            regressed = [name for name, result in results.items()
+                         if len(compare_to_baseline({name: result}, baseline, args.tolerance)) > 0]
+            if len(regressed) == 0:
+                break
+
+            print()
+            print("Running the scenarios which regressed again, to rule out noise")
+            results.update(run_suite(args.variants, regressed))
+
+        regressions = compare_to_baseline(results, baseline, args.tolerance)
+
+        print()
+        if len(regressions) > 0:
+            print("Regressions against the baseline:")
+            for regression in regressions:
+                print("    " + regression)
+            sys.exit(1)
+        print("No regressions against the baseline.")
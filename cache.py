@@ -0,0 +1,129 @@
+# An on-disk cache of parsed .vy files. Each parsed file is stored compressed, under a key made from the hash of
+# its contents and the Varithon version, so editing a file or upgrading Varithon means the old entry is never read.
+
+import hashlib
+import os
+import pickle
+import tempfile
+import zlib
+
+import varithon as V
+
+# the directory used when no cache directory is given, may be overridden by the VARITHON_CACHE_DIR environment variable
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "varithon")
+
+CACHE_EXTENSION = ".vyc"
+
+# the version of the layout of parsed .vy files within the cache, changed whenever the parsed Commands change
+CACHE_FORMAT = 2
+
+
+def get_cache_dir(cache_dir=None):
+    """ Gets the directory that parsed .vy files are cached in.
+
+        :param cache_dir a path to the cache directory, if this is None the VARITHON_CACHE_DIR environment
+            variable is used, or DEFAULT_CACHE_DIR if it is not set
+        :return a path to the cache directory """
+
+    if cache_dir is not None:
+        return cache_dir
+
+    return os.environ.get("VARITHON_CACHE_DIR", DEFAULT_CACHE_DIR)
+
+
+def get_cache_key(source):
+    """ Gets the cache key of the source of a .vy file, the key changes whenever either the source, the
+        Varithon version, or the cache format changes.
+
+        :param source the contents of a .vy file as a string
+        :return a hexadecimal string key """
+
+    digest = hashlib.sha256(V.VARITHON_VERSION.encode())
+    digest.update(b"\0")
+    digest.update(str(CACHE_FORMAT).encode())
+    digest.update(b"\0")
+    digest.update(source.encode())
+
+    return digest.hexdigest()
+
+
+def read_cache(key, cache_dir=None):
+    """ Reads a parsed .vy file from the cache.
+
+        :param key the cache key of the .vy file
+        :param cache_dir a path to the cache directory, see get_cache_dir
+        :return the parsed list of lines, or None if it is not cached or the entry is unreadable """
+
+    path = os.path.join(get_cache_dir(cache_dir), key + CACHE_EXTENSION)
+
+    try:
+        with open(path, "rb") as f:
+            return pickle.loads(zlib.decompress(f.read()))
+    except FileNotFoundError:
+        return None
+    except (OSError, zlib.error, pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+        return None     # a damaged or outdated entry is treated as missing, and will be replaced
+
+
+def write_cache(key, parsed_line_list, cache_dir=None):
+    """ Writes a parsed .vy file to the cache. The entry is written to a temporary file first, then moved into
+        place, so other processes never read a partially written entry.
+
+        :param key the cache key of the .vy file
+        :param parsed_line_list a list of lists, each interior list representing a single line of the Varithon file
+        :param cache_dir a path to the cache directory, see get_cache_dir """
+
+    directory = get_cache_dir(cache_dir)
+    os.makedirs(directory, exist_ok=True)
+
+    data = zlib.compress(pickle.dumps(parsed_line_list, pickle.HIGHEST_PROTOCOL))
+
+    fd, temporary_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(temporary_path, os.path.join(directory, key + CACHE_EXTENSION))
+    except BaseException:
+        os.remove(temporary_path)
+        raise
+
+
+def load_varithon_file(filepath, cache_dir=None):
+    """ Parses the given .vy file, reading it from the cache if it has already been parsed, and adding it to the
+        cache otherwise.
+
+        :param filepath: a path to the .vy file to parse
+        :param cache_dir a path to the cache directory, see get_cache_dir
+        :return: A list of strings and Command objects, possibly a VarithonSyntaxException
+            is thrown if the file is unable to be parsed """
+
+    with open(filepath, "r") as f:
+        source = f.read()
+
+    key = get_cache_key(source)
+
+    parsed_line_list = read_cache(key, cache_dir)
+    if parsed_line_list is None:
+        parsed_line_list = V.parse_varithon_string(source, filepath)
+        write_cache(key, parsed_line_list, cache_dir)
+
+    return parsed_line_list
+
+
+def clear_cache(cache_dir=None):
+    """ Removes every entry from the cache.
+
+        :param cache_dir a path to the cache directory, see get_cache_dir
+        :return the number of entries removed """
+
+    directory = get_cache_dir(cache_dir)
+    if not os.path.isdir(directory):
+        return 0
+
+    removed = 0
+    for name in os.listdir(directory):
+        if name.endswith(CACHE_EXTENSION):
+            os.remove(os.path.join(directory, name))
+            removed += 1
+
+    return removed
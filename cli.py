@@ -0,0 +1,302 @@
+# The command line interface of Varithon, run with 'python -m varithon'. Every given template, or every .vy file
+# within a given directory, is compiled into many variations which are written out in the chosen format. While
+# running, the throughput is reported live, and once finished, a breakdown of where the time was spent.
+
+import argparse
+import os
+import sys
+import time
+
+import cache
+import varithon as V
+from dedup import Deduplicator, DigestSet, BloomFilter
+from errors import SyntaxException, VarithonSyntaxException
+from parallel import CompilePool
+from writers import WRITERS, DEFAULT_SHARD_BYTES
+
+# the extension of Varithon files, used to find templates within directories
+TEMPLATE_EXTENSION = ".vy"
+
+# the default number of seconds between each live report of the throughput
+PROGRESS_INTERVAL = 1.0
+
+# the default number of preview variations regenerated whenever a watched template changes
+PREVIEW_COUNT = 5
+
+# the default number of seconds between each check for changed templates when watching
+POLL_INTERVAL = 0.2
+
+# the phases of a run which are timed, in the order they are reported
+PHASES = ["parse", "compile", "dedup", "write"]
+
+
+def find_templates(paths):
+    """ Finds the templates to compile, directories are searched recursively for .vy files.
+
+        :param paths a list of paths to .vy files and directories
+        :return a list of tuples of the path to each template, and the name its variations are written under """
+
+    templates = []
+    for path in paths:
+        if os.path.isdir(path):
+            found = []
+            for directory, _, filenames in os.walk(path):
+                found.extend([os.path.join(directory, filename) for filename in filenames
+                              if filename.endswith(TEMPLATE_EXTENSION)])
+
+            for template_path in sorted(found):
+                relative_path = os.path.relpath(template_path, path)
+                templates.append((template_path, os.path.splitext(relative_path)[0].replace(os.sep, ".")))
+        elif os.path.isfile(path):
+            templates.append((path, os.path.splitext(os.path.basename(path))[0]))
+        else:
+            raise FileNotFoundError(f"No such template or directory: '{path}'")
+
+    return templates
+
+
+class RunStats(object):
+    """ RunStats times each phase of a run and counts the variations compiled, reporting the throughput while the
+        run goes on. On a terminal the report is rewritten in place, otherwise a new line is written each time. """
+
+    def __init__(self, total, stream=None, interval=PROGRESS_INTERVAL):
+        """ Constructs a RunStats, starting the clock of the run.
+
+            :param total the total number of variations that will be compiled
+            :param stream the stream to report to, sys.stderr if this is None
+            :param interval the number of seconds between each live report, or None to never report live """
+
+        self.total = total
+        self.stream = stream if stream is not None else sys.stderr
+        self.interval = interval
+        self.live = hasattr(self.stream, "isatty") and self.stream.isatty()
+
+        self.phase_seconds = dict.fromkeys(PHASES, 0.0)
+        self.variant_count = 0
+        self.byte_count = 0
+
+        self.start_time = time.perf_counter()
+        self.report_time = self.start_time
+        self.report_variant_count = 0
+        self.report_byte_count = 0
+
+    def add_time(self, phase, seconds):
+        """ Adds time spent on a phase of the run.
+
+            :param phase the name of the phase, one of PHASES
+            :param seconds the number of seconds spent """
+
+        self.phase_seconds[phase] += seconds
+
+    def add_variant(self, byte_count):
+        """ Counts a compiled variation, reporting the throughput if the report interval has passed.
+
+            :param byte_count the size of the compiled python source of the variation in bytes """
+
+        self.variant_count += 1
+        self.byte_count += byte_count
+
+        if self.interval is not None and time.perf_counter() - self.report_time >= self.interval:
+            self.report_progress()
+
+    def report_progress(self):
+        """ Reports the number of variations compiled so far, and the throughput since the last report. """
+
+        now = time.perf_counter()
+        seconds = max(now - self.report_time, 1e-9)
+
+        variants_per_second = (self.variant_count - self.report_variant_count) / seconds
+        bytes_per_second = (self.byte_count - self.report_byte_count) / seconds
+
+        report = (f"{self.variant_count}/{self.total} variations  {variants_per_second:,.1f} variations/s  "
+                  f"{format_bytes(bytes_per_second)}/s")
+        if self.live:
+            self.stream.write("\r" + report.ljust(79))
+        else:
+            self.stream.write(report + "\n")
+        self.stream.flush()
+
+        self.report_time = now
+        self.report_variant_count = self.variant_count
+        self.report_byte_count = self.byte_count
+
+    def get_summary(self, template_count):
+        """ Gets the final report of the run, its overall throughput and the time spent on each phase.
+
+            :param template_count the number of templates compiled
+            :return the report as a string """
+
+        seconds = max(time.perf_counter() - self.start_time, 1e-9)
+
+        lines = [f"Compiled {self.variant_count} variations of {template_count} templates in {seconds:.2f}s "
+                 f"({self.variant_count / seconds:,.1f} variations/s, {format_bytes(self.byte_count / seconds)}/s)"]
+        for phase in PHASES:
+            phase_seconds = self.phase_seconds[phase]
+            lines.append(f"    {phase:<10} {phase_seconds:>9.3f}s {phase_seconds / seconds:>7.1%}")
+
+        return "\n".join(lines)
+
+
+def format_bytes(byte_count):
+    """ Formats a number of bytes in the largest unit it is at least one of.
+
+        :param byte_count the number of bytes
+        :return the number of bytes as a string, such as '1.5 MB' """
+
+    for unit in ["B", "KB", "MB"]:
+        if byte_count < 1000:
+            return f"{byte_count:.1f} {unit}"
+        byte_count /= 1000
+
+    return f"{byte_count:.1f} GB"
+
+
+def compile_template(pool, name, args, stats, deduplicator):
+    """ Compiles the variations of a single template and writes them out. Possibly a SyntaxException is thrown if
+        the template is unable to be compiled.
+
+        :param pool the parallel.CompilePool of the run, which holds the template
+        :param name the name of the template within the pool, which the variations are written under
+        :param args the parsed command line arguments
+        :param stats the RunStats of the run
+        :param deduplicator the Deduplicator of the run, or None to write every variation """
+
+    writer_class = WRITERS[args.format]
+
+    with writer_class(args.out, name, args.shard_size) as writer:
+        if args.lazy and pool.pool is None and deduplicator is None:
+            # each variation is written as it is compiled, so none is ever held as a whole, which is timed as compiling
+            lazy_variants = pool.iter_lazy_variants(name, args.count, args.seed, args.fast_random)
+            for index, chunks in enumerate(lazy_variants):
+                start = time.perf_counter()
+                byte_count = writer.write_chunks(name, index, args.seed, chunks, lazy=True)
+                stats.add_time("compile", time.perf_counter() - start)
+                stats.add_variant(byte_count)
+        else:
+            variants = iter(pool.compile(name, args.count, args.seed, fast_random=args.fast_random,
+                                         emit=writer_class.emit, lazy=args.lazy))
+            for index in range(args.count):
+                start = time.perf_counter()
+                source = next(variants)
+                stats.add_time("compile", time.perf_counter() - start)
+                stats.add_variant(len(source.encode()) if isinstance(source, str) else len(source))
+
+                compiled = time.perf_counter()
+
+                if deduplicator is not None:
+                    is_new = deduplicator.is_new(source)
+                    start, compiled = compiled, time.perf_counter()
+                    stats.add_time("dedup", compiled - start)
+                    if not is_new:
+                        continue
+
+                writer.write(name, index, args.seed, source, args.lazy)
+                stats.add_time("write", time.perf_counter() - compiled)
+
+        start = time.perf_counter()     # closing the writer flushes the last records, which is timed as writing
+    stats.add_time("write", time.perf_counter() - start)
+
+
+def get_parser():
+    """ Gets the parser of the command line arguments.
+
+        :return an argparse.ArgumentParser """
+
+    parser = argparse.ArgumentParser(prog="python -m varithon",
+                                     description="Compiles .vy templates into many python variations.")
+    parser.add_argument("templates", nargs="+", help="the .vy files, or directories of .vy files, to compile")
+    parser.add_argument("--count", type=int, default=5, help="the number of variations to compile per template")
+    parser.add_argument("--jobs", type=int, default=None, help="the number of worker processes, defaults to the CPU count")
+    parser.add_argument("--seed", type=int, default=0, help="the seed of the run")
+    parser.add_argument("--out", default="compiled", help="the directory to write the variations to")
+    parser.add_argument("--format", choices=sorted(WRITERS), default="py", help="the output format of the variations")
+    parser.add_argument("--shard-size", type=int, default=DEFAULT_SHARD_BYTES, help="the size in bytes of each shard")
+    parser.add_argument("--dedup", choices=["none", "exact", "bloom"], default="none",
+                        help="drop repeated variations, exactly or with a Bloom filter")
+    parser.add_argument("--fast-random", action="store_true",
+                        help="make integers and choices from single random floats, which is faster, variations "
+                             "must be re-created with this setting too")
+    parser.add_argument("--lazy", action="store_true",
+                        help="collapse nested collections depth first, so memory grows with how deeply they nest "
+                             "rather than with the size of each variation, with one job each variation is streamed "
+                             "into its file, variations must be re-created with this setting too")
+    parser.add_argument("--no-cache", action="store_true", help="always parse templates, rather than using the cache")
+    parser.add_argument("--progress-interval", type=float, default=PROGRESS_INTERVAL,
+                        help="the number of seconds between each live report of the throughput")
+    parser.add_argument("--quiet", action="store_true", help="report nothing but errors")
+    parser.add_argument("--watch", action="store_true",
+                        help="regenerate previews whenever a template changes, running in full only on demand")
+    parser.add_argument("--preview-count", type=int, default=PREVIEW_COUNT,
+                        help="the number of previews of each changed template")
+    parser.add_argument("--preview-out", default=None,
+                        help="the directory to write the previews to, defaults to a 'preview' directory within --out")
+    parser.add_argument("--poll-interval", type=float, default=POLL_INTERVAL,
+                        help="the number of seconds between each check for changed templates")
+
+    return parser
+
+
+def main(argv=None):
+    """ Runs the command line interface.
+
+        :param argv a list of the command line arguments, sys.argv is used if this is None
+        :return the exit status, 0 on success and 1 if a template could not be found, parsed, or compiled """
+
+    args = get_parser().parse_args(argv)
+
+    if args.watch:
+        from watch import watch_templates
+        return watch_templates(args)
+
+    try:
+        templates = find_templates(args.templates)
+    except FileNotFoundError as e:
+        print(e, file=sys.stderr)
+        return 1
+
+    # the variations of a template are written under its name, so two templates of the same name would share files
+    paths = {}
+    for path, name in templates:
+        if name in paths:
+            print(f"Two templates are both named '{name}': '{paths[name]}' and '{path}'", file=sys.stderr)
+            return 1
+        paths[name] = path
+
+    stats = RunStats(args.count * len(templates), interval=None if args.quiet else args.progress_interval)
+
+    deduplicator = None
+    if args.dedup != "none":
+        deduplicator = Deduplicator(DigestSet() if args.dedup == "exact" else BloomFilter(max(stats.total, 1)))
+
+    parsed_templates = {}
+    for path, name in templates:
+        start = time.perf_counter()
+        try:
+            parsed_templates[name] = V.parse_varithon_file(path) if args.no_cache else cache.load_varithon_file(path)
+        except VarithonSyntaxException as e:
+            print(e, file=sys.stderr)
+            return 1
+        stats.add_time("parse", time.perf_counter() - start)
+
+    # every template is compiled by the same pool, so its workers are only started once
+    with CompilePool(parsed_templates, args.jobs) as pool:
+        for name in parsed_templates:
+            try:
+                compile_template(pool, name, args, stats, deduplicator)
+            except SyntaxException as e:
+                print(f"{name}: {e}", file=sys.stderr)
+                return 1
+
+    if not args.quiet:
+        if stats.live:
+            print(file=stats.stream)    # end the line rewritten by the live reports
+        print(stats.get_summary(len(templates)), file=stats.stream)
+        if deduplicator is not None:
+            print(f"Dropped {deduplicator.duplicate_count} of {deduplicator.total_count} variations as duplicates "
+                  f"({deduplicator.get_duplicate_rate():.1%})", file=stats.stream)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,9 +1,9 @@
-import random
-
-from commands.command import Command
+from commands.command import Command, Collapsed, DeferredLines, collapsed_arena, LAZY_EXPANSION, STREAMED_LITERAL
 from commands.var import Var
 from commands.get import Get
+from commands.list_literal import ListLiteral, StreamedListLiteral
 from errors import *
+from names import allocate_varithon_name, release_varithon_name
 from utils import *
 
 
@@ -21,6 +21,8 @@ class Collection(Command):
                 is a Command, it will be re-collapsed each time it is executed
         """
 
+    __slots__ = ("flag",)
+
     def __init__(self, tokens):
         super().__init__(tokens)
 
@@ -35,57 +37,162 @@ class Collection(Command):
         else:
             self.flag = ""
 
-    def collapse(self, varithon_state, python_state, context):
+    def collapse(self, varithon_state, python_state, context, rng):
         """ 'Collapses' the internal state of the command. I.e., forces it to decide exactly what it's
-            behaviour will be. This should also completely reset the command, any previous collapses
-            of this command should have no effect on future collapses.
+            behaviour will be. The command itself is left untouched, so any previous collapses
+            of this command have no effect on future collapses.
 
             :param varithon_state a dictionary containing the current state of varithon memory for this
                 compilation, contains information such as variable name associations
             :param python_state a set containing python variable names in the current scope
             :param context the line this command is contained within, this is a list containing
-                strings and Command objects """
-        super().collapse(varithon_state, python_state, context)
-
-        choice = random.random()
-
-        if choice < 0.2:    # build list using append
-            collection = self.get_collection(varithon_state, python_state, context)
+                strings and Command objects
+            :param rng the random.Random instance of this compilation, all random decisions are drawn from it
+            :return a Collapsed object holding the pre-lines, result, and post-lines of this collapse """
+        collapsed = super().collapse(varithon_state, python_state, context, rng)
+
+        choice = rng.random()
+
+        # a collection within a streamed literal cannot add lines, as the line holding it is already being written
+        append = choice < 0.2 and STREAMED_LITERAL not in varithon_state
+
+        if append and self.flag == "b" and LAZY_EXPANSION in varithon_state:
+            # each entry is only collapsed once the lines before its append have been written
+            var_name = allocate_varithon_name(varithon_state, rng)
+
+            indentation = get_indentation(context)
+            get_var = Get([var_name])
+
+            collapsed.pre_lines.append([indentation, Var([var_name]), " = []\n"])
+            collapsed.result = get_var
+
+            collapsed.post_lines.append(DeferredLines(self.iter_append_lines(
+                collapsed.tokens[2], self.get_size(collapsed), indentation, get_var,
+                varithon_state, python_state, context, rng)))
+        elif append:    # build list using append
+            collection = self.get_collection(collapsed, varithon_state, python_state, context, rng)
+
+            var_name = allocate_varithon_name(varithon_state, rng)
+
+            indentation = get_indentation(context)
+            get_var = Get([var_name])   # a single Get is shared by every line, as commands are never modified
+
+            collapsed.pre_lines.append([indentation, Var([var_name]), " = []\n"])
+            collapsed.result = get_var
+
+            collapsed.post_lines.extend([[indentation, get_var, ".append(", item, ")\n"] for item in collection])
+        elif self.flag == "b" and not isinstance(self.tokens[2], Command):
+            # a repeated string is written out as it is emitted, rather than being built in memory
+            size = self.get_size(collapsed)
+            collapsed.result = RepeatedListLiteral(collapsed.tokens[2], size, rng) if size >= 1 else "[]"
+        elif self.flag == "b" and LAZY_EXPANSION in varithon_state and not uses_varithon_state(self.tokens[2]):
+            # each entry after the first is only collapsed as the literal is written
+            size = self.get_size(collapsed)
+            if size >= 1:
+                collapsed.result = StreamedListLiteral(collapsed.add_token_lines(collapsed.tokens[2]), self.tokens[2],
+                                                       size, varithon_state, python_state, context, rng)
+            else:
+                collapsed.result = "[]"
+        else:
+            collection = self.get_collection(collapsed, varithon_state, python_state, context, rng)
 
-            var_name = rand_v_name()
+            if any(isinstance(item, Command) for item in collection):
+                # entries that are still to be collapsed can only be written into the literal afterwards
+                collapsed.result = ListLiteral(collection)
+            else:
+                collapsed.result = get_list_literal_string(collection, rng)
 
-            self.pre_lines.append([get_indentation(context), Var([var_name]), " = []\n"])
-            self.result = Get([var_name])
+        return collapsed
 
-            for item in collection:
-                self.post_lines.append([get_indentation(context), Get([var_name]), ".append(", item, ")\n"])
-        else:
-            self.result = get_list_literal_string(self.get_collection(varithon_state, python_state, context)) # TODO: fix by adding new command that converts its arguments to a list literal string
-
-    def get_collection(self, varithon_state, python_state, context):
-        """ Gets a list of tokens representing the output of this collection command.
+    def get_collection(self, collapsed, varithon_state, python_state, context, rng):
+        """ Gets a list of tokens representing the output of this collection command. When building
+            from a Command, every entry after the first is collapsed again, so each entry is independent.
 
+            :param collapsed the Collapsed object of the current collapse of this command, the pre-lines and
+                post-lines of each entry are added to it
             :param varithon_state a dictionary containing the current state of varithon memory for this
                 compilation, contains information such as variable name associations
             :param python_state a set containing python variable names in the current scope
             :param context the line this command is contained within, this is a list containing
                 strings and Command objects
+            :param rng the random.Random instance of this compilation, all random decisions are drawn from it
             :return a list of tokens representing the output of this collection command"""
         collection = []
 
         if self.flag == "b":
-            try:
-                size = int(self.tokens[1])
+            size = self.get_size(collapsed)
 
-                if size >= 1:
-                    collection.append(self.add_token_lines(self.tokens[2]))
+            if size >= 1:
+                collection.append(collapsed.add_token_lines(collapsed.tokens[2]))
 
+            element = self.tokens[2]
+            if isinstance(element, Command):
                 for i in range(1, size):
-                    collection.append(self.tokens[2])
-            except ValueError as e:
-                raise SyntaxException(f"Could not convert size parameter to integer.")
+                    collection.append(collapsed.add_token_lines(
+                        element.collapse(varithon_state, python_state, context, rng)))
+            else:
+                collection.extend([element] * (size - 1))
         else:
-            for item in self.tokens:
-                collection.append(self.add_token_lines(item))
+            for item in collapsed.tokens:
+                collection.append(collapsed.add_token_lines(item))
 
         return collection
+
+    def iter_append_lines(self, first, size, indentation, get_var, varithon_state, python_state, context, rng):
+        """ Gets the lines appending each entry of a collection built with the -b flag, when lines are expanded
+            lazily. Each entry is collapsed only once the lines before it have been written, and its pre-lines
+            and post-lines are written just before and just after its own append, so only one entry is held at
+            once however large the collection is. Nothing refers to the list after its last append, so its names
+            are then released, and the names of the lists built within a collection are never all held at once.
+
+            :param first the first entry, already collapsed along with this command
+            :param size the number of entries
+            :param indentation the indentation of each line
+            :param get_var the Get command of the list being built
+            :param varithon_state a dictionary containing the current state of varithon memory for this
+                compilation, contains information such as variable name associations
+            :param python_state a set containing python variable names in the current scope
+            :param context the line this command is contained within, this is a list containing
+                strings and Command objects
+            :param rng the random.Random instance of this compilation, all random decisions are drawn from it
+            :return a generator yielding each line """
+        element = self.tokens[2]
+
+        for i in range(size):
+            item = first
+            if i > 0 and isinstance(element, Command):
+                item = element.collapse(varithon_state, python_state, context, rng)
+
+            if isinstance(item, Collapsed):
+                yield from item.get_pre_lines()
+                yield [indentation, get_var, ".append(", item.get_result(), ")\n"]
+                yield from item.get_post_lines()
+
+                collapsed_arena.release(item)
+            else:
+                yield [indentation, get_var, ".append(", item, ")\n"]
+
+        release_varithon_name(get_var.varithon_name, varithon_state, python_state)
+
+    def get_size(self, collapsed):
+        """ Gets the number of entries of this collection command when building with the -b flag.
+
+            :param collapsed the Collapsed object of the current collapse of this command
+            :return the number of entries as an integer """
+        try:
+            return int(collapsed.tokens[1])
+        except ValueError as e:
+            raise SyntaxException(f"Could not convert size parameter to integer.")
+
+
+def uses_varithon_state(token):
+    """ Checks whether a token is, or contains, a Var or Get command, whose result depends on when it is collapsed
+        relative to the rest of its line, so it cannot be collapsed as it is written.
+
+        :param token a token of a command, either a string or Command object
+        :return True if the token contains a Var or Get command, otherwise False """
+
+    if isinstance(token, (Var, Get)):
+        return True
+
+    return isinstance(token, Command) and any(uses_varithon_state(item) for item in token.tokens)
@@ -1,28 +1,16 @@
+class Collapsed(object):
+    """ Collapsed holds the outcome of collapsing a single Command for a single compilation. The parsed
+        Command objects are never modified by a collapse, so one parsed file can be compiled any number
+        of times, with every compilation receiving its own Collapsed objects. """
 
-class Command(object):
-    def __init__(self, tokens):
+    __slots__ = ("pre_lines", "result", "post_lines", "tokens")
+
+    def __init__(self, tokens=None):
         self.pre_lines = []
         self.result = ""
         self.post_lines = []
 
-        self.tokens = tokens
-        self.sub_commands = [x for x in self.tokens if isinstance(x, Command)]
-
-    def collapse(self, varithon_state, python_state, context):
-        """ 'Collapses' the internal state of the command. I.e., forces it to decide exactly what it's
-            behaviour will be. This should also completely reset the command, any previous collapses
-            of this command should have no effect on future collapses.
-
-            :param varithon_state a dictionary containing the current state of varithon memory for this
-                compilation, contains information such as variable name associations
-            :param python_state a set containing python variable names in the current scope
-            :param context the line this command is contained within, this is a list containing
-                strings and Command objects """
-
-        self.clear()
-
-        for com in self.sub_commands:
-            com.collapse(varithon_state, python_state, context)
+        self.tokens = tokens if tokens is not None else []
 
     def get_pre_lines(self):
         """ Gets a list of lists, each interior list representing a single block of code that must be
@@ -78,25 +66,128 @@ class Command(object):
 
         return float(self.result)
 
-    def clear(self):
-        """ Clears the internal memory for these commands pre-lines, result, and post-lines. """
-
-        self.pre_lines = []
-        self.result = ""
-        self.post_lines = []
-
     def add_token_lines(self, token):
         """ Adds the given token's pre-lines and post-lines to these Commands pre-lines and post-lines,
-            merely returns the token if it is just a string and not a Command object
+            merely returns the token if it is just a string and not a Collapsed object. A Collapsed token is
+            given back to the arena afterwards, so it must not be used again
 
             :param token the token to add to the result of this command,
-                can be a string or Command object
+                can be a string or Collapsed object
             :return a string representation of the token"""
 
-        if isinstance(token, Command):
+        if isinstance(token, Collapsed):
             self.pre_lines.extend(token.get_pre_lines())
-            self.post_lines = token.get_post_lines() + self.post_lines
-            return token.get_result()
+            self.post_lines[0:0] = token.get_post_lines()
+            result = token.get_result()
+
+            collapsed_arena.release(token)
+            return result
 
         return token
 
+
+class DeferredLines(object):
+    """ DeferredLines stands in for any number of lines within the post-lines of a Collapsed object when lines are
+        expanded lazily, see V.iter_collapsed_lines. Its lines are only produced, and the commands within them
+        only collapsed, once every line before it has been written, so they are never all held at once. """
+
+    __slots__ = ("lines",)
+
+    def __init__(self, lines):
+        """ Constructs a DeferredLines.
+
+            :param lines an iterator yielding each line, it is only iterated once """
+
+        self.lines = lines
+
+    def __iter__(self):
+        return iter(self.lines)
+
+
+class CollapsedArena(object):
+    """ CollapsedArena hands out Collapsed objects, and takes back each one once its pre-lines, result, and
+        post-lines have been taken out of it, so that later collapses, including those of later compilations,
+        reuse it rather than allocating a new one. """
+
+    __slots__ = ("free", "max_free")
+
+    def __init__(self, max_free=4096):
+        """ Constructs an empty CollapsedArena.
+
+            :param max_free the maximum number of Collapsed objects kept for reuse, so a single very large
+                compilation does not hold on to its memory forever """
+
+        self.free = []
+        self.max_free = max_free
+
+    def new(self, tokens):
+        """ Gets an empty Collapsed object.
+
+            :param tokens the tokens of the Collapsed object
+            :return a Collapsed object with no pre-lines, post-lines or result """
+
+        if len(self.free) == 0:
+            return Collapsed(tokens)
+
+        collapsed = self.free.pop()
+        collapsed.tokens = tokens
+        return collapsed
+
+    def release(self, collapsed):
+        """ Takes back a Collapsed object once its pre-lines, result, and post-lines have been taken out of it,
+            it must no longer be used. Releasing an object a second time has no effect.
+
+            :param collapsed the Collapsed object to take back """
+
+        if collapsed.tokens is None or len(self.free) >= self.max_free:
+            return
+
+        collapsed.pre_lines.clear()
+        collapsed.result = ""
+        collapsed.post_lines.clear()
+        collapsed.tokens = None
+        self.free.append(collapsed)
+
+
+# the arena every Collapsed object is taken from
+collapsed_arena = CollapsedArena()
+
+# the key within varithon_state which is set when lines are expanded lazily, see V.iter_collapsed_lines, it is not
+# a string so it can never be taken by a Varithon variable
+LAZY_EXPANSION = object()
+
+# the key within varithon_state which is set while the entries of a StreamedListLiteral are collapsed, as the line
+# holding the literal is already being written, no lines can be added before it
+STREAMED_LITERAL = object()
+
+
+class Command(object):
+    """ Command is the base of every node of a parsed .vy file. Commands are immutable once constructed, so that
+        a single parsed file can be shared by any number of compilations, and hold only what was parsed, every
+        decision made by a compilation is held in the Collapsed objects it returns. """
+
+    __slots__ = ("tokens", "sub_commands")
+
+    def __init__(self, tokens):
+        self.tokens = tuple(tokens)
+        self.sub_commands = tuple([x for x in self.tokens if isinstance(x, Command)])
+
+    def collapse(self, varithon_state, python_state, context, rng):
+        """ 'Collapses' the internal state of the command. I.e., forces it to decide exactly what it's
+            behaviour will be. The command itself is left untouched, so any previous collapses
+            of this command have no effect on future collapses.
+
+            :param varithon_state a dictionary containing the current state of varithon memory for this
+                compilation, contains information such as variable name associations
+            :param python_state a set containing python variable names in the current scope
+            :param context the line this command is contained within, this is a list containing
+                strings and Command objects
+            :param rng the random.Random instance of this compilation, all random decisions are drawn from it
+            :return a Collapsed object holding the pre-lines, result, and post-lines of this collapse,
+                its tokens are this command's tokens with every sub-command replaced by its own collapse """
+
+        if len(self.sub_commands) == 0:
+            return collapsed_arena.new(self.tokens)
+
+        return collapsed_arena.new([x.collapse(varithon_state, python_state, context, rng)
+                                    if isinstance(x, Command) else x for x in self.tokens])
@@ -12,6 +12,8 @@ class Get(Command):
 
         Get takes no additional parameters."""
 
+    __slots__ = ("varithon_name",)
+
     def __init__(self, tokens):
         super().__init__(tokens)
 
@@ -20,19 +22,23 @@ class Get(Command):
 
         self.varithon_name = tokens[0]
 
-    def collapse(self, varithon_state, python_state, context):
+    def collapse(self, varithon_state, python_state, context, rng):
         """ 'Collapses' the internal state of the command. I.e., forces it to decide exactly what it's
-            behaviour will be. This should also completely reset the command, any previous collapses
-            of this command should have no effect on future collapses.
+            behaviour will be. The command itself is left untouched, so any previous collapses
+            of this command have no effect on future collapses.
 
             :param varithon_state a dictionary containing the current state of varithon memory for this
                 compilation, contains information such as variable name associations
             :param python_state a set containing python variable names in the current scope
             :param context the line this command is contained within, this is a list containing
-                strings and Command objects """
-        super().collapse(varithon_state, python_state, context)
+                strings and Command objects
+            :param rng the random.Random instance of this compilation, all random decisions are drawn from it
+            :return a Collapsed object holding the pre-lines, result, and post-lines of this collapse """
+        collapsed = super().collapse(varithon_state, python_state, context, rng)
 
         if self.varithon_name not in varithon_state:
             raise SyntaxException(f"Varithon variable '{self.varithon_name}' not found.")
 
-        self.result = self.add_token_lines(varithon_state[self.varithon_name])
+        collapsed.result = collapsed.add_token_lines(varithon_state[self.varithon_name])
+        return collapsed
+
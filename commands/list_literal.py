@@ -0,0 +1,98 @@
+from commands.command import Command, collapsed_arena, STREAMED_LITERAL
+from utils import *
+
+
+class ListLiteral(Command):
+    """ ListLiteral is an internal command which converts its tokens into a single list literal string. It is
+        created by Collection when some entries of a list literal are themselves Commands which are still to be
+        collapsed, so the literal can only be written once every entry has been decided.
+
+        ListLiteral cannot be used directly within a .vy file. """
+
+    __slots__ = ()
+
+    def collapse(self, varithon_state, python_state, context, rng):
+        """ 'Collapses' the internal state of the command. I.e., forces it to decide exactly what it's
+            behaviour will be. The command itself is left untouched, so any previous collapses
+            of this command have no effect on future collapses.
+
+            :param varithon_state a dictionary containing the current state of varithon memory for this
+                compilation, contains information such as variable name associations
+            :param python_state a set containing python variable names in the current scope
+            :param context the line this command is contained within, this is a list containing
+                strings and Command objects
+            :param rng the random.Random instance of this compilation, all random decisions are drawn from it
+            :return a Collapsed object holding the pre-lines, result, and post-lines of this collapse """
+        collapsed = super().collapse(varithon_state, python_state, context, rng)
+
+        collapsed.result = get_list_literal_string([collapsed.add_token_lines(item) for item in collapsed.tokens], rng)
+        return collapsed
+
+
+class StreamedListLiteral(StreamedToken):
+    """ StreamedListLiteral is a list literal of a Command element repeated many times, created by Collection when
+        lines are expanded lazily, see V.iter_collapsed_lines. Each entry after the first is only collapsed as it
+        is written, so its memory grows with how deeply its entries are nested rather than with its size.
+
+        Unlike other streamed tokens, the random decisions of its entries are made as it is written, so it must be
+        written exactly once, before any line after it is collapsed. """
+
+    __slots__ = ("first", "element", "size", "spacing", "concat_positions",
+                 "varithon_state", "python_state", "context", "rng")
+
+    def __init__(self, first, element, size, varithon_state, python_state, context, rng):
+        """ Constructs a StreamedListLiteral, making the random decisions of the literal but not of its entries.
+
+            :param first the first entry as a token, already collapsed along with the collection
+            :param element the Command collapsed for every other entry, it must not contain a Var or Get command
+            :param size the number of entries
+            :param varithon_state a dictionary containing the current state of varithon memory for this
+                compilation, contains information such as variable name associations
+            :param python_state a set containing python variable names in the current scope
+            :param context the line the collection is contained within, this is a list containing
+                strings and Command objects
+            :param rng the random.Random instance of this compilation, all random decisions are drawn from it """
+
+        self.first = first
+        self.element = element
+        self.size = size
+        self.varithon_state = varithon_state
+        self.python_state = python_state
+        self.context = context
+        self.rng = rng
+
+        self.spacing = get_list_literal_spacing(rng)
+        self.concat_positions = get_concat_positions(size, rng)
+
+    def iter_chunks(self):
+        return iter_list_literal_chunks(self.get_entries, self.size, self.spacing, self.concat_positions)
+
+    def get_entries(self, start, end):
+        """ Collapses the entries between the given indices. While they are collapsed, STREAMED_LITERAL is set
+            within the varithon state, so that collections within them are written as literals too.
+
+            :param start the index of the first entry
+            :param end the index after the last entry
+            :return a list of the string representations, or StreamedTokens, of the entries """
+
+        streaming = STREAMED_LITERAL in self.varithon_state
+        self.varithon_state[STREAMED_LITERAL] = True
+
+        try:
+            return [self.resolve(self.first if i == 0 else self.element) for i in range(start, end)]
+        finally:
+            if not streaming:
+                del self.varithon_state[STREAMED_LITERAL]
+
+    def resolve(self, token):
+        """ Collapses a token until it is no longer a Command.
+
+            :param token the token of an entry, a string, StreamedToken or Command object
+            :return the string representation of the token, or a StreamedToken """
+
+        while isinstance(token, Command):
+            collapsed = token.collapse(self.varithon_state, self.python_state, self.context, self.rng)
+            token = collapsed.get_result()
+            collapsed_arena.release(collapsed)
+
+        return token if isinstance(token, StreamedToken) else str(token)
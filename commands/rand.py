@@ -1,5 +1,3 @@
-import random
-
 from commands.command import Command
 from errors import *
 
@@ -17,6 +15,8 @@ class Rand(Command):
             -f      : for 'float', will output a float between lower-inclusive and upper-exclusive
         """
 
+    __slots__ = ("flag",)
+
     def __init__(self, tokens):
         super().__init__(tokens)
 
@@ -31,26 +31,31 @@ class Rand(Command):
             case _:
                 raise SyntaxException(f"Invalid 'rand' command, invalid flag.")
 
-    def collapse(self, varithon_state, python_state, context):
+    def collapse(self, varithon_state, python_state, context, rng):
         """ 'Collapses' the internal state of the command. I.e., forces it to decide exactly what it's
-            behaviour will be. This should also completely reset the command, any previous collapses
-            of this command should have no effect on future collapses.
+            behaviour will be. The command itself is left untouched, so any previous collapses
+            of this command have no effect on future collapses.
 
             :param varithon_state a dictionary containing the current state of varithon memory for this
                 compilation, contains information such as variable name associations
             :param python_state a set containing python variable names in the current scope
             :param context the line this command is contained within, this is a list containing
-                strings and Command objects """
-        super().collapse(varithon_state, python_state, context)
+                strings and Command objects
+            :param rng the random.Random instance of this compilation, all random decisions are drawn from it
+            :return a Collapsed object holding the pre-lines, result, and post-lines of this collapse """
+        collapsed = super().collapse(varithon_state, python_state, context, rng)
 
         try:
             match self.flag:
                 case "i":
-                    self.result = self.add_token_lines(random.randint(int(self.tokens[1]), int(self.tokens[2])))
+                    collapsed.result = collapsed.add_token_lines(rng.randint(int(collapsed.tokens[1]),
+                                                                             int(collapsed.tokens[2])))
                 case "f":
-                    lower = float(self.tokens[1])
-                    upper = float(self.tokens[2])
+                    lower = float(collapsed.tokens[1])
+                    upper = float(collapsed.tokens[2])
 
-                    self.result = self.add_token_lines(lower + (upper - lower) * random.random())
+                    collapsed.result = collapsed.add_token_lines(rng.uniform(lower, upper))
         except ValueError as e:
-            raise SyntaxException("Invalid bounds, could not convert.")
\ No newline at end of file
+            raise SyntaxException("Invalid bounds, could not convert.")
+
+        return collapsed
@@ -1,7 +1,6 @@
-import random
-
 from commands.command import Command
 from errors import *
+from names import allocate_python_name
 
 
 class Var(Command):
@@ -15,41 +14,40 @@ class Var(Command):
 
         Var will look at the surrounding context that the variable is used in, in order to
         generate possibilities for its name. Possible variable names can also be supplied as
-        additional arguments, which will be added to the pool of possibilities for its name. """
+        additional arguments, which will be added to the pool of possibilities for its name.
+        Only names that are not yet taken are chosen, once every possibility is taken a name is
+        generated from the Varithon variable name instead. """
 
-    def __init__(self, tokens):
-        super().__init__(tokens)
+    __slots__ = ("varithon_name",)
 
+    def __init__(self, tokens):
         if len(tokens) < 1:
             raise SyntaxException(f"Invalid 'var' command.")
 
-        self.varithon_name = tokens.pop(0)
+        super().__init__(tokens[1:])    # the remaining tokens are the extra possible Python names
+
+        self.varithon_name = tokens[0]
 
         if self.varithon_name[0].isdigit():
             raise SyntaxException(f"Invalid 'var' command, Varithon variable name cannot start with a digit.")
 
-        self.extra_options = tokens  # first element was removed by the pop
-
-    def collapse(self, varithon_state, python_state, context):
+    def collapse(self, varithon_state, python_state, context, rng):
         """ 'Collapses' the internal state of the command. I.e., forces it to decide exactly what it's
-            behaviour will be. This should also completely reset the command, any previous collapses
-            of this command should have no effect on future collapses.
+            behaviour will be. The command itself is left untouched, so any previous collapses
+            of this command have no effect on future collapses.
 
             :param varithon_state a dictionary containing the current state of varithon memory for this
                 compilation, contains information such as variable name associations
             :param python_state a set containing python variable names in the current scope
             :param context the line this command is contained within, this is a list containing
-                strings and Command objects """
-        super().collapse(varithon_state, python_state, context)
-
-        var_name = None
-        while var_name is None or str(var_name) in python_state:
-            if len(self.extra_options) > 0 and random.random() < 0.5:
-                var_name = random.choice(self.extra_options)
-            else:
-                var_name = random.choice([self.varithon_name, "a_var", "variable", "my_var", "some_var", "new_var",
-                                          random.choice("abcdefghijklmnopqrstuvwxyz"), "temp"])
-        varithon_state[self.varithon_name] = var_name
-        python_state.add(var_name)
-
-        self.result = self.add_token_lines(var_name)
+                strings and Command objects
+            :param rng the random.Random instance of this compilation, all random decisions are drawn from it
+            :return a Collapsed object holding the pre-lines, result, and post-lines of this collapse """
+        collapsed = super().collapse(varithon_state, python_state, context, rng)
+
+        var_name = allocate_python_name(self.varithon_name, collapsed.tokens, python_state, rng)
+
+        # the name is stored as a string, as a Collapsed name is given back to the arena once its lines are added
+        collapsed.result = collapsed.add_token_lines(var_name)
+        varithon_state[self.varithon_name] = collapsed.result
+        return collapsed
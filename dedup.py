@@ -0,0 +1,124 @@
+# Deduplication of compiled variations as they are generated. Many templates have a small space of variations,
+# so a long run compiles the same source many times. Each source is reduced to a short digest, and only the digests
+# are kept, either exactly in a set, or approximately in a Bloom filter for very large runs.
+
+import hashlib
+import math
+
+# the size in bytes of the digest kept for every variation
+DIGEST_SIZE = 16
+
+
+def get_digest(source):
+    """ Gets the digest of a compiled variation.
+
+        :param source the compiled python source of the variation as a string, or an encoding of it as bytes
+        :return the digest as bytes """
+
+    if isinstance(source, str):
+        source = source.encode()
+
+    return hashlib.blake2b(source, digest_size=DIGEST_SIZE).digest()
+
+
+class DigestSet(object):
+    """ DigestSet exactly remembers the digest of every variation added to it. It uses roughly 100 bytes of memory
+        per unique variation. """
+
+    def __init__(self):
+        self.digests = set()
+
+    def add(self, digest):
+        """ Adds a digest to the set.
+
+            :param digest the digest of a variation as bytes
+            :return True if the digest was not already in the set, False otherwise """
+
+        if digest in self.digests:
+            return False
+
+        self.digests.add(digest)
+        return True
+
+
+class BloomFilter(object):
+    """ BloomFilter approximately remembers the digest of every variation added to it, in a fixed amount of memory.
+        A variation that was never added is reported as already seen with a probability of roughly error_rate once
+        capacity variations have been added, a variation that was added is always reported as seen. """
+
+    def __init__(self, capacity, error_rate=0.001):
+        """ Constructs a BloomFilter sized for the given number of variations.
+
+            :param capacity the expected number of unique variations
+            :param error_rate the accepted probability of reporting an unseen variation as seen """
+
+        capacity = max(capacity, 1)
+        self.bit_count = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hash_count = max(1, round(self.bit_count / capacity * math.log(2)))
+        self.bits = bytearray((self.bit_count + 7) // 8)
+
+    def add(self, digest):
+        """ Adds a digest to the filter.
+
+            :param digest the digest of a variation as bytes
+            :return True if the digest was definitely not already in the filter, False otherwise """
+
+        # double hashing, every index is derived from two halves of the digest
+        first = int.from_bytes(digest[:8], "little")
+        second = int.from_bytes(digest[8:], "little") | 1
+
+        is_new = False
+        for i in range(self.hash_count):
+            index = (first + i * second) % self.bit_count
+            byte, bit = index >> 3, 1 << (index & 7)
+            if not self.bits[byte] & bit:
+                self.bits[byte] |= bit
+                is_new = True
+
+        return is_new
+
+
+class Deduplicator(object):
+    """ Deduplicator drops variations which have already been seen, and counts how many were dropped. """
+
+    def __init__(self, seen=None):
+        """ Constructs a Deduplicator.
+
+            :param seen the DigestSet or BloomFilter to remember variations with, a new DigestSet if this is None """
+
+        self.seen = seen if seen is not None else DigestSet()
+        self.total_count = 0
+        self.duplicate_count = 0
+
+    def is_new(self, source):
+        """ Checks whether a variation has not been seen before, and remembers it.
+
+            :param source the compiled python source of the variation as a string
+            :return True if the variation is new, False if it is a duplicate """
+
+        self.total_count += 1
+        if self.seen.add(get_digest(source)):
+            return True
+
+        self.duplicate_count += 1
+        return False
+
+    def filter(self, variants):
+        """ Filters duplicates out of a stream of variations.
+
+            :param variants an iterable of tuples, the last entry of each being the compiled python source
+            :return a generator yielding the tuples of the variations that are new """
+
+        for variant in variants:
+            if self.is_new(variant[-1]):
+                yield variant
+
+    def get_duplicate_rate(self):
+        """ Gets the fraction of the variations seen so far which were duplicates.
+
+            :return the duplicate rate as a float between 0 and 1 """
+
+        if self.total_count == 0:
+            return 0.0
+
+        return self.duplicate_count / self.total_count
@@ -0,0 +1,129 @@
+# Emission of variations as Python tokens rather than only as text. Consumers which tokenize every variation can
+# instead have the variations tokenized by the generating workers, and read the tokens back from a compact binary
+# record in a fraction of the time tokenize takes. The records are written by writers.TokenShardWriter.
+
+import io
+import marshal
+import struct
+import sys
+import tokenize
+import zlib
+
+# the version of the layout of token records, changed whenever the layout changes
+TOKEN_FORMAT = 3
+
+# the first bytes of every token shard, read in place of a record length, which is never near 4GB. The marshal
+# format of the records is only guaranteed to be readable by the python version which wrote them, so the header is
+# followed by the token format and the major and minor python version, and shards written by another are refused
+SHARD_MAGIC = b"VYT\xff"
+SHARD_HEADER = SHARD_MAGIC + struct.pack("<BBB", TOKEN_FORMAT, *sys.version_info[:2])
+
+
+def tokenize_source(source):
+    """ Tokenizes the compiled python source of a variation.
+
+        :param source the compiled python source as a string
+        :return a list of tokenize.TokenInfo, possibly a tokenize.TokenError or IndentationError
+            is thrown if the source is unable to be tokenized """
+
+    return list(tokenize.generate_tokens(io.StringIO(source).readline))
+
+
+def encode_tokens(source, tokens=None):
+    """ Encodes the compiled python source of a variation along with its tokens as a compact binary record. The
+        token types and positions are stored as flat sequences, and the lines of each token are not stored at all,
+        as they are re-created from the source. A variation which is unable to be tokenized, such as one with an
+        unclosed bracket, is still encoded, with the error in place of its tokens.
+
+        :param source the compiled python source as a string
+        :param tokens the tokens of the source, if this is None the source is tokenized
+        :return the record as bytes """
+
+    error = None
+    if tokens is None:
+        try:
+            tokens = tokenize_source(source)
+        except (tokenize.TokenError, SyntaxError) as e:
+            error = f"{type(e).__name__}: {e}"
+            tokens = []
+
+    positions = []
+    for token in tokens:
+        positions.extend(token.start)
+        positions.extend(token.end)
+
+    return zlib.compress(marshal.dumps((TOKEN_FORMAT, source, bytes([token.type for token in tokens]),
+                                        tuple(positions), tuple([token.string for token in tokens]), error)))
+
+
+def decode_tokens(data):
+    """ Decodes a record written by encode_tokens.
+
+        :param data the record as bytes
+        :return a tuple of the compiled python source as a string, and a list of its tokenize.TokenInfo, identical
+            to those given by tokenize_source, or None if the source was unable to be tokenized """
+
+    source, tokens, _ = _decode_tokens(data)
+    return source, tokens
+
+
+def _decode_tokens(data):
+    """ Decodes a record written by encode_tokens, along with the error its source was unable to be tokenized with.
+
+        :param data the record as bytes
+        :return a tuple of the compiled python source as a string, the list of its tokenize.TokenInfo, or None, and
+            the error as a string, or None """
+
+    version, source, types, positions, strings, error = marshal.loads(zlib.decompress(data))
+    if version != TOKEN_FORMAT:
+        raise ValueError(f"Unsupported token record format {version}")
+    if error is not None:
+        return source, None, error
+
+    lines = io.StringIO(source).readlines()     # split exactly as tokenize_source reads them
+    lines.append("")    # the end marker is past the last line
+
+    starts = zip(positions[0::4], positions[1::4])
+    ends = zip(positions[2::4], positions[3::4])
+
+    tokens = []
+    for token_type, string, start, end in zip(types, strings, starts, ends):
+        if token_type == tokenize.NEWLINE and string == "":
+            line = ""   # added by tokenize when the source does not end with a newline
+        elif start[0] == end[0] or token_type == tokenize.NL or token_type == tokenize.NEWLINE:
+            line = lines[start[0] - 1]
+        else:
+            line = "".join(lines[start[0] - 1:end[0]])     # a token spanning lines, such as a triple quoted string
+        tokens.append(tokenize.TokenInfo(token_type, string, start, end, line))
+
+    return source, tokens, None
+
+
+def iter_token_records(path):
+    """ Reads the records of a shard written by writers.TokenShardWriter, one at a time.
+
+        :param path the path to the shard
+        :return a generator yielding a dictionary of the template, index, seed, lazy, source, list of
+            tokenize.TokenInfo, or None, and the error the source was unable to be tokenized with, or None, of each
+            variation, possibly a ValueError is thrown if the shard was written with
+            another token format or python version """
+
+    with open(path, "rb") as f:
+        while True:
+            header = f.read(4)
+            if len(header) < 4:
+                return
+
+            if header == SHARD_MAGIC:     # the start of a shard, possibly one of several concatenated together
+                header += f.read(len(SHARD_HEADER) - len(SHARD_MAGIC))
+                if header != SHARD_HEADER:
+                    version, major, minor = struct.unpack("<BBB", header[len(SHARD_MAGIC):].ljust(3, b"\0"))
+                    raise ValueError(f"Unsupported token shard of format {version} written by python {major}.{minor}, "
+                                     f"expected format {TOKEN_FORMAT} written by python "
+                                     f"{sys.version_info.major}.{sys.version_info.minor}")
+                continue
+
+            template, index, seed, lazy, data = marshal.loads(f.read(struct.unpack("<I", header)[0]))
+            source, tokens, error = _decode_tokens(data)
+            yield {"template": template, "index": index, "seed": seed, "lazy": lazy,
+                   "source": source, "tokens": tokens, "error": error}
@@ -1,30 +1,54 @@
 class SyntaxException(Exception):
-    def __init__(self, message):
+    def __init__(self, message, column=None):
         """ Constructs a SyntaxException given an error message.
 
-            :param message a string giving details about this exception """
+            :param message a string giving details about this exception
+            :param column an integer representing the column within its line the syntax
+                error was found on, None if it is not known """
 
         self.message = message
+        self.column = column
 
     def __str__(self):
         return f"{self.message}"
 
 
 class VarithonSyntaxException(SyntaxException):
-    def __init__(self, message, filepath, line):
-        """ Constructs a VarithonSyntaxException given a filepath, line, and
+    def __init__(self, message, filepath, line, column=None):
+        """ Constructs a VarithonSyntaxException given a filepath, line, column, and
             error message.
 
             :param filepath a string representing a path to the file on which the
                 syntax exception was found
             :param line an integer representing the line number the syntax error
                 was found on
+            :param column an integer representing the column the syntax error was found on,
+                None if it is not known
             :param message a string giving details about this exception """
 
-        super().__init__(message)
+        super().__init__(message, column)
 
         self.filepath = filepath
         self.line = line
 
     def __str__(self):
-        return f"Syntax Error in [{self.filepath}] on line {self.line}: {self.message}"
+        if self.column is None:
+            return f"Syntax Error in [{self.filepath}] on line {self.line}: {self.message}"
+
+        return f"Syntax Error in [{self.filepath}] on line {self.line}, column {self.column}: {self.message}"
+
+
+class VariantSpaceException(Exception):
+    def __init__(self, message, infinite=False):
+        """ Constructs a VariantSpaceException given an error message. It is thrown when the
+            variations of a Varithon file cannot be enumerated, either because there are
+            infinitely many, or because there are more than the given limit.
+
+            :param message a string giving details about this exception
+            :param infinite True if there are infinitely many variations, False otherwise """
+
+        self.message = message
+        self.infinite = infinite
+
+    def __str__(self):
+        return f"{self.message}"
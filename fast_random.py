@@ -0,0 +1,28 @@
+# Faster random decisions for batch generation. random.Random.random is a single call into C, but randint and choice
+# are written in Python on top of random bits, and are several times slower. FastRandom makes each integer and each
+# choice from a single random float instead, so every kind of decision costs about as little as a float does.
+#
+# Random decisions are only a small part of compiling a variation, most of the time is spent collapsing lines, so
+# this saves about 5 to 15% per variation. Drawing the floats for a block of variations in bulk could save little
+# more, as the draws themselves are only about 5% of the time.
+
+import random
+
+
+class FastRandom(random.Random):
+    """ FastRandom is a random.Random whose integers and choices are each made from a single random float. Its
+        floats, and so its uniform, choices, and expovariate draws, are exactly those of random.Random for the same
+        seed, but its integers and choices differ. Each integer or choice between n options is biased by less than
+        n / 2**53, which is far too small to ever be observed. """
+
+    def randint(self, a, b):
+        if b < a:
+            raise ValueError(f"empty range for randint({a}, {b})")
+
+        return a + int(self.random() * (b - a + 1))
+
+    def choice(self, seq):
+        if len(seq) == 0:
+            raise IndexError("Cannot choose from an empty sequence")
+
+        return seq[int(self.random() * len(seq))]
@@ -0,0 +1,102 @@
+# Allocation of python names for Var commands. A Var draws its python name from a few pools of names: the extra
+# options given to it, a small list of common names, and single letters. Only names which are still free within
+# the current compilation are drawn from, and once every pool is used up, a name is generated from the Varithon
+# variable name instead, so allocation never has to retry, and always finishes.
+
+import profiling
+from utils import rand_v_name
+
+# the common names a Var may be given, alongside its own Varithon variable name and a single letter
+COMMON_NAMES = ["a_var", "variable", "my_var", "some_var", "new_var", "temp"]
+
+LETTERS = "abcdefghijklmnopqrstuvwxyz"
+
+# the position of the single letter name within the common names, kept for the distribution of names to match
+# the original list of [<Varithon-variable-name>, a_var, variable, my_var, some_var, new_var, <letter>, temp]
+LETTER_POSITION = 6
+
+# the name generated names are based on, when the Varithon variable name is not a valid python name
+GENERATED_NAME_BASE = "var"
+
+
+def allocate_python_name(varithon_name, extra_options, python_state, rng):
+    """ Allocates a python name that is not yet taken, and adds it to the taken names. Half of the time a name
+        is drawn from the extra options, otherwise it is drawn from the Varithon variable name, the common names,
+        and single letters. A pool with no free names is skipped, and if every pool is used up, a name is
+        generated instead.
+
+        :param varithon_name the Varithon variable name the python name is for
+        :param extra_options a list of extra possible python names, these may be strings or Collapsed objects
+        :param python_state a set containing python variable names in the current scope
+        :param rng the random.Random instance of this compilation, all random decisions are drawn from it
+        :return the allocated python name, one of extra_options or a string """
+
+    free_extra_options = [x for x in extra_options if str(x) not in python_state]
+    free_letters = [x for x in LETTERS if x not in python_state]
+    free_names = [x for x in [varithon_name] + COMMON_NAMES if x not in python_state]
+    if len(free_letters) > 0:
+        free_names.insert(min(LETTER_POSITION, len(free_names)), None)
+
+    if profiling.active_profiler is not None:
+        profiling.active_profiler.record_var_taken_names(
+            len(extra_options) - len(free_extra_options) + len(LETTERS) - len(free_letters)
+            + len(COMMON_NAMES) + 1 - len([x for x in free_names if x is not None]))
+
+    if len(free_extra_options) > 0 and (len(free_names) == 0 or rng.random() < 0.5):
+        python_name = rng.choice(free_extra_options)
+    elif len(free_names) > 0:
+        python_name = rng.choice(free_names)
+        if python_name is None:     # a random single letter name
+            python_name = rng.choice(free_letters)
+    else:
+        python_name = generate_python_name(varithon_name, python_state)
+
+    python_state.add(str(python_name))
+    return python_name
+
+
+def generate_python_name(varithon_name, python_state):
+    """ Generates a python name that is not yet taken, without any randomness. The name is the Varithon variable
+        name followed by a number, which starts at the number of names already taken, so that a free name is
+        almost always found on the first attempt.
+
+        :param varithon_name the Varithon variable name the python name is for
+        :param python_state a set containing python variable names in the current scope
+        :return the generated python name as a string """
+
+    base = varithon_name if varithon_name.isidentifier() else GENERATED_NAME_BASE
+
+    number = len(python_state)
+    while f"{base}_{number}" in python_state:
+        number += 1
+
+    return f"{base}_{number}"
+
+
+def allocate_varithon_name(varithon_state, rng):
+    """ Allocates a random 20 character Varithon variable name that is not yet used within the current
+        compilation. To be used for expanding commands. The name is reserved straight away, by associating it
+        with itself, until a Var command associates it with its python name.
+
+        :param varithon_state a dictionary containing the current state of varithon memory for this compilation
+        :param rng the random.Random instance of this compilation, all random decisions are drawn from it
+        :return a random 20 character Varithon variable name """
+
+    v_name = rand_v_name(rng)
+    while v_name in varithon_state:    # practically never happens, but names must be unique
+        v_name = rand_v_name(rng)
+
+    varithon_state[v_name] = v_name
+    return v_name
+
+
+def release_varithon_name(varithon_name, varithon_state, python_state):
+    """ Releases a Varithon variable name given by allocate_varithon_name, along with the python name a Var
+        associated it with, once no later line refers to it, so both may be allocated again. Otherwise a
+        compilation which expands many commands holds every name it ever allocated until it finishes.
+
+        :param varithon_name the Varithon variable name to release
+        :param varithon_state a dictionary containing the current state of varithon memory for this compilation
+        :param python_state a set containing python variable names in the current scope """
+
+    python_state.discard(str(varithon_state.pop(varithon_name)))
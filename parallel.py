@@ -0,0 +1,219 @@
+# Parallel generation of Varithon variations. The parsed .vy files are sent to each worker process once, and every
+# worker then compiles its share of the variations. Every variation is seeded from the run seed and its own index,
+# so the output does not depend on the number of workers used. A CompilePool shares one pool of workers between
+# many templates, so a run of many small templates only starts its workers once.
+
+import multiprocessing
+import os
+import time
+
+import varithon as V
+from errors import SyntaxException
+
+# the number of variations compiled by a worker per task
+CHUNK_SIZE = 64
+
+_worker_templates = None
+
+
+def compile_range(parsed_line_list, seed, start, stop, fast_random=False, emit=None, lazy=False):
+    """ Compiles the variations with indices start (inclusive) to stop (exclusive) of a run.
+
+        :param parsed_line_list a list of lists, each interior list representing a single line of the Varithon file
+        :param seed an integer seed for the whole run
+        :param start the index of the first variation to compile
+        :param stop the index after the last variation to compile
+        :param fast_random whether to make integers and choices from single random floats, see V.variant_rng
+        :param emit a function applied to the compiled python source of each variation, such as
+            emit.encode_tokens, or None to keep the source
+        :param lazy whether to collapse the lines depth first, see V.iter_collapsed_lines
+        :return a list containing the compiled python source of each variation as a string, or the result of emit """
+
+    variants = V.compile_many(parsed_line_list, stop - start, seed, start, fast_random, lazy)
+    if emit is not None:
+        return [emit(source) for source in variants]
+    return list(variants)
+
+
+def init_worker(templates):
+    """ Stores the parsed .vy files within a worker process, so they are only sent to each worker once. This is the
+        initializer of every pool of worker processes, whether a multiprocessing.Pool or a ProcessPoolExecutor.
+
+        :param templates a dictionary of each template name and its parsed list of lines """
+
+    global _worker_templates
+    _worker_templates = templates
+
+
+def compile_chunk(task):
+    """ Compiles a single chunk of variations within a worker process.
+
+        :param task a tuple of the name of the template, the run seed, the first index, the index after the last of
+            the chunk, whether to make integers and choices from single random floats, the function applied to
+            each variation, and whether to collapse the lines depth first
+        :return a list containing the compiled python source of each variation as a string, or the result of emit """
+
+    name, seed, start, stop, fast_random, emit, lazy = task
+    return compile_range(_worker_templates[name], seed, start, stop, fast_random, emit, lazy)
+
+
+def _compile_timed_chunk(templates, task):
+    """ Compiles a single chunk of variations, timing it and catching the error its template fails to compile with.
+
+        :param templates a dictionary of each template name and its parsed list of lines
+        :param task a tuple of the chunk, see compile_chunk
+        :return a tuple of the list of compiled variations, or None if the chunk was unable to be compiled, the
+            SyntaxException it was unable to be compiled with, or None, and the number of seconds spent """
+
+    name, seed, start, stop, fast_random, emit, lazy = task
+
+    compile_start = time.perf_counter()
+    try:
+        variants = compile_range(templates[name], seed, start, stop, fast_random, emit, lazy)
+    except SyntaxException as e:
+        return None, e, time.perf_counter() - compile_start
+
+    return variants, None, time.perf_counter() - compile_start
+
+
+def compile_timed_chunk(task):
+    """ Compiles a single chunk of variations within a worker process like compile_chunk, but a template which fails
+        to compile does not end the whole run, see _compile_timed_chunk.
+
+        :param task a tuple of the chunk, see compile_chunk
+        :return a tuple of the list of compiled variations, or None, the SyntaxException, or None, and the number of
+            seconds spent """
+
+    return _compile_timed_chunk(_worker_templates, task)
+
+
+class CompilePool(object):
+    """ CompilePool is a pool of worker processes shared by every template of a run. Each template is folded, see
+        V.fold_constants, and sent to every worker once, when the pool is started. """
+
+    def __init__(self, templates, jobs=None):
+        """ Constructs a CompilePool, starting its worker processes.
+
+            :param templates a dictionary of each template name and its parsed list of lines
+            :param jobs the number of worker processes to use, defaults to the number of CPUs, if this is 1 the
+                variations are compiled within the current process """
+
+        self.templates = {name: V.fold_constants(parsed) for name, parsed in templates.items()}
+        self.jobs = jobs if jobs is not None else os.cpu_count() or 1
+
+        self.pool = None
+        if self.jobs > 1:
+            self.pool = multiprocessing.Pool(self.jobs, initializer=init_worker, initargs=(self.templates,))
+
+    def compile(self, name, count, seed=0, chunk_size=CHUNK_SIZE, fast_random=False, start=0, emit=None,
+                lazy=False):
+        """ Compiles many variations of a template of the pool. The variations are yielded in order of their index,
+            and are identical for any number of workers given the same seed.
+
+            :param name the name of the template
+            :param count the number of variations to compile
+            :param seed an integer seed for the whole run
+            :param chunk_size the number of variations compiled by a worker per task
+            :param fast_random whether to make integers and choices from single random floats, see V.variant_rng
+            :param start the index of the first variation to compile
+            :param emit a function applied to the compiled python source of each variation within the workers,
+                such as emit.encode_tokens, or None to keep the source, it must be a module level function so it
+                can be pickled
+            :param lazy whether to collapse the lines depth first, see V.iter_collapsed_lines
+            :return a generator yielding the compiled python source of each variation as a string, or the result
+                of emit """
+
+        tasks = [(name, seed, chunk_start, min(chunk_start + chunk_size, start + count), fast_random, emit, lazy)
+                 for chunk_start in range(start, start + count, chunk_size)]
+
+        if self.pool is None or len(tasks) <= 1:
+            for _, _, chunk_start, chunk_stop, _, _, _ in tasks:
+                yield from compile_range(self.templates[name], seed, chunk_start, chunk_stop, fast_random, emit, lazy)
+            return
+
+        for variants in self.pool.imap(compile_chunk, tasks):
+            yield from variants
+
+    def compile_templates(self, counts, seed=0, chunk_size=CHUNK_SIZE, fast_random=False, emit=None, lazy=False):
+        """ Compiles many variations of several templates of the pool. The chunks of every template are taken in
+            order by the same workers, so the workers are never left idle between templates. A template which fails
+            to compile gives its error in place of the chunks which failed, and the other templates carry on.
+
+            :param counts a dictionary of each template name and the number of variations to compile of it
+            :param seed an integer seed for every template
+            :param chunk_size the number of variations compiled by a worker per task
+            :param fast_random whether to make integers and choices from single random floats, see V.variant_rng
+            :param emit a function applied to the compiled python source of each variation within the workers, see
+                compile
+            :param lazy whether to collapse the lines depth first, see V.iter_collapsed_lines
+            :return a generator yielding a tuple of the template name, the index of the first variation of the
+                chunk, the list of compiled variations, or None if the chunk was unable to be compiled, the
+                SyntaxException it was unable to be compiled with, or None, and the number of seconds spent
+                compiling the chunk, in order of template then index """
+
+        tasks = [(name, seed, chunk_start, min(chunk_start + chunk_size, count), fast_random, emit, lazy)
+                 for name, count in counts.items() for chunk_start in range(0, count, chunk_size)]
+
+        if self.pool is None:
+            results = (_compile_timed_chunk(self.templates, task) for task in tasks)
+        else:
+            results = self.pool.imap(compile_timed_chunk, tasks)
+
+        for (name, _, chunk_start, _, _, _, _), (variants, error, seconds) in zip(tasks, results):
+            yield name, chunk_start, variants, error, seconds
+
+    def iter_lazy_variants(self, name, count, seed=0, fast_random=False, start=0):
+        """ Compiles many variations of a template of the pool with lazy expansion within the current process, each
+            as a generator of the chunks of its source, see V.iter_variant_chunks, so no variation is ever held as a
+            whole. Each generator must be exhausted before the next is taken.
+
+            :param name the name of the template
+            :param count the number of variations to compile
+            :param seed an integer seed for the whole run
+            :param fast_random whether to make integers and choices from single random floats, see V.variant_rng
+            :param start the index of the first variation to compile
+            :return a generator yielding a generator of the chunks of the compiled python source of each variation """
+
+        for index in range(start, start + count):
+            yield V.iter_variant_chunks(self.templates[name], seed, index, fast_random)
+
+    def close(self):
+        """ Stops the worker processes of the pool. """
+
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def compile_parallel(parsed_line_list, count, jobs=None, seed=0, chunk_size=CHUNK_SIZE, fast_random=False, start=0,
+                     emit=None, lazy=False):
+    """ Compiles many variations of a parsed .vy file using a pool of worker processes. The variations are
+        yielded in order of their index, and are identical for any number of workers given the same seed.
+
+        :param parsed_line_list a list of lists, each interior list representing a single line of the Varithon file
+        :param count the number of variations to compile
+        :param jobs the number of worker processes to use, defaults to the number of CPUs, if this is 1 the
+            variations are compiled within the current process
+        :param seed an integer seed for the whole run
+        :param chunk_size the number of variations compiled by a worker per task
+        :param fast_random whether to make integers and choices from single random floats, see V.variant_rng
+        :param start the index of the first variation to compile
+        :param emit a function applied to the compiled python source of each variation within the workers, such as
+            emit.encode_tokens, or None to keep the source, it must be a module level function so it can be pickled
+        :param lazy whether to collapse the lines depth first, see V.iter_collapsed_lines
+        :return a generator yielding the compiled python source of each variation as a string, or the result of
+            emit """
+
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+
+    task_count = (count + chunk_size - 1) // chunk_size
+    with CompilePool({None: parsed_line_list}, min(jobs, task_count)) as pool:
+        yield from pool.compile(None, count, seed, chunk_size, fast_random, start, emit, lazy)
@@ -0,0 +1,248 @@
+# Opt-in instrumentation of compilation. While a Profiler is active, the collapse of every command, and every
+# generated helper name, is timed and counted per command type and per line of the Varithon file, along with the
+# number of expansion passes. Nothing is installed while no Profiler is active, so it costs nothing when unused.
+#
+# Usage:
+#   with Profiler("hello.vy") as profiler:
+#       compile_many(parsed, 1000, seed)
+#   profiler.write_json("profile.json")
+#   pstats.Stats(profiler).sort_stats("cumulative").print_stats()
+
+import json
+import marshal
+import time
+
+# the Profiler that is currently recording, or None if no Profiler is active
+active_profiler = None
+
+
+class CommandStats(object):
+    """ CommandStats holds the measurements of a single command type on a single line of a Varithon file. """
+
+    def __init__(self):
+        self.calls = 0
+        self.primitive_calls = 0
+        self.total_seconds = 0.0
+        self.self_seconds = 0.0
+        self.lines_generated = 0
+
+        # the measurements of this command type per calling command, as lists of calls and total seconds
+        self.callers = {}
+
+    def to_json(self):
+        return {
+            "calls": self.calls,
+            "total_seconds": self.total_seconds,
+            "self_seconds": self.self_seconds,
+            "lines_generated": self.lines_generated,
+        }
+
+
+class Profiler(object):
+    """ Profiler records how long compilation spends within each command. Profilers are started and stopped
+        explicitly, or used as context managers, and only one Profiler may be active at a time.
+
+        Measurements can be exported as JSON with to_json or write_json, or in the format of the standard
+        profiler with dump_stats, which can be read with pstats. Profilers can also be given to pstats.Stats
+        directly. Within those, each command is reported as a function named after the command, at the line
+        of the Varithon file it came from. """
+
+    def __init__(self, filepath="<template>"):
+        """ Constructs a Profiler.
+
+            :param filepath the path of the Varithon file being profiled, used only for reporting """
+
+        self.filepath = filepath
+
+        # the CommandStats of each command type on each line, keyed by a tuple of the line number and command name
+        self.command_stats = {}
+
+        self.variants = 0
+        self.passes = 0
+        self.var_taken_names = 0
+
+        # the line of the Varithon file currently being collapsed, set by collapse_line_list
+        self.line_number = 0
+
+        self.stack = []
+        self.active_counts = {}
+        self.patched = []
+
+    def start(self):
+        """ Starts recording, by instrumenting every command. """
+
+        global active_profiler
+
+        if active_profiler is not None:
+            raise RuntimeError("Another Profiler is already active.")
+
+        # imported here, as the commands themselves import this module
+        import names
+        from commands.var import Var
+        from commands.get import Get
+        from commands.collection import Collection
+        from commands.rand import Rand
+        from commands.list_literal import ListLiteral
+
+        for command_class, name in [(Var, "var"), (Get, "get"), (Collection, "collection"), (Rand, "rand"),
+                                    (ListLiteral, "list_literal")]:
+            self.patch(command_class, "collapse", name)
+        self.patch(names, "rand_v_name", "rand_v_name")
+
+        active_profiler = self
+
+    def stop(self):
+        """ Stops recording, and removes the instrumentation from every command. """
+
+        global active_profiler
+
+        for owner, attribute, original in reversed(self.patched):
+            setattr(owner, attribute, original)
+        self.patched = []
+
+        if active_profiler is self:
+            active_profiler = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def patch(self, owner, attribute, name):
+        """ Replaces a function with a version of it which records its measurements, until stop is called.
+
+            :param owner the class or module the function belongs to
+            :param attribute the name of the function within owner
+            :param name the name the function is reported as """
+
+        original = owner.__dict__[attribute]
+        profiler = self
+
+        def instrumented(*args, **kwargs):
+            return profiler.call(name, original, args, kwargs)
+
+        self.patched.append((owner, attribute, original))
+        setattr(owner, attribute, instrumented)
+
+    def call(self, name, function, args, kwargs):
+        """ Calls an instrumented function, and records its measurements.
+
+            :param name the name the function is reported as
+            :param function the function to call
+            :param args the positional arguments of the call
+            :param kwargs the keyword arguments of the call
+            :return the result of the call """
+
+        key = (self.line_number, name)
+        caller = self.stack[-1][0] if len(self.stack) > 0 else None
+
+        frame = [key, 0.0]  # the key and the time spent within instrumented calls made by this call
+        self.stack.append(frame)
+        self.active_counts[key] = self.active_counts.get(key, 0) + 1
+
+        start = time.perf_counter()
+        try:
+            result = function(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+
+            self.stack.pop()
+            self.active_counts[key] -= 1
+            if len(self.stack) > 0:
+                self.stack[-1][1] += elapsed
+
+        stats = self.command_stats.get(key)
+        if stats is None:
+            stats = self.command_stats[key] = CommandStats()
+
+        stats.calls += 1
+        stats.self_seconds += elapsed - frame[1]
+        if self.active_counts[key] == 0:    # time of recursive calls is already counted by the outermost call
+            stats.primitive_calls += 1
+            stats.total_seconds += elapsed
+
+        if hasattr(result, "get_pre_lines"):
+            stats.lines_generated += len(result.get_pre_lines()) + len(result.get_post_lines())
+
+        if caller is not None:
+            caller_stats = stats.callers.setdefault(caller, [0, 0.0])
+            caller_stats[0] += 1
+            caller_stats[1] += elapsed
+
+        return result
+
+    def record_variant(self):
+        """ Records the start of the collapse of a single variation. """
+
+        self.variants += 1
+
+    def record_pass(self):
+        """ Records a single expansion pass of collapse_line_list. """
+
+        self.passes += 1
+
+    def record_var_taken_names(self, count):
+        """ Records the number of names a Var command could not use, as they were already taken.
+
+            :param count the number of taken names """
+
+        self.var_taken_names += count
+
+    def to_json(self):
+        """ Gets every measurement as a dictionary that can be converted to JSON. The measurements of each
+            command type are given both in total, and per line of the Varithon file.
+
+            :return a dictionary of every measurement """
+
+        commands = {}
+        lines = {}
+        for (line_number, name), stats in sorted(self.command_stats.items()):
+            lines.setdefault(str(line_number), {})[name] = stats.to_json()
+
+            total = commands.setdefault(name, {"calls": 0, "total_seconds": 0.0, "self_seconds": 0.0,
+                                               "lines_generated": 0})
+            for measurement, value in stats.to_json().items():
+                total[measurement] += value
+
+        return {
+            "filepath": self.filepath,
+            "variants": self.variants,
+            "passes": self.passes,
+            "var_taken_names": self.var_taken_names,
+            "commands": commands,
+            "lines": lines,
+        }
+
+    def write_json(self, path):
+        """ Writes every measurement to a JSON file.
+
+            :param path the path of the file to write """
+
+        with open(path, "w") as f:
+            json.dump(self.to_json(), f, indent=4)
+
+    def create_stats(self):
+        """ Converts the measurements into the format of the standard profiler, stored in self.stats. This is
+            called by pstats.Stats when it is given a Profiler. """
+
+        def function_key(key):
+            line_number, name = key
+            return self.filepath, line_number, name
+
+        self.stats = {}
+        for key, stats in self.command_stats.items():
+            callers = {function_key(caller): (calls, calls, seconds, seconds)
+                       for caller, (calls, seconds) in stats.callers.items()}
+            self.stats[function_key(key)] = (stats.primitive_calls, stats.calls, stats.self_seconds,
+                                             stats.total_seconds, callers)
+
+    def dump_stats(self, path):
+        """ Writes the measurements in the format of the standard profiler, which can be read with pstats.
+
+            :param path the path of the file to write """
+
+        self.create_stats()
+        with open(path, "wb") as f:
+            marshal.dump(self.stats, f)
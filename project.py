@@ -0,0 +1,360 @@
+# Project builds, compiling every template within a directory tree in a single run. Every template is parsed in
+# parallel into a shared registry, reusing the parse cache, and each is given its own quota of variations, either
+# directly or as a weighted share of a total. The variations of every template are then compiled by a single pool
+# of worker processes, so small templates never leave workers idle, and the build ends with a summary of the time
+# spent on, and output written by, each template.
+#
+# A project may be configured by a varithon.json file at the root of its directory, for example
+#
+#   {"count": 100, "total": 50000, "templates": {"loops.nested": {"count": 10}, "lists": {"weight": 3}}}
+#
+# where templates with a count are given exactly that many variations, and if a total is given it is shared
+# between every other template by weight, otherwise each is given the default count times its weight.
+
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+import cache
+import varithon as V
+from cli import find_templates, RunStats, format_bytes, PROGRESS_INTERVAL
+from errors import VarithonSyntaxException
+from parallel import CompilePool
+from writers import WRITERS, DEFAULT_SHARD_BYTES
+
+# the name of the configuration file at the root of a project
+PROJECT_FILENAME = "varithon.json"
+
+# the default number of variations of each template, if neither the configuration nor the command line give one
+DEFAULT_COUNT = 5
+
+# the number of variations compiled by a worker per task
+CHUNK_SIZE = 64
+
+
+class ProjectException(Exception):
+    """ ProjectException is thrown when a project is unable to be configured or built. """
+
+
+def _parse_template(task):
+    """ Parses a single template within a worker process.
+
+        :param task a tuple of the path to the template, the cache directory, and whether to use the cache
+        :return a tuple of the folded list of lines of the template, or None if it was unable to be parsed, the
+            error it was unable to be parsed with, or None, and the number of seconds spent """
+
+    path, cache_dir, use_cache = task
+
+    start = time.perf_counter()
+    try:
+        parsed = cache.load_varithon_file(path, cache_dir) if use_cache else V.parse_varithon_file(path)
+    except VarithonSyntaxException as e:
+        return None, str(e), time.perf_counter() - start
+
+    return V.fold_constants(parsed), None, time.perf_counter() - start
+
+
+class TemplateRegistry(object):
+    """ TemplateRegistry holds every parsed template of a project by name, shared by each stage of the build. The
+        templates are held with their constant lines folded, see V.fold_constants, so that is only done once. """
+
+    def __init__(self):
+        self.templates = {}
+        self.paths = {}
+        self.parse_seconds = {}
+        self.errors = {}
+
+    def load(self, templates, jobs=None, cache_dir=None, use_cache=True):
+        """ Parses templates into the registry using a pool of worker processes. A template which is unable to be
+            parsed is not added, and its error is kept in errors instead.
+
+            :param templates a list of tuples of the path to each template and its name, see cli.find_templates
+            :param jobs the number of worker processes to use, defaults to the number of CPUs, if this is 1 the
+                templates are parsed within the current process
+            :param cache_dir a path to the cache directory, see cache.get_cache_dir
+            :param use_cache whether to read and add to the parse cache, rather than always parsing """
+
+        if jobs is None:
+            jobs = os.cpu_count() or 1
+
+        tasks = [(path, cache_dir, use_cache) for path, _ in templates]
+        if jobs <= 1 or len(tasks) <= 1:
+            results = list(map(_parse_template, tasks))
+        else:
+            with multiprocessing.Pool(min(jobs, len(tasks))) as pool:
+                results = pool.map(_parse_template, tasks)
+
+        for (path, name), (parsed, error, seconds) in zip(templates, results):
+            self.paths[name] = path
+            self.parse_seconds[name] = seconds
+            if error is not None:
+                self.errors[name] = error
+            else:
+                self.templates[name] = parsed
+
+    def __getitem__(self, name):
+        return self.templates[name]
+
+    def __contains__(self, name):
+        return name in self.templates
+
+    def __len__(self):
+        return len(self.templates)
+
+
+def load_project_config(directory):
+    """ Reads the configuration of a project.
+
+        :param directory a path to the root directory of the project
+        :return the configuration as a dictionary, empty if the project has no configuration file """
+
+    try:
+        with open(os.path.join(directory, PROJECT_FILENAME), "r") as f:
+            config = json.load(f)
+    except FileNotFoundError:
+        return {}
+    except ValueError as e:
+        raise ProjectException(f"The configuration of '{directory}' is not valid JSON: {e}")
+
+    if not isinstance(config, dict) or not isinstance(config.get("templates", {}), dict):
+        raise ProjectException(f"The configuration of '{directory}' must be an object with an object of templates")
+
+    for key in ["count", "total"]:
+        if key in config and not _is_count(config[key]):
+            raise ProjectException(f"The {key} of the configuration of '{directory}' must be a non-negative integer")
+
+    for name, template_settings in config.get("templates", {}).items():
+        if not isinstance(template_settings, dict):
+            raise ProjectException(f"The configuration of template '{name}' must be an object")
+        if "count" in template_settings and not _is_count(template_settings["count"]):
+            raise ProjectException(f"The count of template '{name}' must be a non-negative integer")
+
+        weight = template_settings.get("weight", 1)
+        if isinstance(weight, bool) or not isinstance(weight, (int, float)) or not 0 <= weight < float("inf"):
+            raise ProjectException(f"The weight of template '{name}' must be a non-negative number")
+
+    return config
+
+
+def _is_count(value):
+    """ Checks whether a value of the configuration is a valid number of variations. JSON booleans are read as
+        Python booleans, which are integers, so are checked for separately.
+
+        :param value the value of the configuration
+        :return True if the value is a non-negative integer """
+
+    return isinstance(value, int) and not isinstance(value, bool) and value >= 0
+
+
+def get_quotas(names, config, count=None, total=None):
+    """ Gets the number of variations of each template of a project. Templates given a count by the configuration
+        are given exactly that many, and every other template is given a share of the total proportional to its
+        weight, rounded so the shares add up to the total, or the default count times its weight if there is no
+        total.
+
+        :param names a list of the name of each template
+        :param config the configuration of the project, see load_project_config
+        :param count the default count, overriding that of the configuration, or None to use the configuration
+        :param total the total, overriding that of the configuration, or None to use the configuration
+        :return a dictionary of each template name and its number of variations, in the order of names """
+
+    settings = config.get("templates", {})
+    unknown = sorted(set(settings).difference(names))
+    if len(unknown) > 0:
+        raise ProjectException(f"The configuration names templates which do not exist: {', '.join(unknown)}")
+
+    count = count if count is not None else config.get("count", DEFAULT_COUNT)
+    total = total if total is not None else config.get("total")
+
+    quotas = {}
+    weights = {}
+    for name in names:
+        template_settings = settings.get(name, {})
+        if "count" in template_settings:
+            quotas[name] = template_settings["count"]
+        else:
+            weights[name] = template_settings.get("weight", 1)
+
+        if quotas.get(name, 0) < 0 or weights.get(name, 0) < 0:
+            raise ProjectException(f"The count and weight of '{name}' must not be negative")
+
+    weight_sum = sum(weights.values())
+    if total is None:
+        quotas.update({name: round(count * weight) for name, weight in weights.items()})
+    elif weight_sum > 0:
+        remaining = total - sum(quotas.values())
+        if remaining < 0:
+            raise ProjectException(f"The counts of the templates add up to more than the total of {total}")
+
+        # each share is rounded down, then the variations left over go to the shares rounded down the most
+        shares = {name: remaining * weight / weight_sum for name, weight in weights.items()}
+        quotas.update({name: int(share) for name, share in shares.items()})
+        leftover = remaining - sum(quotas[name] for name in weights)
+        for name in sorted(weights, key=lambda name: int(shares[name]) - shares[name])[:leftover]:
+            quotas[name] += 1
+    else:
+        quotas.update(dict.fromkeys(weights, 0))
+
+    return {name: quotas[name] for name in names}
+
+
+class TemplateStats(object):
+    """ TemplateStats holds the outcome of building a single template of a project. """
+
+    def __init__(self, name, quota, parse_seconds):
+        self.name = name
+        self.quota = quota
+        self.parse_seconds = parse_seconds
+        self.compile_seconds = 0.0
+        self.write_seconds = 0.0
+        self.variant_count = 0
+        self.byte_count = 0
+        self.file_count = 0
+
+
+def build_project(directory, destination, count=None, total=None, jobs=None, seed=0, output_format="py",
+                  max_shard_bytes=DEFAULT_SHARD_BYTES, fast_random=False, use_cache=True, chunk_size=CHUNK_SIZE,
+                  stats=None, lazy=False):
+    """ Builds every template within a project directory, writing the variations of each in the chosen format.
+        The variations of a template are identical to those of V.compile_many given the same seed.
+
+        :param directory a path to the root directory of the project
+        :param destination a path to the directory the variations are written to
+        :param count the default number of variations of each template, see get_quotas
+        :param total the total number of variations shared between weighted templates, see get_quotas
+        :param jobs the number of worker processes to use, defaults to the number of CPUs, if this is 1 the
+            variations are compiled within the current process
+        :param seed an integer seed for every template
+        :param output_format the format the variations are written in, one of writers.WRITERS
+        :param max_shard_bytes the uncompressed size in bytes after which a writer starts a new file
+        :param fast_random whether to make integers and choices from single random floats, see V.variant_rng
+        :param use_cache whether to read and add to the parse cache, rather than always parsing
+        :param chunk_size the number of variations compiled by a worker per task
+        :param stats a cli.RunStats to report the progress of the build to, or None to report nothing
+        :param lazy whether to collapse the lines depth first, see V.iter_collapsed_lines
+        :return a tuple of the TemplateRegistry of the project, with the error of each template which failed to
+            parse or compile, and a list of the TemplateStats of each template which was parsed, possibly a
+            ProjectException is thrown if the project is badly configured """
+
+    config = load_project_config(directory)
+
+    start = time.perf_counter()
+    registry = TemplateRegistry()
+    registry.load(find_templates([directory]), jobs, use_cache=use_cache)
+    if stats is not None:
+        stats.add_time("parse", time.perf_counter() - start)
+
+    quotas = get_quotas(sorted(registry.paths), config, count, total)
+    if stats is not None:
+        stats.total = sum(quotas[name] for name in registry.templates)
+
+    template_stats = {name: TemplateStats(name, quotas[name], registry.parse_seconds[name])
+                      for name in sorted(registry.templates)}
+
+    writer_class = WRITERS[output_format]
+    counts = {name: quotas[name] for name in template_stats}
+
+    # every template is compiled by the same pool, and the chunks are taken in order, so only one writer is open
+    with CompilePool(registry.templates, jobs) as pool:
+        writer = None
+        for name, chunk_start, variants, error, seconds in pool.compile_templates(counts, seed, chunk_size,
+                                                                                  fast_random, writer_class.emit,
+                                                                                  lazy):
+            template = template_stats[name]
+            template.compile_seconds += seconds
+
+            # a template which fails to compile is reported like one which fails to parse, and the rest of its
+            # chunks are dropped, while every other template carries on
+            if name in registry.errors:
+                continue
+            if error is not None:
+                registry.errors[name] = f"{name}: {error}"
+                continue
+
+            write_start = time.perf_counter()
+            if writer is None or writer.prefix != name:
+                if writer is not None:
+                    writer.close()
+                    template_stats[writer.prefix].file_count = len(writer.shard_paths)
+                writer = writer_class(destination, name, max_shard_bytes)
+
+            for index, source in enumerate(variants, chunk_start):
+                writer.write(name, index, seed, source, lazy)
+                byte_count = len(source.encode()) if isinstance(source, str) else len(source)
+                template.variant_count += 1
+                template.byte_count += byte_count
+                if stats is not None:
+                    stats.add_variant(byte_count)
+            template.write_seconds += time.perf_counter() - write_start
+
+        if writer is not None:
+            writer.close()
+            template_stats[writer.prefix].file_count = len(writer.shard_paths)
+
+    if stats is not None:
+        for template in template_stats.values():
+            stats.add_time("compile", template.compile_seconds)
+            stats.add_time("write", template.write_seconds)
+
+    return registry, list(template_stats.values())
+
+
+def get_summary(template_stats):
+    """ Gets a table of the time spent on, and output written by, each template of a build.
+
+        :param template_stats a list of the TemplateStats of each template
+        :return the table as a string """
+
+    width = max([len("template")] + [len(template.name) for template in template_stats])
+
+    lines = [f"{'template':<{width}} {'variations':>10} {'output':>10} {'files':>6} {'parse':>9} {'compile':>9} "
+             f"{'write':>9}"]
+    for template in template_stats:
+        lines.append(f"{template.name:<{width}} {template.variant_count:>10} {format_bytes(template.byte_count):>10} "
+                     f"{template.file_count:>6} {template.parse_seconds:>8.3f}s {template.compile_seconds:>8.3f}s "
+                     f"{template.write_seconds:>8.3f}s")
+
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compiles every .vy template within a project directory.")
+    parser.add_argument("directory", help="the root directory of the project")
+    parser.add_argument("--count", type=int, default=None,
+                        help=f"the default number of variations of each template, overriding {PROJECT_FILENAME}")
+    parser.add_argument("--total", type=int, default=None,
+                        help=f"the total number of variations shared between templates by weight, overriding "
+                             f"{PROJECT_FILENAME}")
+    parser.add_argument("--jobs", type=int, default=None, help="the number of worker processes, defaults to the CPU count")
+    parser.add_argument("--seed", type=int, default=0, help="the seed of every template")
+    parser.add_argument("--out", default="compiled", help="the directory to write the variations to")
+    parser.add_argument("--format", choices=sorted(WRITERS), default="py", help="the output format of the variations")
+    parser.add_argument("--shard-size", type=int, default=DEFAULT_SHARD_BYTES, help="the size in bytes of each shard")
+    parser.add_argument("--fast-random", action="store_true", help="make integers and choices from single random floats")
+    parser.add_argument("--lazy", action="store_true", help="collapse nested collections depth first")
+    parser.add_argument("--no-cache", action="store_true", help="always parse templates, rather than using the cache")
+    parser.add_argument("--quiet", action="store_true", help="report nothing but errors")
+    args = parser.parse_args()
+
+    run_stats = RunStats(0, interval=None if args.quiet else PROGRESS_INTERVAL)
+    try:
+        registry, template_stats = build_project(args.directory, args.out, args.count, args.total, args.jobs,
+                                                 args.seed, args.format, args.shard_size, args.fast_random,
+                                                 not args.no_cache, stats=run_stats, lazy=args.lazy)
+    except (ProjectException, FileNotFoundError) as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
+
+    for error in registry.errors.values():
+        print(error, file=sys.stderr)
+
+    if not args.quiet:
+        if run_stats.live:
+            print(file=run_stats.stream)
+        print(get_summary(template_stats), file=run_stats.stream)
+        print(run_stats.get_summary(len(template_stats)), file=run_stats.stream)
+
+    sys.exit(1 if len(registry.errors) > 0 else 0)
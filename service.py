@@ -0,0 +1,330 @@
+# A local generation service. Templates are parsed once when the service starts and kept in memory, and every
+# worker process receives them once. Each template has a bounded queue of variations which its workers keep full,
+# and clients stream variations from it over HTTP, on a Unix socket or a localhost port. A queue only refills as
+# clients take from it, and variations are only taken as fast as each client reads them, so memory stays bounded.
+#
+#   GET /templates                      a JSON object of each template name and the number of variations queued,
+#                                       or the error it failed to compile with
+#   GET /variants/<name>?count=<n>      a stream of n variations as JSON lines, every variation if n is 0
+
+import argparse
+import asyncio
+import collections
+import concurrent.futures
+import concurrent.futures.process
+import http.client
+import json
+import os
+import socket
+import urllib.parse
+
+import cache
+import parallel
+from cli import find_templates
+from errors import SyntaxException
+
+# the default number of variations queued per template
+PREFETCH_COUNT = 256
+
+# the number of variations compiled by a worker per task
+CHUNK_SIZE = 16
+
+# the number of times in a row the worker processes are restarted for a template before it is given up on
+RESTART_LIMIT = 3
+
+
+class GenerationService(object):
+    """ GenerationService keeps a queue of variations of each template filled by a pool of worker processes, and
+        serves them to clients over HTTP. Every variation is handed to exactly one client, along with its index,
+        seed, random mode, and expansion mode, so it can be re-created. A variation taken by a client which
+        disconnects before reading it is dropped, so the indices a client sees may have gaps. """
+
+    def __init__(self, templates, jobs=None, seed=0, prefetch_count=PREFETCH_COUNT, chunk_size=CHUNK_SIZE,
+                 fast_random=False, lazy=False):
+        """ Constructs a GenerationService, it does not start until start is called.
+
+            :param templates a dictionary of each template name and its parsed list of lines
+            :param jobs the number of worker processes to use, defaults to the number of CPUs
+            :param seed an integer seed for every template
+            :param prefetch_count the maximum number of variations queued per template
+            :param chunk_size the number of variations compiled by a worker per task
+            :param fast_random whether to make integers and choices from single random floats, see V.variant_rng
+            :param lazy whether to collapse the lines depth first, see V.iter_collapsed_lines """
+
+        self.templates = templates
+        self.jobs = jobs if jobs is not None else os.cpu_count() or 1
+        self.seed = seed
+        self.prefetch_count = prefetch_count
+        self.chunk_size = chunk_size
+        self.fast_random = fast_random
+        self.lazy = lazy
+
+        self.queues = {}
+        self.errors = {}
+        self.fill_tasks = []
+        self.executor = None
+        self.server = None
+
+    async def start(self, unix_path=None, host="127.0.0.1", port=0):
+        """ Starts the worker processes and begins filling the queues, then listens for clients.
+
+            :param unix_path the path of a Unix socket to listen on, if this is None a TCP port is listened on
+            :param host the host of the TCP port to listen on
+            :param port the TCP port to listen on, 0 chooses any free port
+            :return the address listened on, either the Unix socket path or a tuple of the host and port """
+
+        self.executor = concurrent.futures.ProcessPoolExecutor(self.jobs, initializer=parallel.init_worker,
+                                                               initargs=(self.templates,))
+
+        for name in self.templates:
+            self.queues[name] = asyncio.Queue(self.prefetch_count)
+            self.fill_tasks.append(asyncio.create_task(self.fill(name)))
+
+        if unix_path is not None:
+            self.server = await asyncio.start_unix_server(self.handle_client, unix_path)
+            return unix_path
+
+        self.server = await asyncio.start_server(self.handle_client, host, port)
+        return self.server.sockets[0].getsockname()[:2]
+
+    def restart_executor(self, executor):
+        """ Replaces the pool of worker processes once one of its workers has died, which breaks the whole pool.
+            Every template shares the pool, so it is only replaced by the first to find it broken.
+
+            :param executor the broken concurrent.futures.ProcessPoolExecutor """
+
+        if self.executor is executor:
+            executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = concurrent.futures.ProcessPoolExecutor(self.jobs, initializer=parallel.init_worker,
+                                                                   initargs=(self.templates,))
+
+    async def close(self):
+        """ Stops listening for clients, stops filling the queues, and stops the worker processes. """
+
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+
+        for task in self.fill_tasks:
+            task.cancel()
+        await asyncio.gather(*self.fill_tasks, return_exceptions=True)
+
+        if self.executor is not None:
+            self.executor.shutdown(cancel_futures=True)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def fill(self, name):
+        """ Keeps the queue of a template full. A chunk is compiled by each worker at once, and a new chunk is only
+            started once the queue has room for the last, so at most jobs chunks are held beyond the queue.
+
+            :param name the name of the template """
+
+        loop = asyncio.get_running_loop()
+        queue = self.queues[name]
+
+        pending = collections.deque()
+        start = 0       # the index of the first variation of the oldest pending chunk
+        next_index = 0
+        restart_count = 0
+        while True:
+            try:
+                while len(pending) < self.jobs:
+                    executor = self.executor
+                    stop = next_index + self.chunk_size
+                    task = (name, self.seed, next_index, stop, self.fast_random, None, self.lazy)
+                    pending.append((executor, loop.run_in_executor(executor, parallel.compile_chunk, task)))
+                    next_index = stop
+
+                executor, future = pending.popleft()
+                variants = await future
+            except (SyntaxException, concurrent.futures.process.BrokenProcessPool) as e:
+                for _, other in pending:
+                    if not other.cancel():
+                        other.exception()   # failed along with the pool, retrieved so it is not reported as unhandled
+                pending.clear()
+
+                # a worker process which died, such as by being killed, is replaced and the lost chunks compiled
+                # again, but a template error, such as a Get of a variable that is never set, is never retried
+                if isinstance(e, SyntaxException) or restart_count >= RESTART_LIMIT:
+                    self.errors[name] = f"{type(e).__name__}: {e}"
+                    await queue.put((None, None))
+                    return
+
+                restart_count += 1
+                self.restart_executor(executor)
+                next_index = start
+                continue
+
+            restart_count = 0
+
+            for index, source in enumerate(variants, start):
+                await queue.put((index, source))
+            start += self.chunk_size
+
+    async def handle_client(self, reader, writer):
+        """ Serves a single HTTP request.
+
+            :param reader the asyncio.StreamReader of the connection
+            :param writer the asyncio.StreamWriter of the connection """
+
+        try:
+            request_line = (await reader.readline()).decode("latin-1").split()
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass    # headers are not needed
+
+            if len(request_line) != 3:
+                await self.send_error(writer, 400, "Bad Request")
+                return
+            if request_line[0] != "GET":
+                await self.send_error(writer, 405, "Method Not Allowed")
+                return
+
+            url = urllib.parse.urlsplit(request_line[1])
+            parts = [urllib.parse.unquote(part) for part in url.path.strip("/").split("/")]
+
+            if parts == ["templates"]:
+                body = json.dumps({name: self.errors.get(name, queue.qsize())
+                                   for name, queue in self.queues.items()}).encode()
+                writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                             b"Content-Length: %d\r\nConnection: close\r\n\r\n" % len(body) + body)
+                await writer.drain()
+            elif len(parts) == 2 and parts[0] == "variants" and parts[1] in self.queues:
+                try:
+                    count = int(urllib.parse.parse_qs(url.query).get("count", ["1"])[0])
+                except ValueError:
+                    count = -1
+                if count < 0:
+                    await self.send_error(writer, 400, "Bad Request")
+                    return
+
+                await self.stream_variants(writer, parts[1], count)
+            else:
+                await self.send_error(writer, 404, "Not Found")
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass    # the client went away
+        finally:
+            writer.close()
+
+    async def stream_variants(self, writer, name, count):
+        """ Streams variations of a template to a client as JSON lines, each in its own HTTP chunk. Each variation
+            is only taken from the queue once the client has read the last, so a slow client never causes
+            variations to build up.
+
+            :param writer the asyncio.StreamWriter of the connection
+            :param name the name of the template
+            :param count the number of variations to send, or 0 to send them until the client disconnects """
+
+        queue = self.queues[name]
+        sent = 0
+        while count == 0 or sent < count:
+            index, source = await queue.get()
+            if index is None:
+                queue.put_nowait((None, None))     # the template failed to compile, every other client must stop too
+                if sent == 0:
+                    await self.send_error(writer, 500, "Internal Server Error")
+                    return
+                break
+
+            if sent == 0:   # the response only starts once there is a variation, so errors can still be reported
+                writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/x-ndjson\r\n"
+                             b"Transfer-Encoding: chunked\r\nConnection: close\r\n\r\n")
+
+            line = json.dumps({"template": name, "index": index, "seed": self.seed, "fast_random": self.fast_random,
+                               "lazy": self.lazy, "source": source}) + "\n"
+            data = line.encode()
+            writer.write(b"%X\r\n%s\r\n" % (len(data), data))
+            await writer.drain()
+            sent += 1
+
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+    async def send_error(self, writer, status, reason):
+        """ Sends an HTTP error response with no body.
+
+            :param writer the asyncio.StreamWriter of the connection
+            :param status the HTTP status code
+            :param reason the HTTP reason phrase """
+
+        writer.write(b"HTTP/1.1 %d %s\r\nContent-Length: 0\r\nConnection: close\r\n\r\n" % (status, reason.encode()))
+        await writer.drain()
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """ UnixHTTPConnection is an http.client.HTTPConnection over a Unix socket rather than a TCP connection. """
+
+    def __init__(self, path, timeout=None):
+        super().__init__("localhost", timeout=timeout)
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if self.timeout is not None:
+            self.sock.settimeout(self.timeout)
+        self.sock.connect(self.path)
+
+
+def fetch_variants(address, name, count=1, timeout=None):
+    """ Fetches variations of a template from a running GenerationService.
+
+        :param address the address of the service, either the path of its Unix socket or a tuple of host and port
+        :param name the name of the template
+        :param count the number of variations to fetch, or 0 to fetch them until the generator is closed
+        :param timeout the number of seconds to wait for the service before giving up, or None to wait forever
+        :return a generator yielding a dictionary of the template, index, seed, fast_random, lazy, and source of
+            each variation """
+
+    if isinstance(address, str):
+        connection = UnixHTTPConnection(address, timeout)
+    else:
+        connection = http.client.HTTPConnection(*address, timeout=timeout)
+
+    try:
+        connection.request("GET", f"/variants/{urllib.parse.quote(name)}?count={count}")
+        response = connection.getresponse()
+        if response.status != 200:
+            raise LookupError(f"Could not fetch variations of '{name}': {response.status} {response.reason}")
+
+        for line in response:
+            yield json.loads(line)
+    finally:
+        connection.close()
+
+
+async def serve(args):
+    """ Runs the service as given by the command line arguments until interrupted.
+
+        :param args the parsed command line arguments """
+
+    templates = {name: cache.load_varithon_file(path) for path, name in find_templates(args.templates)}
+
+    service = GenerationService(templates, args.jobs, args.seed, args.prefetch, fast_random=args.fast_random,
+                                lazy=args.lazy)
+    async with service:
+        address = await service.start(args.unix, args.host, args.port)
+        print(f"Serving {len(templates)} templates on {address}")
+        await asyncio.Event().wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serves variations of .vy templates over HTTP.")
+    parser.add_argument("templates", nargs="+", help="the .vy files, or directories of .vy files, to serve")
+    parser.add_argument("--unix", default=None, help="the path of a Unix socket to listen on, rather than a port")
+    parser.add_argument("--host", default="127.0.0.1", help="the host to listen on")
+    parser.add_argument("--port", type=int, default=8765, help="the port to listen on")
+    parser.add_argument("--jobs", type=int, default=None, help="the number of worker processes, defaults to the CPU count")
+    parser.add_argument("--seed", type=int, default=0, help="the seed of every template")
+    parser.add_argument("--prefetch", type=int, default=PREFETCH_COUNT, help="the number of variations queued per template")
+    parser.add_argument("--fast-random", action="store_true", help="make integers and choices from single random floats")
+    parser.add_argument("--lazy", action="store_true", help="collapse nested collections depth first")
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
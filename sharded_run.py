@@ -0,0 +1,558 @@
+# Sharded runs, for builds too large for a single machine or too long to finish without interruption. A run of
+# every variation of a set of templates is split into shards of consecutive indices, and a manifest of the run is
+# written to a shared directory along with a copy of each template. Any number of nodes may then work on the run,
+# each claiming unfinished shards one at a time, and once every shard is done their output is merged.
+#
+#   <run>/manifest.json         the settings of the run, its templates, and its shards
+#   <run>/templates/<name>.vy   the template sources, so every node compiles exactly the same templates
+#   <run>/claims/<id>.json      the node working on a shard, rewritten as a checkpoint while it works
+#   <run>/shards/<id>/          the output of a finished shard, written by the writer of the run's format
+#   <run>/done/<id>.json        a record of a finished shard, written last, so a shard is done only if this exists
+#
+# A claim that has not been checkpointed within its lease is taken to belong to a node that was stopped, and may
+# be taken over by another. A node that is stopped only loses the shard it was working on, which is redone whole.
+# A shard whose template fails to compile would fail the same way on every node, so it is recorded as done along
+# with its error rather than being retried, and the run is refused when it is merged.
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import socket
+import sys
+import tarfile
+import tempfile
+import time
+
+import cache
+from cli import find_templates, TEMPLATE_EXTENSION
+from errors import SyntaxException
+from parallel import compile_parallel
+from writers import WRITERS, DEFAULT_SHARD_BYTES
+
+MANIFEST_VERSION = 1
+
+# the default number of variations of a template in each shard
+SHARD_VARIANTS = 1000
+
+# the default number of seconds after its last checkpoint that a claim may be taken over by another node
+LEASE_SECONDS = 600.0
+
+# the default number of seconds between each checkpoint of a claim
+CHECKPOINT_INTERVAL = 10.0
+
+
+class RunException(Exception):
+    """ RunException is thrown when a sharded run is unable to be created, worked on, or merged. """
+
+
+class ClaimLostException(RunException):
+    """ ClaimLostException is thrown when the claim of a shard is taken over by another node while it is worked on. """
+
+
+def write_json_atomic(path, value):
+    """ Writes a value as JSON, writing to a temporary file first and then moving it into place, so other nodes
+        never read a partially written file.
+
+        :param path the path to write to
+        :param value the value to write """
+
+    fd, temporary_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(value, f, indent=1)
+        os.replace(temporary_path, path)
+    except BaseException:
+        os.remove(temporary_path)
+        raise
+
+
+def read_json(path):
+    """ Reads a JSON file.
+
+        :param path the path to read
+        :return the value read, or None if there is no such file """
+
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def get_node_id():
+    """ Gets an identifier of this node which is unique among every node working on a run.
+
+        :return the identifier as a string """
+
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+def create_run(run_directory, template_paths, count, seed=0, output_format="jsonl",
+               max_shard_bytes=DEFAULT_SHARD_BYTES, shard_variants=SHARD_VARIANTS, fast_random=False, lazy=False):
+    """ Creates a sharded run, writing its manifest and a copy of each template into the run directory. The shards
+        only depend on the arguments given, so creating the same run twice creates the same shards.
+
+        :param run_directory a path to the shared directory of the run, which must not already contain a run
+        :param template_paths a list of paths to .vy files and directories, see cli.find_templates
+        :param count the number of variations to compile per template
+        :param seed an integer seed for the whole run
+        :param output_format the format the variations are written in, one of writers.WRITERS
+        :param max_shard_bytes the uncompressed size in bytes after which a writer starts a new file
+        :param shard_variants the number of variations of a template in each shard
+        :param fast_random whether to make integers and choices from single random floats, see V.variant_rng
+        :param lazy whether to collapse the lines depth first, see V.iter_collapsed_lines
+        :return the manifest of the run as a dictionary """
+
+    if output_format not in WRITERS:
+        raise RunException(f"Unknown output format '{output_format}'")
+    if shard_variants < 1:
+        raise RunException("Each shard must contain at least one variation")
+
+    manifest_path = os.path.join(run_directory, "manifest.json")
+    if os.path.exists(manifest_path):
+        raise RunException(f"A run already exists in '{run_directory}'")
+
+    templates = {}
+    for path, name in find_templates(template_paths):
+        if name in templates:
+            raise RunException(f"Two templates are both named '{name}'")
+
+        with open(path, "rb") as f:
+            templates[name] = f.read()
+
+    for directory in ["templates", "claims", "shards", "done"]:
+        os.makedirs(os.path.join(run_directory, directory), exist_ok=True)
+
+    shards = []
+    for name in sorted(templates):
+        with open(os.path.join(run_directory, "templates", name + TEMPLATE_EXTENSION), "wb") as f:
+            f.write(templates[name])
+
+        for start in range(0, count, shard_variants):
+            shards.append({"id": f"{len(shards):06d}", "template": name, "start": start,
+                           "stop": min(start + shard_variants, count)})
+
+    manifest = {
+        "version": MANIFEST_VERSION,
+        "count": count,
+        "seed": seed,
+        "format": output_format,
+        "max_shard_bytes": max_shard_bytes,
+        "fast_random": fast_random,
+        "lazy": lazy,
+        "templates": {name: hashlib.sha256(templates[name]).hexdigest() for name in sorted(templates)},
+        "shards": shards,
+    }
+    write_json_atomic(manifest_path, manifest)  # written last, so a run only exists once it is complete
+
+    return manifest
+
+
+def read_manifest(run_directory):
+    """ Reads the manifest of a sharded run.
+
+        :param run_directory a path to the shared directory of the run
+        :return the manifest of the run as a dictionary """
+
+    manifest = read_json(os.path.join(run_directory, "manifest.json"))
+    if manifest is None:
+        raise RunException(f"There is no run in '{run_directory}'")
+    if manifest["version"] != MANIFEST_VERSION:
+        raise RunException(f"The run in '{run_directory}' was created by an incompatible version of Varithon")
+
+    return manifest
+
+
+def load_templates(run_directory, manifest):
+    """ Parses the copy of each template of a run, checking that none have changed since the run was created.
+
+        :param run_directory a path to the shared directory of the run
+        :param manifest the manifest of the run
+        :return a dictionary of each template name and its parsed list of lines """
+
+    templates = {}
+    for name, digest in manifest["templates"].items():
+        path = os.path.join(run_directory, "templates", name + TEMPLATE_EXTENSION)
+        with open(path, "rb") as f:
+            if hashlib.sha256(f.read()).hexdigest() != digest:
+                raise RunException(f"The template '{name}' has changed since the run was created")
+
+        templates[name] = cache.load_varithon_file(path)
+
+    return templates
+
+
+class ShardClaim(object):
+    """ ShardClaim is a node's claim of a single shard. A claim is a file created only if it does not already
+        exist, so at most one node holds a claim at once. The holder checkpoints the claim as it works, and a claim
+        which has not been checkpointed within the lease may be taken over. """
+
+    def __init__(self, run_directory, shard_id, node_id, lease_seconds=LEASE_SECONDS):
+        """ Constructs a ShardClaim, the shard is not claimed until acquire is called.
+
+            :param run_directory a path to the shared directory of the run
+            :param shard_id the id of the shard to claim
+            :param node_id the identifier of the claiming node
+            :param lease_seconds the number of seconds after its last checkpoint that a claim may be taken over """
+
+        self.path = os.path.join(run_directory, "claims", shard_id + ".json")
+        self.node_id = node_id
+        self.lease_seconds = lease_seconds
+
+        self.claimed_time = None
+        self.previous_node_id = None    # the node whose expired claim was taken over, if any
+
+    def acquire(self):
+        """ Claims the shard, taking over the claim of another node if its lease has run out.
+
+            :return True if the shard was claimed, False if another node holds it """
+
+        if self.create():
+            return True
+
+        try:
+            expired = time.time() - os.stat(self.path).st_mtime > self.lease_seconds
+        except FileNotFoundError:
+            expired = True      # released since it was seen
+
+        if not expired:
+            return False
+
+        # the expired claim is moved aside rather than removed, as only one node can move it, so only one
+        # node takes it over
+        stale_path = f"{self.path}.{self.node_id}.stale"
+        try:
+            os.rename(self.path, stale_path)
+        except FileNotFoundError:
+            pass
+        else:
+            try:
+                self.previous_node_id = read_json(stale_path).get("node")
+            except (AttributeError, ValueError):
+                pass    # the claim file was never written in full
+            os.remove(stale_path)
+
+        return self.create()
+
+    def create(self):
+        """ Creates the claim file, if it does not already exist.
+
+            :return True if the claim file was created, False otherwise """
+
+        try:
+            fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_EXCL)
+        except FileExistsError:
+            return False
+
+        self.claimed_time = time.time()
+        with os.fdopen(fd, "w") as f:
+            json.dump(self.get_checkpoint(0), f)
+        return True
+
+    def get_checkpoint(self, written):
+        """ Gets the contents of the claim file.
+
+            :param written the number of variations of the shard written so far
+            :return a dictionary of the node, the time the shard was claimed, the time now, and the progress """
+
+        return {"node": self.node_id, "claimed": self.claimed_time, "checkpointed": time.time(), "written": written}
+
+    def checkpoint(self, written):
+        """ Rewrites the claim file with the progress of the shard, which extends the lease. If the claim is no
+            longer held by this node, a ClaimLostException is thrown.
+
+            :param written the number of variations of the shard written so far """
+
+        try:
+            with open(self.path, "r+") as f:    # never created, so a claim which was taken over stays lost
+                holder = json.load(f).get("node")
+                if holder == self.node_id:
+                    f.seek(0)
+                    f.truncate()
+                    json.dump(self.get_checkpoint(written), f)
+        except (FileNotFoundError, ValueError):
+            holder = None
+
+        if holder != self.node_id:
+            raise ClaimLostException(f"The claim of '{os.path.basename(self.path)}' was taken over")
+
+    def release(self):
+        """ Releases the claim, if it is still held by this node. """
+
+        try:
+            if read_json(self.path).get("node") == self.node_id:
+                os.remove(self.path)
+        except (FileNotFoundError, AttributeError, ValueError):
+            pass
+
+
+def run_shard(run_directory, manifest, shard, parsed, claim, jobs=None, checkpoint_interval=CHECKPOINT_INTERVAL):
+    """ Compiles and writes every variation of a claimed shard. The output is written to a directory of this node's
+        own, which is only moved into place once complete, so an interrupted shard leaves no partial output.
+
+        :param run_directory a path to the shared directory of the run
+        :param manifest the manifest of the run
+        :param shard the dictionary of the shard within the manifest
+        :param parsed the parsed list of lines of the shard's template
+        :param claim the ShardClaim of the shard, which must be held
+        :param jobs the number of worker processes to use, see parallel.compile_parallel
+        :param checkpoint_interval the number of seconds between each checkpoint of the claim
+        :return the record of the finished shard as a dictionary, with the error of a shard which failed to
+            compile """
+
+    shard_directory = os.path.join(run_directory, "shards", shard["id"])
+    temporary_directory = f"{shard_directory}.{claim.node_id}.tmp"
+    shutil.rmtree(temporary_directory, ignore_errors=True)    # left by an earlier attempt of this node
+    if claim.previous_node_id is not None:
+        # left by the node whose claim was taken over
+        shutil.rmtree(f"{shard_directory}.{claim.previous_node_id}.tmp", ignore_errors=True)
+
+    seed = manifest["seed"]
+    lazy = manifest.get("lazy", False)     # not written by runs created before lazy expansion
+    count = shard["stop"] - shard["start"]
+    writer_class = WRITERS[manifest["format"]]
+    variants = compile_parallel(parsed, count, jobs, seed, fast_random=manifest["fast_random"], start=shard["start"],
+                                emit=writer_class.emit, lazy=lazy)
+
+    done_path = os.path.join(run_directory, "done", shard["id"] + ".json")
+    checkpoint_time = time.monotonic()
+    try:
+        with writer_class(temporary_directory, shard["template"], manifest["max_shard_bytes"]) as writer:
+            for index, source in enumerate(variants, shard["start"]):
+                writer.write(shard["template"], index, seed, source, lazy)
+
+                if time.monotonic() - checkpoint_time >= checkpoint_interval:
+                    claim.checkpoint(index + 1 - shard["start"])
+                    checkpoint_time = time.monotonic()
+    except SyntaxException as e:
+        shutil.rmtree(temporary_directory, ignore_errors=True)
+        claim.checkpoint(0)
+
+        record = {"id": shard["id"], "node": claim.node_id, "count": 0, "files": [],
+                  "error": f"{shard['template']}: {e}"}
+        write_json_atomic(done_path, record)
+        return record
+
+    claim.checkpoint(count)     # the claim must still be held for the output to be kept
+
+    record = {"id": shard["id"], "node": claim.node_id, "count": writer.record_count,
+              "files": [os.path.basename(path) for path in writer.shard_paths]}
+    try:
+        os.rename(temporary_directory, shard_directory)
+    except OSError:
+        done = read_json(done_path)
+        if done is not None:
+            shutil.rmtree(temporary_directory)     # another node finished the same shard first, their output is kept
+            return done
+
+        # a node which stopped after moving its output into place, but before recording the shard as done,
+        # left output which is replaced, as nothing records which files it holds
+        stale_directory = f"{shard_directory}.{claim.node_id}.stale"
+        os.rename(shard_directory, stale_directory)
+        shutil.rmtree(stale_directory)
+        os.rename(temporary_directory, shard_directory)
+
+    write_json_atomic(done_path, record)
+    return record
+
+
+def run_node(run_directory, node_id=None, jobs=None, max_shards=None, lease_seconds=LEASE_SECONDS,
+             checkpoint_interval=CHECKPOINT_INTERVAL, stream=None):
+    """ Works on a sharded run, claiming and finishing unfinished shards until none are left unclaimed. Any
+        number of nodes may work on the same run at once, and a node which is stopped may simply be started again.
+
+        :param run_directory a path to the shared directory of the run
+        :param node_id the identifier of this node, see get_node_id if this is None
+        :param jobs the number of worker processes to use, see parallel.compile_parallel
+        :param max_shards the maximum number of shards to finish, or None to finish as many as possible
+        :param lease_seconds the number of seconds after its last checkpoint that a claim may be taken over
+        :param checkpoint_interval the number of seconds between each checkpoint of a claim
+        :param stream the stream to report each finished shard to, or None to report nothing
+        :return a list of the ids of the shards finished by this node """
+
+    node_id = node_id if node_id is not None else get_node_id()
+    manifest = read_manifest(run_directory)
+    templates = load_templates(run_directory, manifest)
+
+    finished = []
+    for shard in manifest["shards"]:
+        if max_shards is not None and len(finished) >= max_shards:
+            break
+        if os.path.exists(os.path.join(run_directory, "done", shard["id"] + ".json")):
+            continue
+
+        claim = ShardClaim(run_directory, shard["id"], node_id, lease_seconds)
+        if not claim.acquire():
+            continue
+        try:
+            if os.path.exists(os.path.join(run_directory, "done", shard["id"] + ".json")):
+                continue    # finished by another node since it was checked
+
+            start = time.perf_counter()
+            record = run_shard(run_directory, manifest, shard, templates[shard["template"]], claim, jobs,
+                               checkpoint_interval)
+        except ClaimLostException:
+            continue
+        finally:
+            claim.release()
+
+        finished.append(shard["id"])
+        if stream is not None and "error" in record:
+            print(f"{shard['id']}: {shard['template']} {shard['start']}-{shard['stop']}, failed: {record['error']}",
+                  file=stream)
+        elif stream is not None:
+            print(f"{shard['id']}: {shard['template']} {shard['start']}-{shard['stop']}, wrote {record['count']} "
+                  f"variations in {time.perf_counter() - start:.2f}s", file=stream)
+
+    return finished
+
+
+def get_run_status(run_directory):
+    """ Gets the progress of a sharded run.
+
+        :param run_directory a path to the shared directory of the run
+        :return a dictionary of the number of shards in total, done, failed to compile, which are counted as done
+            too, and claimed, and the checkpoint of each claim """
+
+    manifest = read_manifest(run_directory)
+
+    done = 0
+    failed = 0
+    claims = {}
+    for shard in manifest["shards"]:
+        record = read_json(os.path.join(run_directory, "done", shard["id"] + ".json"))
+        if record is not None:
+            done += 1
+            failed += "error" in record
+            continue
+
+        try:
+            checkpoint = read_json(os.path.join(run_directory, "claims", shard["id"] + ".json"))
+        except ValueError:
+            checkpoint = None   # being created
+        if checkpoint is not None:
+            claims[shard["id"]] = checkpoint
+
+    return {"total": len(manifest["shards"]), "done": done, "failed": failed, "claimed": len(claims),
+            "claims": claims}
+
+
+def merge_run(run_directory, destination):
+    """ Merges the output of every shard of a finished run into one set of files per template, as if the whole run
+        had been written by a single writer. Compressed JSON lines are joined without being decompressed, as a
+        gzip file may hold many compressed members one after another, and token records are simply concatenated.
+
+        :param run_directory a path to the shared directory of the run
+        :param destination a path to the directory the merged files are written to, it is created if needed
+        :return a list of the paths of the merged files, possibly a RunException is thrown if a shard is not
+            finished or failed to compile """
+
+    manifest = read_manifest(run_directory)
+    output_format = manifest["format"]
+
+    shard_files = {}
+    for shard in manifest["shards"]:
+        record = read_json(os.path.join(run_directory, "done", shard["id"] + ".json"))
+        if record is None:
+            raise RunException(f"The shard {shard['id']} is not finished")
+        if "error" in record:
+            raise RunException(f"The shard {shard['id']} failed to compile: {record['error']}")
+
+        shard_directory = os.path.join(run_directory, "shards", shard["id"])
+        shard_files.setdefault(shard["template"], []).extend(
+            [os.path.join(shard_directory, filename) for filename in record["files"]])
+
+    os.makedirs(destination, exist_ok=True)
+
+    merged_paths = []
+    for name, paths in shard_files.items():
+        if output_format == "py":
+            for path in paths:
+                merged_paths.append(shutil.copy(path, destination))
+            continue
+
+        # files are joined in order, starting a new one whenever the size limit would be passed
+        groups = []
+        group_bytes = 0
+        for path in paths:
+            size = os.path.getsize(path)
+            if len(groups) == 0 or (group_bytes > 0 and group_bytes + size > manifest["max_shard_bytes"]):
+                groups.append([])
+                group_bytes = 0
+            groups[-1].append(path)
+            group_bytes += size
+
+        for number, group in enumerate(groups):
+            merged_path = os.path.join(destination, f"{name}-{number:05d}{WRITERS[output_format].extension}")
+            if output_format == "tar":
+                with tarfile.open(merged_path, "w", format=tarfile.PAX_FORMAT) as merged:
+                    for path in group:
+                        with tarfile.open(path, "r") as shard_tar:
+                            for info in shard_tar:
+                                merged.addfile(info, shard_tar.extractfile(info))
+            else:
+                with open(merged_path, "wb") as merged:
+                    for path in group:
+                        with open(path, "rb") as f:
+                            shutil.copyfileobj(f, merged)
+            merged_paths.append(merged_path)
+
+    return merged_paths
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Creates, works on, and merges sharded runs of .vy templates.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    create_parser = subparsers.add_parser("create", help="create a run in a shared directory")
+    create_parser.add_argument("run", help="the shared directory of the run")
+    create_parser.add_argument("templates", nargs="+", help="the .vy files, or directories of .vy files, to compile")
+    create_parser.add_argument("--count", type=int, default=5, help="the number of variations to compile per template")
+    create_parser.add_argument("--seed", type=int, default=0, help="the seed of the run")
+    create_parser.add_argument("--format", choices=sorted(WRITERS), default="jsonl", help="the output format")
+    create_parser.add_argument("--shard-size", type=int, default=DEFAULT_SHARD_BYTES,
+                               help="the size in bytes of each output file")
+    create_parser.add_argument("--shard-variants", type=int, default=SHARD_VARIANTS,
+                               help="the number of variations of a template in each shard of the run")
+    create_parser.add_argument("--fast-random", action="store_true",
+                               help="make integers and choices from single random floats")
+    create_parser.add_argument("--lazy", action="store_true", help="collapse nested collections depth first")
+
+    work_parser = subparsers.add_parser("work", help="claim and finish unfinished shards of a run")
+    work_parser.add_argument("run", help="the shared directory of the run")
+    work_parser.add_argument("--node", default=None, help="the identifier of this node, defaults to host and pid")
+    work_parser.add_argument("--jobs", type=int, default=None, help="the number of worker processes, defaults to the CPU count")
+    work_parser.add_argument("--lease", type=float, default=LEASE_SECONDS,
+                             help="the number of seconds after which a claim with no checkpoint may be taken over")
+
+    status_parser = subparsers.add_parser("status", help="report the progress of a run")
+    status_parser.add_argument("run", help="the shared directory of the run")
+
+    merge_parser = subparsers.add_parser("merge", help="merge the output of a finished run")
+    merge_parser.add_argument("run", help="the shared directory of the run")
+    merge_parser.add_argument("destination", help="the directory to write the merged files to")
+
+    args = parser.parse_args()
+
+    try:
+        if args.command == "create":
+            manifest = create_run(args.run, args.templates, args.count, args.seed, args.format, args.shard_size,
+                                  args.shard_variants, args.fast_random, args.lazy)
+            print(f"Created a run of {len(manifest['templates'])} templates in {len(manifest['shards'])} shards")
+        elif args.command == "work":
+            finished = run_node(args.run, args.node, args.jobs, lease_seconds=args.lease, stream=sys.stderr)
+            print(f"Finished {len(finished)} shards")
+        elif args.command == "status":
+            status = get_run_status(args.run)
+            print(f"{status['done']} of {status['total']} shards done, {status['failed']} of them failed, "
+                  f"{status['claimed']} claimed")
+            for shard_id, checkpoint in sorted(status["claims"].items()):
+                print(f"    {shard_id}: {checkpoint['node']}, {checkpoint['written']} variations written, "
+                      f"last checkpoint {time.time() - checkpoint['checkpointed']:.0f}s ago")
+        else:
+            print(f"Merged into {len(merge_run(args.run, args.destination))} files")
+    except (RunException, FileNotFoundError) as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
@@ -1,5 +1,27 @@
 import varithon as V
-import subprocess
+import cache
+import cli
+import dedup
+import emit
+import fast_random
+import parallel
+import profiling
+import project
+import service
+import sharded_run
+import variant_space
+import verify
+import watch
+import writers
+from commands.command import collapsed_arena
+import asyncio
+import gzip
+import io
+import json
+import math
+import os
+import random
+import tracemalloc
 
 # how many times to attempt tests
 TEST_ATTEMPTS = 10
@@ -37,11 +59,521 @@ def test_collection_rand_a():
     assert_varithon_output("test_collection_rand_a", None, "")
 
 
+def test_compile_many():
+    parsed = V.parse_varithon_file("tests/test_collection_d.vy")
+
+    variants = list(V.compile_many(parsed, TEST_ATTEMPTS))
+
+    assert len(variants) == TEST_ATTEMPTS
+    for variant in variants:
+        assert V.COMMAND_START not in variant
+        compile(variant, "test_collection_d", "exec")
+
+
+def test_compile_parallel():
+    parsed = V.parse_varithon_file("tests/test_collection_rand_a.vy")
+
+    serial = list(parallel.compile_parallel(parsed, TEST_ATTEMPTS, jobs=1, seed=7, chunk_size=3))
+    pooled = list(parallel.compile_parallel(parsed, TEST_ATTEMPTS, jobs=3, seed=7, chunk_size=3))
+
+    assert len(serial) == TEST_ATTEMPTS
+    assert serial == pooled
+
+
+def test_compile_variant_random_access():
+    parsed = V.parse_varithon_file("tests/test_collection_rand_a.vy")
+
+    variants = list(V.compile_many(parsed, TEST_ATTEMPTS, seed=3))
+
+    for index in reversed(range(TEST_ATTEMPTS)):
+        assert V.compile_variant(parsed, 3, index) == variants[index]
+
+
+def test_syntax_error_position():
+    try:
+        V.parse_varithon_string("print(1)\nx = ~[collection -b 2 {collection \"a\"]~\n", "test.vy")
+    except V.VarithonSyntaxException as e:
+        assert (e.filepath, e.line, e.column) == ("test.vy", 2, 23)
+    else:
+        assert False, "expected a VarithonSyntaxException"
+
+
+def test_parse_cache(tmp_path):
+    parsed = cache.load_varithon_file("tests/test_collection_d.vy", tmp_path)
+    cached = cache.load_varithon_file("tests/test_collection_d.vy", tmp_path)
+
+    assert len(list(tmp_path.iterdir())) == 1
+    assert V.compile_variant(cached, 1, 2) == V.compile_variant(parsed, 1, 2)
+
+
+def test_jsonl_shard_writer(tmp_path):
+    parsed = V.parse_varithon_file("tests/test_var_get_a.vy")
+
+    with writers.JSONLShardWriter(tmp_path, "test_var_get_a", max_shard_bytes=100, buffer_bytes=50) as writer:
+        for i, source in enumerate(V.compile_many(parsed, TEST_ATTEMPTS, seed=4)):
+            writer.write("test_var_get_a", i, 4, source)
+
+    records = []
+    for path in writer.shard_paths:
+        with gzip.open(path, "rt") as f:
+            records.extend([json.loads(line) for line in f])
+
+    assert len(writer.shard_paths) > 1
+    assert [record["index"] for record in records] == list(range(TEST_ATTEMPTS))
+    for record in records:
+        assert record["source"] == V.compile_variant(parsed, record["seed"], record["index"])
+
+
+def test_dedup():
+    parsed = V.parse_varithon_file("tests/test_var_get_a.vy")
+    variants = list(V.compile_many(parsed, 200, seed=5))
+
+    exact = dedup.Deduplicator()
+    bloom = dedup.Deduplicator(dedup.BloomFilter(200))
+
+    unique = list(exact.filter(enumerate(variants)))
+
+    assert [source for _, source in unique] == list(dict.fromkeys(variants))
+    assert exact.duplicate_count == 200 - len(unique)
+    assert list(bloom.filter(enumerate(variants))) == unique
+
+
+def test_variant_space():
+    parsed = V.parse_varithon_file("tests/test_var_get_a.vy")
+
+    space = variant_space.VariantSpace(parsed)
+    variants = list(space)
+
+    assert len(space) == 32     # 7 fixed names and 25 single letters, as the letter 'a' is already a fixed name
+    assert len(set(variants)) == len(variants)
+    assert set(space.sample(10, seed=1)) <= set(variants)
+    assert len(set(space.sample(len(space), seed=1))) == len(space)
+    assert set(V.compile_many(parsed, 200, seed=2)) <= set(variants)
+    assert variant_space.count_variants(V.parse_varithon_file("tests/test_collection_rand_a.vy")) == math.inf
+
+
+def test_verification_pool():
+    sources = ["print(1)", "x = 1\nprint(x)", "print(x)", "while True:\n    pass"]
+
+    with verify.VerificationPool(jobs=2, timeout=0.5, chunk_size=1) as pool:
+        results = list(pool.run(sources))
+        failures = pool.verify(sources, "1", "")
+
+    assert [result.timed_out for result in results] == [False, False, False, True]
+    assert "NameError" in results[2].stderr     # every variation runs with its own globals
+    assert [index for index, _, _ in failures] == [2, 3]
+
+
+def test_profiler():
+    parsed = V.parse_varithon_file("tests/test_var_get_b.vy")
+    collapse = V.Var.collapse
+
+    with profiling.Profiler("tests/test_var_get_b.vy") as profiler:
+        list(V.compile_many(parsed, TEST_ATTEMPTS, seed=6))
+
+    report = profiler.to_json()
+
+    assert V.Var.collapse is collapse
+    assert report["variants"] == TEST_ATTEMPTS
+    assert report["passes"] == TEST_ATTEMPTS
+    assert report["commands"]["var"]["calls"] == 9 * TEST_ATTEMPTS
+    assert report["lines"]["13"]["get"]["calls"] == TEST_ATTEMPTS
+
+
+def test_many_variables():
+    source = "".join([f"~[var v{i}]~ = {i}\n" for i in range(1000)]) + "print(~[get v0]~ + ~[get v999]~)\n"
+    parsed = V.parse_varithon_string(source)
+
+    with verify.VerificationPool(jobs=1) as pool:
+        assert pool.verify(V.compile_many(parsed, 3), "999", "") == []
+
+
+def test_large_collection_literal(tmp_path):
+    parsed = V.parse_varithon_string("x = ~[collection -b 20000 7]~\nprint(len(x), sum(x))\n")
+
+    for index in range(TEST_ATTEMPTS):
+        V.compile_varithon_file(tmp_path / "large.py", parsed, V.variant_rng(8, index))
+        with open(tmp_path / "large.py") as f:
+            assert f.read() == V.compile_variant(parsed, 8, index)
+
+    with verify.VerificationPool(jobs=1) as pool:
+        assert pool.verify(V.compile_many(parsed, TEST_ATTEMPTS), "20000 140000", "") == []
+
+
+def test_immutable_commands(monkeypatch):
+    parsed = V.parse_varithon_file("tests/test_collection_d.vy")
+    command = next(item for line in parsed for item in line if isinstance(item, V.Command))
+
+    assert isinstance(command.tokens, tuple) and isinstance(command.sub_commands, tuple)
+    try:
+        command.collapsed = None
+    except AttributeError:
+        pass
+    else:
+        assert False, "expected commands to hold no state of a compilation"
+
+    first = V.compile_variant(parsed, 9, 0)
+    free = list(collapsed_arena.free)
+
+    assert len(free) > 0
+    assert V.compile_variant(parsed, 9, 0) == first
+    assert all(collapsed.tokens is None for collapsed in collapsed_arena.free)
+    assert {id(collapsed) for collapsed in free} <= {id(collapsed) for collapsed in collapsed_arena.free}
+
+    # Collapsed objects given back to the arena are poisoned rather than reused, so any later use of one shows up
+    def release(arena, collapsed):
+        collapsed.pre_lines.clear()
+        collapsed.result = "<released>"
+        collapsed.post_lines.clear()
+
+    monkeypatch.setattr(type(collapsed_arena), "release", release)
+    parsed_line_lists = [V.parse_varithon_file(f"tests/{name}") for name in sorted(os.listdir("tests"))
+                         if name.endswith(".vy")]
+    parsed_line_lists.append(V.parse_varithon_string("~[var a {collection -b 1 q}]~ = 3\nprint(~[get a]~)\n"))
+    for parsed in parsed_line_lists:
+        for i in range(TEST_ATTEMPTS):
+            assert "<released>" not in V.compile_variant(parsed, 0, i)
+            assert "<released>" not in V.compile_variant(parsed, 0, i, lazy=True)
+
+
+def test_cli(tmp_path, capsys):
+    status = cli.main(["tests", "--count", str(TEST_ATTEMPTS), "--jobs", "2", "--seed", "2", "--format", "jsonl",
+                       "--out", str(tmp_path), "--no-cache", "--progress-interval", "0"])
+
+    shards = sorted(path.name for path in tmp_path.iterdir())
+    with gzip.open(tmp_path / "test_var_get_a-00000.jsonl.gz", "rt") as f:
+        records = [json.loads(line) for line in f]
+    report = capsys.readouterr().err
+
+    assert status == 0
+    assert len(shards) == 8
+    assert [record["source"] for record in records] == list(V.compile_many(V.parse_varithon_file(
+        "tests/test_var_get_a.vy"), TEST_ATTEMPTS, seed=2))
+    assert f"Compiled {8 * TEST_ATTEMPTS} variations of 8 templates" in report
+    assert f"{8 * TEST_ATTEMPTS}/{8 * TEST_ATTEMPTS} variations" in report
+    assert cli.main(["tests/missing.vy"]) == 1
+
+    (tmp_path / "unknown.vy").write_text("print(~[get nope]~)\n")
+    assert cli.main([str(tmp_path / "unknown.vy"), "--out", str(tmp_path / "unknown"), "--jobs", "1", "--quiet"]) == 1
+    assert "unknown: Varithon variable 'nope' not found." in capsys.readouterr().err
+    assert cli.main(["tests/test_var_get_a.vy", "--count", "0", "--dedup", "bloom", "--out", str(tmp_path / "none"),
+                     "--quiet"]) == 0
+
+    # templates of the same name in different directories would be written to the same files
+    for directory in ["a", "b"]:
+        (tmp_path / directory).mkdir()
+        (tmp_path / directory / "t.vy").write_text("print(1)\n")
+    assert cli.main([str(tmp_path / "a" / "t.vy"), str(tmp_path / "b" / "t.vy"), "--out", str(tmp_path / "twice"),
+                     "--quiet"]) == 1
+    assert "Two templates are both named 't'" in capsys.readouterr().err
+    assert not (tmp_path / "twice").exists()
+
+
+def test_watch(tmp_path):
+    template = tmp_path / "template.vy"
+    lines = [f"~[var v{i}]~ = {i}\n" for i in range(100)] + ["print(~[get v0]~)\n"]
+    template.write_text("".join(lines))
+
+    watcher = watch.Watcher([str(tmp_path)], str(tmp_path / "preview"), preview_count=3, seed=1, stream=io.StringIO())
+
+    assert watcher.poll() == ["template"]
+    assert watcher.poll() == []
+
+    lines[-1] = "print(~[get v99]~)\n"
+    template.write_text("".join(lines) + "x = ~[get missing]~\n")
+
+    assert watcher.poll() == []     # the missing variable is only found once compiled, the lines are still parsed
+    template.write_text("".join(lines))
+
+    assert watcher.poll() == ["template"]
+    assert "parsed 0 of 101 lines" in watcher.stream.getvalue().splitlines()[-1]
+    assert (tmp_path / "preview" / "template_2.py").read_text() == V.compile_variant(
+        V.parse_varithon_file(str(template)), 1, 2)
+
+
+def test_fold_constants():
+    parsed = V.parse_varithon_file("tests/test_var_get_b.vy")
+    folded = V.fold_constants(parsed)
+
+    assert len(folded) < len(parsed)
+    assert V.fold_constants(folded) is folded
+    assert all(V.contains_command(folded[i]) for i in folded.command_indices)
+    assert [folded.line_numbers[i] for i in folded.command_indices] == [
+        i + 1 for i, line in enumerate(parsed) if V.contains_command(line)]
+    for index in range(TEST_ATTEMPTS):
+        assert V.compile_variant(folded, 4, index) == V.compile_variant(parsed, 4, index)
+
+
+def test_fast_random():
+    fast = fast_random.FastRandom("1:2")
+    standard = random.Random("1:2")
+
+    assert [fast.random() for _ in range(100)] == [standard.random() for _ in range(100)]
+    assert {fast.randint(3, 7) for _ in range(1000)} == {3, 4, 5, 6, 7}
+    assert {fast.choice("abc") for _ in range(1000)} == {"a", "b", "c"}
+
+    parsed = V.parse_varithon_file("tests/test_collection_rand_a.vy")
+    serial = list(parallel.compile_parallel(parsed, TEST_ATTEMPTS, jobs=1, seed=3, fast_random=True))
+    pooled = list(parallel.compile_parallel(parsed, TEST_ATTEMPTS, jobs=2, seed=3, chunk_size=3, fast_random=True))
+
+    assert serial == pooled == list(V.compile_many(parsed, TEST_ATTEMPTS, seed=3, fast_random=True))
+    with verify.VerificationPool(jobs=1) as pool:
+        assert pool.verify(serial, None, "") == []
+
+    try:
+        fast.randint(5, 1)
+    except ValueError:
+        pass
+    else:
+        assert False, "expected an empty range to be refused"
+
+
+def test_generation_service():
+    parsed = V.parse_varithon_file("tests/test_var_get_a.vy")
+
+    async def fetch():
+        templates = {"var get a": parsed, "missing_variable": V.parse_varithon_string("~[get x]~\n")}
+        async with service.GenerationService(templates, jobs=2, seed=5, prefetch_count=4, chunk_size=3) as generator:
+            address = await generator.start()
+            loop = asyncio.get_running_loop()
+
+            records = await loop.run_in_executor(None, lambda: list(service.fetch_variants(
+                address, "var get a", TEST_ATTEMPTS, timeout=30)))
+            queued = generator.queues["var get a"].qsize()
+
+            try:
+                await loop.run_in_executor(None, lambda: list(service.fetch_variants(
+                    address, "missing_variable", 1, timeout=30)))
+            except LookupError:
+                pass
+            else:
+                assert False, "expected a template which fails to compile to be reported"
+
+            # a worker which dies is replaced, and its chunks are compiled again
+            for process in list(generator.executor._processes.values()):
+                process.kill()
+            records += await loop.run_in_executor(None, lambda: list(service.fetch_variants(
+                address, "var get a", TEST_ATTEMPTS, timeout=30)))
+
+            return records, queued
+
+    records, queued = asyncio.run(fetch())
+
+    assert queued <= 4  # the queue refills only up to its bound
+    assert [record["index"] for record in records] == list(range(2 * TEST_ATTEMPTS))
+    assert [record["source"] for record in records] == list(V.compile_many(parsed, 2 * TEST_ATTEMPTS, seed=5))
+
+
+def test_sharded_run(tmp_path, monkeypatch):
+    monkeypatch.setenv("VARITHON_CACHE_DIR", str(tmp_path / "cache"))
+    run_directory = tmp_path / "run"
+    manifest = sharded_run.create_run(run_directory, ["tests/test_var_get_a.vy", "tests/test_rand_a.vy"],
+                                      TEST_ATTEMPTS, seed=6, shard_variants=7)
+    shard_ids = [shard["id"] for shard in manifest["shards"]]
+
+    # a node which was stopped part way through its shard, and a node still working on its shard
+    stopped = sharded_run.ShardClaim(run_directory, shard_ids[0], "stopped")
+    working = sharded_run.ShardClaim(run_directory, shard_ids[1], "working")
+    assert stopped.acquire() and working.acquire()
+    os.utime(stopped.path, (0, 0))
+    (run_directory / "shards" / f"{shard_ids[0]}.stopped.tmp").mkdir()
+
+    assert sharded_run.run_node(run_directory, "a", jobs=1, max_shards=2, lease_seconds=math.inf) == shard_ids[2:4]
+    finished = sharded_run.run_node(run_directory, "b", jobs=1, lease_seconds=60)
+    assert shard_ids[0] in finished and shard_ids[1] not in finished
+    assert sharded_run.get_run_status(run_directory)["claims"][shard_ids[1]]["node"] == "working"
+
+    assert not (run_directory / "shards" / f"{shard_ids[0]}.stopped.tmp").exists()
+
+    # a node which stopped after moving its output into place, but before recording the shard as done
+    def stop(path, value):
+        raise RuntimeError("stopped")
+
+    working.release()
+    with monkeypatch.context() as m:
+        m.setattr(sharded_run, "write_json_atomic", stop)
+        try:
+            sharded_run.run_node(run_directory, "working", jobs=1)
+        except RuntimeError:
+            pass
+        else:
+            assert False, "expected the node to stop"
+    assert (run_directory / "shards" / shard_ids[1]).exists()
+
+    assert sharded_run.run_node(run_directory, "a", jobs=1) == [shard_ids[1]]
+    assert sharded_run.get_run_status(run_directory)["done"] == len(shard_ids)
+
+    records = {}
+    for path in sharded_run.merge_run(run_directory, tmp_path / "merged"):
+        with gzip.open(path, "rt") as f:
+            for line in f:
+                record = json.loads(line)
+                records.setdefault(record["template"], []).append(record["source"])
+
+    for name in ["test_var_get_a", "test_rand_a"]:
+        parsed = V.parse_varithon_file(f"tests/{name}.vy")
+        assert records[name] == list(V.compile_many(parsed, TEST_ATTEMPTS, seed=6))
+
+    # a template which fails to compile is recorded as failed rather than being retried by every node
+    (tmp_path / "unknown.vy").write_text("print(~[get nope]~)\n")
+    failing_directory = tmp_path / "failing"
+    sharded_run.create_run(failing_directory, [str(tmp_path / "unknown.vy")], 2)
+    assert sharded_run.run_node(failing_directory, "a", jobs=1) == ["000000"]
+    assert sharded_run.run_node(failing_directory, "b", jobs=1) == []
+    status = sharded_run.get_run_status(failing_directory)
+    assert status["done"] == status["failed"] == 1 and status["claimed"] == 0
+    try:
+        sharded_run.merge_run(failing_directory, tmp_path / "failing-merged")
+    except sharded_run.RunException as e:
+        assert "unknown: Varithon variable 'nope' not found." in str(e)
+    else:
+        assert False, "expected a run with a failed shard to be refused"
+
+
+def test_token_emission(tmp_path):
+    status = cli.main(["tests/test_collection_d.vy", "--count", str(TEST_ATTEMPTS), "--jobs", "2", "--seed", "3",
+                       "--format", "tokens", "--out", str(tmp_path), "--no-cache", "--quiet"])
+    records = list(emit.iter_token_records(tmp_path / "test_collection_d-00000.vyt"))
+
+    assert status == 0
+    assert [record["index"] for record in records] == list(range(TEST_ATTEMPTS))
+    assert [record["source"] for record in records] == list(V.compile_many(V.parse_varithon_file(
+        "tests/test_collection_d.vy"), TEST_ATTEMPTS, seed=3))
+    for record in records:
+        assert record["tokens"] == emit.tokenize_source(record["source"])
+
+    # shards may be concatenated, but those written by another python version are refused
+    shard = (tmp_path / "test_collection_d-00000.vyt").read_bytes()
+    (tmp_path / "joined.vyt").write_bytes(shard + shard)
+    assert [record["source"] for record in emit.iter_token_records(tmp_path / "joined.vyt")] == 2 * [
+        record["source"] for record in records]
+    (tmp_path / "old.vyt").write_bytes(emit.SHARD_MAGIC + bytes([emit.TOKEN_FORMAT, 3, 1]) + shard[
+        len(emit.SHARD_HEADER):])
+    try:
+        list(emit.iter_token_records(tmp_path / "old.vyt"))
+    except ValueError as e:
+        assert "python 3.1" in str(e)
+    else:
+        assert False, "expected a shard written by another python version to be refused"
+
+    source = "x = '''a\nb'''\nif x:\n    print(x,\n  1)"    # spanning lines, with no final newline
+    assert emit.decode_tokens(emit.encode_tokens(source)) == (source, emit.tokenize_source(source))
+
+    # a variation which does not tokenize is written with its error rather than stopping the run
+    template = tmp_path / "unclosed.vy"
+    template.write_text("print((~[rand -i 1 9]~)\n")
+    status = cli.main([str(template), "--count", "3", "--format", "tokens", "--out", str(tmp_path), "--no-cache",
+                       "--quiet"])
+    records = list(emit.iter_token_records(tmp_path / "unclosed-00000.vyt"))
+    assert status == 0
+    assert [record["index"] for record in records] == [0, 1, 2]
+    for record in records:
+        assert record["tokens"] is None and record["error"].startswith("TokenError")
+    assert emit.decode_tokens(emit.encode_tokens(records[0]["source"])) == (records[0]["source"], None)
+
+
+def test_verified_cache(tmp_path):
+    parsed = V.parse_varithon_file("tests/test_var_get_b.vy")
+    variants = list(V.compile_many(parsed, TEST_ATTEMPTS))
+
+    assert verify.get_fingerprint("a = 1\nprint(a)\n") == verify.get_fingerprint("b = 1\nprint(b)\n")
+    assert verify.get_fingerprint("a = 1\nprint(a)\n") != verify.get_fingerprint("b = 1\nprint(a)\n")
+    assert verify.get_fingerprint("print(1, sep='')") != verify.get_fingerprint("print(1, end='')")
+    assert verify.get_fingerprint("a = 1\nprint(f'{a=}')") != verify.get_fingerprint("b = 1\nprint(f'{b=}')")
+
+    with verify.VerificationPool(jobs=1) as pool:
+        assert pool.verify(variants, "var2", "", verify.get_verified_cache(tmp_path)) == []
+        assert pool.run_count == 1  # every variation differs only in its names
+
+        # a new run reads the verified fingerprints back, and only checks against the same expected output
+        assert pool.verify(variants, "var2", "", verify.get_verified_cache(tmp_path)) == []
+        assert pool.run_count == 1
+        assert len(pool.verify(variants, "var3", "", verify.get_verified_cache(tmp_path))) == TEST_ATTEMPTS
+        assert pool.run_count == 2
+
+
+def test_project_build(tmp_path, monkeypatch):
+    monkeypatch.setenv("VARITHON_CACHE_DIR", str(tmp_path / "cache"))
+    directory = tmp_path / "project"
+    (directory / "lists").mkdir(parents=True)
+    for name in ["test_var_get_a", "test_var_get_b", "test_collection_d"]:
+        (directory / "lists" / f"{name}.vy").write_text(open(f"tests/{name}.vy").read())
+    (directory / "broken.vy").write_text("x = ~[get x\n")
+    (directory / "failing.vy").write_text("print(~[get nope]~)\n")
+    (directory / project.PROJECT_FILENAME).write_text(json.dumps({"total": 31, "templates": {
+        "lists.test_var_get_a": {"count": 4}, "lists.test_collection_d": {"weight": 2}, "failing": {"count": 2}}}))
+
+    registry, template_stats = project.build_project(directory, tmp_path / "out", jobs=2, seed=9,
+                                                     output_format="jsonl", chunk_size=3)
+
+    # the 25 variations left over are shared by weight, the broken template keeps its share, and the template
+    # which fails to compile is reported without stopping the others
+    assert {template.name: template.variant_count for template in template_stats} == {
+        "failing": 0, "lists.test_collection_d": 13, "lists.test_var_get_a": 4, "lists.test_var_get_b": 6}
+    assert list(registry.errors) == ["broken", "failing"]
+    assert registry.errors["failing"] == "failing: Varithon variable 'nope' not found."
+    for template in template_stats[1:]:
+        with gzip.open(tmp_path / "out" / f"{template.name}-00000.jsonl.gz", "rt") as f:
+            sources = [json.loads(line)["source"] for line in f]
+        assert sources == list(V.compile_many(registry[template.name], template.quota, seed=9))
+    assert "lists.test_collection_d" in project.get_summary(template_stats)
+
+    # settings of the wrong type are refused on loading, naming the template they belong to
+    for settings in [{"count": "4"}, {"count": -1}, {"count": 2.5}, {"weight": "2"}, {"weight": -1}, {"weight": True}]:
+        (directory / project.PROJECT_FILENAME).write_text(json.dumps({"templates": {"lists.test_var_get_a": settings}}))
+        try:
+            project.load_project_config(directory)
+        except project.ProjectException as e:
+            assert "'lists.test_var_get_a'" in str(e)
+        else:
+            assert False, f"expected {settings} to be refused"
+
+
+def test_lazy_expansion(tmp_path):
+    assert_varithon_output("test_var_get_a", "5", "", lazy=True)
+    assert_varithon_output("test_collection_b", "500", "", lazy=True)
+    assert_varithon_output("test_collection_d", "[[['a'], ['a']], [['a'], ['a']], [['a'], ['a']]]", "", lazy=True)
+
+    template = tmp_path / "nested.vy"
+    template.write_text("x = ~[collection -b 300 {collection -b 3 {rand -i 1 9}}]~\nprint(len(x))\n")
+    parsed = V.parse_varithon_file(str(template))
+    sources = [V.compile_variant(parsed, 4, i, lazy=True) for i in range(10)]
+    assert sources == [V.compile_variant(parsed, 4, i, lazy=True) for i in range(10)]
+
+    V.compile_varithon_file(tmp_path / "lazy.py", parsed, V.variant_rng(4, 0), lazy=True)
+    assert (tmp_path / "lazy.py").read_text() == sources[0]
+
+    # with one job each variation is streamed into its record, with more it is compiled lazily by the workers
+    for jobs, output_format in [("1", "jsonl"), ("1", "py"), ("2", "jsonl")]:
+        out = tmp_path / f"{output_format}-{jobs}"
+        assert cli.main([str(template), "--count", "10", "--jobs", jobs, "--seed", "4", "--format", output_format,
+                         "--out", str(out), "--lazy", "--no-cache", "--quiet"]) == 0
+        if output_format == "py":
+            assert [(out / f"nested_{i}.py").read_text() for i in range(10)] == sources
+        else:
+            with gzip.open(out / "nested-00000.jsonl.gz", "rt") as f:
+                records = [json.loads(line) for line in f]
+            assert [record["source"] for record in records] == sources
+            assert all(record["lazy"] for record in records)
+
+    # the names of the lists built by appending are released once each is built, so memory does not grow with size
+    peaks = []
+    for size in [1000, 10000]:
+        parsed = V.parse_varithon_string(f"x = ~[collection -b {size} {{collection -b 3 {{rand -i 1 9}}}}]~\n")
+        tracemalloc.start()
+        chunks = V.iter_variant_chunks(parsed, 0, 10)
+        assert ".append(" in next(chunks)     # this variation builds its list by appending
+        assert sum(len(chunk) for chunk in chunks) > 40 * size
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    assert peaks[1] < 2 * peaks[0]
+
+
 ############################################################################
 ############################ Helper Functions ##############################
 ############################################################################
 
-def assert_varithon_output(filename, expected_output, expected_error):
+def assert_varithon_output(filename, expected_output, expected_error, lazy=False):
     """ Tests a Varithon file numerous times, in order to ensure that the resulting compiled
         Python files all have the exact same behaviour.
 
@@ -51,18 +583,18 @@ def assert_varithon_output(filename, expected_output, expected_error):
             string, if the actual output does not match this, an assertion error is thrown.
             If this is None, the output will not be tested.
         :param expected_error the expected error of the resulting compiled Python files as a
-            string, if the actual error does not match this, an assertion error is thrown """
+            string, if the actual error does not match this, an assertion error is thrown
+        :param lazy whether to compile the variations with lazy expansion, see V.iter_collapsed_lines """
 
     parsed = V.parse_varithon_file(f"tests/{filename}.vy")
 
-    for _ in range(TEST_ATTEMPTS):
-        V.compile_varithon_file(f"compiled/{filename}.py", parsed)
-        process = subprocess.Popen(f"python compiled/{filename}.py", stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-
-        output, error = process.communicate()
+    with verify.VerificationPool(jobs=2) as pool:
+        failures = pool.verify(V.compile_many(parsed, TEST_ATTEMPTS, lazy=lazy), expected_output, expected_error)
 
+    for index, source, result in failures:
+        assert not result.timed_out, source
         # strip white spacing from results before testing
         if expected_output is not None:
-            assert output.decode().strip() == expected_output
+            assert verify.normalize_output(result.stdout) == verify.normalize_output(expected_output), source
         if expected_error is not None:
-            assert error.decode().strip() == expected_error
+            assert verify.normalize_output(result.stderr) == verify.normalize_output(expected_error), source
@@ -1,26 +1,139 @@
-import random
+import math
 
-from commands.command import Command
 
-def get_list_literal_string(collection):
+# the probability that a list literal is split into two concatenated lists before any single element
+CONCAT_PROBABILITY = 0.01
+
+# list literals with at least this many elements draw the points they are split at in bulk
+BATCH_DRAW_THRESHOLD = 64
+
+# the number of elements written at once when a list literal is streamed
+LITERAL_CHUNK_SIZE = 64
+
+
+class StreamedToken(object):
+    """ StreamedToken is a token which may be very large, so it is written out in chunks rather than being held
+        in memory as a single string. Every random decision of the token is made when it is created, so it is
+        the same however many times it is written. """
+
+    def iter_chunks(self):
+        """ Gets the string representation of this token in chunks.
+
+            :return a generator yielding strings, which joined together are the string representation """
+
+        raise NotImplementedError
+
+    def __str__(self):
+        return "".join(self.iter_chunks())
+
+
+class RepeatedListLiteral(StreamedToken):
+    """ RepeatedListLiteral is a list literal consisting of a single element repeated many times. Only the element
+        and the points the literal is split at are stored, so its memory does not depend on its size. """
+
+    def __init__(self, element, size, rng):
+        """ Constructs a RepeatedListLiteral, making every random decision of the literal.
+
+            :param element the string representation of the element
+            :param size the number of elements
+            :param rng the random.Random instance of this compilation, all random decisions are drawn from it """
+
+        self.element = element
+        self.size = size
+        self.spacing = get_list_literal_spacing(rng)
+        self.concat_positions = get_concat_positions(size, rng)
+
+    def iter_chunks(self):
+        return iter_list_literal_chunks(lambda start, end: [self.element] * (end - start), self.size,
+                                        self.spacing, self.concat_positions)
+
+
+def get_list_literal_spacing(rng):
+    """ Decides the spacing used after the commas and around the plus signs of a list literal.
+
+        :param rng the random.Random instance of this compilation, all random decisions are drawn from it
+        :return the spacing as a string """
+
+    return " " if rng.random() < 0.7 else ""
+
+
+def get_concat_positions(size, rng):
+    """ Decides the points a list literal is split at into concatenated lists, every element but the first is
+        preceded by a split with a probability of CONCAT_PROBABILITY. For large literals, rather than making a
+        decision per element, the gaps between splits are drawn directly, as they follow a geometric distribution,
+        so only one random draw is made per split.
+
+        :param size the number of elements
+        :param rng the random.Random instance of this compilation, all random decisions are drawn from it
+        :return a sorted list of the indices of the elements which begin a new concatenated list """
+
+    if size < BATCH_DRAW_THRESHOLD:
+        return [i for i in range(1, size) if rng.random() < CONCAT_PROBABILITY]
+
+    rate = -math.log(1 - CONCAT_PROBABILITY)
+
+    positions = []
+    position = 1 + int(rng.expovariate(1.0) / rate)
+    while position < size:
+        positions.append(position)
+        position += 1 + int(rng.expovariate(1.0) / rate)
+
+    return positions
+
+
+def iter_list_literal_chunks(get_elements, size, spacing, concat_positions):
+    """ Writes a list literal in chunks of at most LITERAL_CHUNK_SIZE elements.
+
+        :param get_elements a function given a start and end index, which returns a list of the string
+            representations of the elements between them, or of StreamedTokens
+        :param size the number of elements
+        :param spacing the spacing used after the commas and around the plus signs
+        :param concat_positions a sorted list of the indices of the elements which begin a new concatenated list
+        :return a generator yielding strings, which joined together are the list literal """
+
+    separator = f",{spacing}"
+
+    yield "["
+    start = 0
+    for end in concat_positions + [size]:
+        for chunk_start in range(start, end, LITERAL_CHUNK_SIZE):
+            if chunk_start > start:
+                yield separator
+
+            elements = get_elements(chunk_start, min(chunk_start + LITERAL_CHUNK_SIZE, end))
+            if any(isinstance(element, StreamedToken) for element in elements):
+                # nested streamed tokens are written out piece by piece as well
+                for i, element in enumerate(elements):
+                    if i > 0:
+                        yield separator
+                    if isinstance(element, StreamedToken):
+                        yield from element.iter_chunks()
+                    else:
+                        yield element
+            else:
+                yield separator.join(elements)
+
+        if end < size:  # concat two list
+            yield f"]{spacing}+{spacing}["
+        start = end
+    yield "]"
+
+
+def get_list_literal_string(collection, rng):
     """ Converts a list of tokens into a separate list of tokens that is the given collection of tokens
         represented as a list literal
 
         :param collection a list of tokens
+        :param rng the random.Random instance of this compilation, all random decisions are drawn from it
         :returns a string representation of the given collection """
     if len(collection) == 0:
         return "[]"
 
-    spacing = " " if random.random() < 0.7 else ""
+    spacing = get_list_literal_spacing(rng)
+    concat_positions = get_concat_positions(len(collection), rng)
 
-    s = f"[{collection[0]}"
-    for i in range(1, len(collection)):
-        if random.random() < 0.01: # concat two list
-            s += f"]{spacing}+{spacing}[{collection[i]}"
-        else:
-            s += f",{spacing}{collection[i]}"
-
-    return s + "]"
+    return "".join(iter_list_literal_chunks(lambda start, end: [str(collection[i]) for i in range(start, end)],
+                                            len(collection), spacing, concat_positions))
 
 
 def get_indentation(context):
@@ -33,13 +146,10 @@ def get_indentation(context):
         return context[0]
     return ""
 
-def rand_v_name():
+def rand_v_name(rng):
     """ Creates a random 20 character Varithon variable name. To be used for expanding commands.
 
+        :param rng the random.Random instance of this compilation, all random decisions are drawn from it
         :return a random 20 character Varithon variable name. To be used for expanding commands."""
 
-    v_name = ""
-    for i in range(20):
-        v_name += random.choice("abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ_")
-
-    return v_name
+    return "".join(rng.choices("abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ_", k=20))
@@ -0,0 +1,201 @@
+# Counting and enumeration of the variations of a parsed .vy file. Every variation is the result of a sequence of
+# random decisions, e.g. which name a Var picks, or which layout a Collection uses. Replacing the random.Random of
+# a compilation with a DecisionRandom, which makes each of these decisions from a given list of choices instead,
+# allows the tree of every possible sequence of decisions to be walked, and so every variation to be listed.
+
+import math
+import random
+
+import varithon as V
+from dedup import get_digest
+from errors import *
+
+
+class DecisionRandom(random.Random):
+    """ DecisionRandom is a stand-in for the random.Random of a compilation, which takes its decisions from a
+        fixed list of choices, and records how many options every decision had. Once the given choices run out,
+        every further decision takes its first option, or a random option if explore_rng is given.
+
+        The commands only ever compare random() against a probability, so random() is treated as a decision with
+        two options, one below and one above any probability. Names generated by choices() are not treated as
+        decisions, they are instead drawn from a fixed stream, as they only have to be unique. """
+
+    def __init__(self, choices=(), explore_rng=None):
+        """ Constructs a DecisionRandom.
+
+            :param choices a sequence of integers, the option to take for each of the first decisions
+            :param explore_rng a random.Random used to pick the options of decisions after choices run out,
+                if this is None the first option is always taken """
+
+        super().__init__(0)
+
+        self.forced_choices = choices
+        self.explore_rng = explore_rng
+
+        self.choices_taken = []
+        self.option_counts = []
+
+        self.name_rng = random.Random(0)
+
+    def decide(self, option_count):
+        """ Makes a single decision.
+
+            :param option_count the number of options of the decision
+            :return the integer index of the option taken """
+
+        position = len(self.choices_taken)
+        if position < len(self.forced_choices):
+            option = self.forced_choices[position]
+        elif self.explore_rng is not None:
+            option = self.explore_rng.randrange(option_count)
+        else:
+            option = 0
+
+        self.choices_taken.append(option)
+        self.option_counts.append(option_count)
+
+        return option
+
+    def random(self):
+        return 0.0 if self.decide(2) == 0 else 1.0 - 2 ** -53
+
+    def choice(self, seq):
+        return seq[self.decide(len(seq))]
+
+    def randint(self, a, b):
+        return a + self.decide(b - a + 1)
+
+    def uniform(self, a, b):
+        raise VariantSpaceException("A variation contains a random float, so there are infinitely many variations.",
+                                    infinite=True)
+
+    def expovariate(self, lambd=1.0):
+        # only drawn for list literals large enough that enumerating where they are split is never practical
+        raise VariantSpaceException("A variation contains a list literal too large to enumerate.")
+
+    def choices(self, population, weights=None, *, cum_weights=None, k=1):
+        return self.name_rng.choices(population, weights, cum_weights=cum_weights, k=k)
+
+
+def walk_decisions(parsed_line_list, limit):
+    """ Walks the tree of every possible sequence of decisions for a parsed .vy file, depth first.
+
+        :param parsed_line_list a list of lists, each interior list representing a single line of the Varithon file
+        :param limit the maximum number of sequences to walk before a VariantSpaceException is thrown
+        :return a generator yielding a tuple of the sequence of decisions, and the compiled python source """
+
+    choices = []
+    for _ in range(limit):
+        rng = DecisionRandom(choices)
+        source = V.compile_varithon_string(parsed_line_list, rng)
+
+        yield tuple(rng.choices_taken), source
+
+        # move onto the next sequence, by advancing the last decision which still has options left
+        position = len(rng.choices_taken) - 1
+        while position >= 0 and rng.choices_taken[position] + 1 >= rng.option_counts[position]:
+            position -= 1
+
+        if position < 0:
+            return
+
+        choices = rng.choices_taken[:position]
+        choices.append(rng.choices_taken[position] + 1)
+
+    raise VariantSpaceException(f"There are more than {limit} sequences of decisions to enumerate.")
+
+
+class VariantSpace(object):
+    """ VariantSpace is the set of every distinct variation of a parsed .vy file. Only the sequence of decisions
+        leading to each variation is stored, so variations are compiled again when they are accessed. Each
+        distinct variation has an integer index, from 0 to the number of variations, which can be used to
+        compile it directly, or to sample variations without replacement. """
+
+    def __init__(self, parsed_line_list, limit=100000):
+        """ Constructs the VariantSpace of a parsed .vy file, by enumerating every variation.
+
+            :param parsed_line_list a list of lists, each interior list representing a single line of the Varithon file
+            :param limit the maximum number of sequences of decisions to walk, a VariantSpaceException is thrown
+                if there are more than this, or if there are infinitely many variations """
+
+        self.parsed_line_list = parsed_line_list
+        self.decisions = []
+
+        # different sequences of decisions may lead to the same variation, only the first is kept
+        digests = set()
+        for choices, source in walk_decisions(parsed_line_list, limit):
+            digest = get_digest(source)
+            if digest not in digests:
+                digests.add(digest)
+                self.decisions.append(choices)
+
+    def __len__(self):
+        return len(self.decisions)
+
+    def variant(self, index):
+        """ Compiles the variation with the given index.
+
+            :param index the integer index of the variation, between 0 and the number of variations
+            :return a string containing the compiled python source """
+
+        return V.compile_varithon_string(self.parsed_line_list, DecisionRandom(self.decisions[index]))
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self.variant(index)
+
+    def sample(self, count, seed=None):
+        """ Samples distinct variations without replacement.
+
+            :param count the number of variations to sample, at most the number of variations
+            :param seed an integer seed for the sample, if this is None a seed is chosen by the operating system
+            :return a generator yielding the compiled python source of each sampled variation """
+
+        for index in random.Random(seed).sample(range(len(self)), count):
+            yield self.variant(index)
+
+
+def count_variants(parsed_line_list, limit=100000):
+    """ Exactly counts the distinct variations of a parsed .vy file.
+
+        :param parsed_line_list a list of lists, each interior list representing a single line of the Varithon file
+        :param limit the maximum number of sequences of decisions to walk
+        :return the number of distinct variations, math.inf if there are infinitely many variations,
+            or None if there are more than limit sequences of decisions """
+
+    try:
+        return len(VariantSpace(parsed_line_list, limit))
+    except VariantSpaceException as e:
+        return math.inf if e.infinite else None
+
+
+def estimate_variant_space(parsed_line_list, probes=1000, seed=0):
+    """ Estimates the number of sequences of decisions of a parsed .vy file, which is an upper bound on its
+        number of distinct variations, without walking every sequence. Each probe follows a single random
+        sequence, and multiplies together the number of options of every decision along it, the average of
+        which is an unbiased estimate of the number of sequences (Knuth's estimator).
+
+        :param parsed_line_list a list of lists, each interior list representing a single line of the Varithon file
+        :param probes the number of random sequences to follow
+        :param seed an integer seed for the random sequences
+        :return the estimated number of sequences of decisions as a float, or math.inf if there are
+            infinitely many variations """
+
+    explore_rng = random.Random(seed)
+
+    total = 0
+    for _ in range(probes):
+        rng = DecisionRandom((), explore_rng)
+        try:
+            V.compile_varithon_string(parsed_line_list, rng)
+        except VariantSpaceException as e:
+            if e.infinite:
+                return math.inf
+            raise
+
+        total += math.prod(rng.option_counts)
+
+    try:
+        return total / probes
+    except OverflowError:
+        return math.inf
@@ -7,107 +7,220 @@
 
 # By: Timothy Letkeman
 
-from commands.command import Command
+import itertools
+import random
+import re
+
+from commands.command import Command, DeferredLines, collapsed_arena, LAZY_EXPANSION
 from commands.var import Var
 from commands.get import Get
 from commands.collection import Collection
 from commands.rand import Rand
 from errors import *
+from utils import StreamedToken
+import profiling
+from fast_random import FastRandom
+
+VARITHON_VERSION = "0.2.0"
 
 COMMAND_START = "~["
 COMMAND_END = "]~"
 
+# the approximate size in characters of each chunk of compiled source written to a file
+SOURCE_CHUNK_SIZE = 1 << 16
+
+
+# a token within a command ends at a space, or at the start or end of a nested command
+TOKEN_DELIMITER = re.compile(r"[ {}]")
+
 
-def tokenize_command(string):
+def tokenize_command(string, start=0, end=None):
     """ Parses a command string, and returns a list of all the tokens in it. A
         token is defined as either a string or a Command object. Command strings
         may have nested command objects by enclosing the command in curly braces,
-        then it is interpreted as a command instead of as a string.
+        then it is interpreted as a command instead of as a string. The string is
+        read in a single pass, nested commands are parsed in place rather than
+        from copies of the string.
 
-        :param string A string representing the body of a varithon statement
+        :param string A string containing the body of a varithon statement
             If this string is unable to be converted, this function will throw
-            a VarithonSyntaxException exception
+            a SyntaxException exception, with the column of the error
+        :param start the index in string at which the body starts
+        :param end the index in string at which the body ends, defaults to the end of string
         :return a list containing strings and/or Command objects"""
 
-    tokens = []
+    if end is None:
+        end = len(string)
+
+    tokens, index = _tokenize(string, start, end)
 
-    brace_level = 0
-    last_tokenized_index = 0
-    for i in range(len(string) + 1):
-        if i == len(string) or (string[i] == ' ' and brace_level == 0):
-            if i > last_tokenized_index:    # more than one character
-                tokens.append(string[last_tokenized_index:i])
-                last_tokenized_index = i + 1
-        elif string[i] == '{':
-            if brace_level == 0:                # first brace, therefore store the index
-                last_tokenized_index = i
-            brace_level += 1
-        elif string[i] == '}':
-            brace_level -= 1
-            if brace_level == 0:                # closing off the first brace, therefore recursively parse this as a Command token
-                tokens.append(parse_command(string[last_tokenized_index + 1:i]))
-                last_tokenized_index = i + 1
+    if index < end:     # _tokenize only stops early at an unmatched closing brace
+        raise SyntaxException("'}' found, but no matching '{'", index + 1)
 
     return tokens
 
 
-def parse_command(string):
+def _tokenize(string, start, end):
+    """ Tokenizes a command body from start until either end or an unmatched closing brace,
+        whichever comes first.
+
+        :param string A string containing the body of a varithon statement
+        :param start the index in string at which the body starts
+        :param end the index in string at which the body ends
+        :return a tuple of the list of tokens, and the index at which tokenizing stopped """
+
+    tokens = []
+
+    index = start
+    while index < end:
+        match = TOKEN_DELIMITER.search(string, index, end)
+        delimiter_index = match.start() if match is not None else end
+
+        if delimiter_index > index:
+            tokens.append(string[index:delimiter_index])
+
+        if delimiter_index == end or string[delimiter_index] == '}':
+            return tokens, delimiter_index
+        elif string[delimiter_index] == '{':    # recursively parse the nested command up to its closing brace
+            sub_tokens, close_index = _tokenize(string, delimiter_index + 1, end)
+
+            if close_index == end:
+                raise SyntaxException("'{' found, but no matching '}'", delimiter_index + 1)
+
+            tokens.append(_build_command(sub_tokens, delimiter_index))
+            index = close_index + 1
+        else:
+            index = delimiter_index + 1
+
+    return tokens, index
+
+
+def _build_command(tokens, index):
+    """ Builds the Command object for an already tokenized command.
+
+        :param tokens a list containing strings and/or Command objects, the first of which is the command name
+        :param index the index of the start of the command within its line, used for error reporting
+        :return a Command object, possibly a SyntaxException is thrown
+            if the tokens are unable to be parsed """
+
+    if len(tokens) == 0:
+        raise SyntaxException("Empty command.", index + 1)
+
+    try:
+        match tokens.pop(0):
+            case "var":
+                return Var(tokens)
+            case "get":
+                return Get(tokens)
+            case "collection":
+                return Collection(tokens)
+            case "best":
+                return "TODO"
+            case "rand":
+                return Rand(tokens)
+            case name:
+                raise SyntaxException(f"Unknown command '{name}'.")
+    except SyntaxException as e:
+        if e.column is None:
+            e.column = index + 1
+        raise
+
+
+def parse_command(string, start=0, end=None):
     """ Parses and returns a Command object given a string representing
         that command. Ex. The full varithon statement ~~[var a]~~ would result
         in calling this function with the argument of "var a".
 
-        :param string A string representing the body of a varithon statement
+        :param string A string containing the body of a varithon statement
             If this string is unable to be converted, this function will throw
-            a VarithonSyntaxException exception
+            a SyntaxException exception, with the column of the error
+        :param start the index in string at which the body starts
+        :param end the index in string at which the body ends, defaults to the end of string
         :return a Command object, possibly a SyntaxException is thrown
             if the string is unable to be parsed """
 
-    tokens = tokenize_command(string)
-
-    match tokens.pop(0):
-        case "var":
-            return Var(tokens)
-        case "get":
-            return Get(tokens)
-        case "collection":
-            return Collection(tokens)
-        case "best":
-            return "TODO"
-        case "rand":
-            return Rand(tokens)
+    return _build_command(tokenize_command(string, start, end), start)
 
 
 def parse_line(line):
     """ Parses a single line of a .vy file into a list, each entry in the list
-        either being a string, or a Command object. This function is called recursively to
+        either being a string, or a Command object. The line is read in a single pass from left to right.
 
         :param line: the line to parse as a string
         :return: A list of strings and Command objects, possibly a SyntaxException
             is thrown if the file is unable to be parsed """
 
-    if len(line) == 0:
-        return []
+    line_list = []
 
-    if COMMAND_START in line:
-        command_start_index = line.index(COMMAND_START)
+    index = 0
+    while True:
+        command_start_index = line.find(COMMAND_START, index)
+        if command_start_index == -1:
+            break
 
-        before_start, after_start = line[:command_start_index], line[command_start_index + len(COMMAND_START):]
+        body_start_index = command_start_index + len(COMMAND_START)
+        command_end_index = line.find(COMMAND_END, body_start_index)
+        if command_end_index == -1:
+            raise SyntaxException(f"'{COMMAND_START}' found, but no matching '{COMMAND_END}'", command_start_index + 1)
 
-        if COMMAND_END in after_start:
-            command_end_index = after_start.index(COMMAND_END)
+        if command_start_index > index:  # add the text before the start of the command, as long as it isn't empty
+            line_list.append(line[index:command_start_index])
 
-            command, after_end = after_start[:command_end_index], after_start[command_end_index + len(COMMAND_END):]
+        line_list.append(_build_command(tokenize_command(line, body_start_index, command_end_index),
+                                        command_start_index))
 
-            line_list = [parse_command(command)]
-            if len(before_start) > 0:  # prepend before the start of the command, as long as it isn't empty
-                line_list.insert(0, before_start)
-            line_list.extend(parse_line(after_end))  # recursive to get all commands in the line
+        index = command_end_index + len(COMMAND_END)
 
-            return line_list
-        else:
-            raise SyntaxException(f"'{COMMAND_START}' found, but no matching '{COMMAND_END}'")
-    else:
-        return [line]
+    if index < len(line):
+        line_list.append(line[index:])
+
+    return line_list
+
+
+def parse_varithon_string(source, filepath="<string>"):
+    """ Parses the source of a .vy file into a list of lists, each interior list containing only
+    strings, or Command objects. The source is read in a single pass, so parsing takes time
+    proportional to its length.
+
+    :param source: the contents of a .vy file as a string
+    :param filepath: the path reported within any syntax errors
+    :return: A list of strings and Command objects, possibly a VarithonSyntaxException
+        is thrown if the source is unable to be parsed """
+
+    return [parse_numbered_line(line, filepath, line_number)
+            for line_number, line in enumerate(iter_source_lines(source), 1)]
+
+
+def iter_source_lines(source):
+    """ Splits the source of a .vy file into its lines, each line keeping its line ending.
+
+    :param source: the contents of a .vy file as a string
+    :return: a generator yielding each line as a string """
+
+    line_start_index = 0
+    while line_start_index < len(source):
+        line_end_index = source.find("\n", line_start_index) + 1
+        if line_end_index == 0:
+            line_end_index = len(source)
+
+        yield source[line_start_index:line_end_index]
+
+        line_start_index = line_end_index
+
+
+def parse_numbered_line(line, filepath, line_number):
+    """ Parses a single line of a .vy file, reporting its position within the file in any syntax errors.
+
+    :param line: the line to parse as a string
+    :param filepath: the path reported within any syntax errors
+    :param line_number: the number of the line within the file, starting from 1
+    :return: A list of strings and Command objects, possibly a VarithonSyntaxException
+        is thrown if the line is unable to be parsed """
+
+    try:
+        return parse_line(line)
+    except SyntaxException as e:
+        raise VarithonSyntaxException(e.message, filepath, line_number, e.column)
 
 
 def parse_varithon_file(filepath):
@@ -115,73 +228,372 @@ def parse_varithon_file(filepath):
     strings, or Command objects.
 
     :param filepath: a path to the .vy file to parse
-    :return: A list of strings and Command objects, possibly a SyntaxException
+    :return: A list of strings and Command objects, possibly a VarithonSyntaxException
         is thrown if the file is unable to be parsed """
 
-    parsed_line_list = []
-
     with open(filepath, "r") as f:
-        line_number = 1
-        for line in f:
-            try:
-                parsed_line_list.append(parse_line(line))
-            except SyntaxException as e:
-                raise VarithonSyntaxException(filepath, line_number, e.message)
-            line_number += 1
+        source = f.read()
+
+    return parse_varithon_string(source, filepath)
+
+
+def variant_rng(seed, index, fast_random=False):
+    """ Creates the random.Random instance for the variation with the given index of a template with the given seed.
+        Each variation depends only on the seed and its own index, so any variation can be re-created on its own.
+
+        :param seed an integer seed for the template
+        :param index the integer index of the variation
+        :param fast_random whether to make integers and choices from single random floats, see FastRandom, the
+            same variation must be re-created with the same setting
+        :return a random.Random instance to draw every random decision of the variation from """
+
+    if fast_random:
+        return FastRandom(f"{seed}:{index}")
+
+    return random.Random(f"{seed}:{index}")
+
+
+class LineExpansion(list):
+    """ The lines that a single line containing commands expanded into when its commands were collapsed,
+        i.e. the pre-lines of its commands, the line itself, and the post-lines of its commands. """
+
+
+def contains_command(line):
+    """ Checks whether a line still contains any Command objects that must be collapsed.
+
+        :param line a list containing strings and Command objects
+        :return True if the line contains a Command object, False otherwise """
+
+    for item in line:
+        if isinstance(item, Command):
+            return True
+
+    return False
+
+
+class FoldedLineList(list):
+    """ A parsed list of lines in which every run of lines without any commands has been joined into a single line
+        holding a single string, as such lines are the same in every variation. The lines which contain commands,
+        and the line number within the Varithon file that each line starts at, are found once and kept, so they
+        do not need to be found again for every variation. """
+
+    def __init__(self):
+        super().__init__()
+
+        self.line_numbers = []
+        self.command_indices = []
+
+
+def fold_constants(parsed_line_list):
+    """ Joins every run of lines without any commands within a parsed list of lines into a single line, so that
+        each variation only walks the lines that vary. Compiling the folded list of lines gives exactly the same
+        variations as compiling the original.
+
+        :param parsed_line_list a list of lists, each interior list representing a single line of the Varithon file
+        :return a FoldedLineList, the given list itself if it is already folded """
+
+    if isinstance(parsed_line_list, FoldedLineList):
+        return parsed_line_list
+
+    folded = FoldedLineList()
+
+    text = []
+    for line_number, line in enumerate(parsed_line_list, 1):
+        if not contains_command(line):
+            if len(text) == 0:
+                folded.line_numbers.append(line_number)
+            text.extend(line)
+            continue
+
+        if len(text) > 0:
+            folded.append(["".join(text)])
+            text = []
+
+        folded.command_indices.append(len(folded))
+        folded.line_numbers.append(line_number)
+        folded.append(line)
+
+    if len(text) > 0:
+        folded.append(["".join(text)])
+
+    return folded
+
 
-    return parsed_line_list
+def collapse_line(line, varithon_state, python_state, rng):
+    """ Collapses every command within a single line, in sequence.
 
+        :param line a list containing strings and Command objects
+        :param varithon_state a dictionary containing the current state of varithon memory for this compilation
+        :param python_state a set containing python variable names in the current scope
+        :param rng the random.Random instance to draw every random decision from
+        :return a tuple of the pre-lines, the collapsed line, and the post-lines """
 
-def compile_varithon_file(destination_filepath, parsed_line_list):
+    pre_lines = []
+    new_line = []
+    post_lines = []
+    for item in line:
+        if isinstance(item, Command):
+            collapsed = item.collapse(varithon_state, python_state, line, rng)
+
+            pre_lines.extend(collapsed.get_pre_lines())
+            new_line.append(collapsed.get_result())
+            post_lines.extend(collapsed.get_post_lines())
+
+            collapsed_arena.release(collapsed)
+        else:
+            new_line.append(item)
+
+    return pre_lines, new_line, post_lines
+
+
+def flatten_line_list(line_list, flat_line_list=None):
+    """ Flattens a list of lines which may contain LineExpansions into a list of lines, in order.
+
+        :param line_list a list of lines and LineExpansions
+        :param flat_line_list the list to add the lines to, a new list if this is None
+        :return a list of lines """
+
+    if flat_line_list is None:
+        flat_line_list = []
+
+    for line in line_list:
+        if isinstance(line, LineExpansion):
+            flatten_line_list(line, flat_line_list)
+        else:
+            flat_line_list.append(line)
+
+    return flat_line_list
+
+
+def collapse_line_list(parsed_line_list, rng=None):
+    """ Collapses a parsed list of lines into a list of lines containing only strings. Each collapse is random and
+        independent of any previous collapse. The parsed list of lines is not modified, so it can be collapsed any
+        number of times.
+
+        Commands are collapsed in passes, every pass collapsing the commands created by the pass before it, in
+        order of the lines they are in. Only lines which still contain commands are visited by each pass, so the
+        total work grows with the number of commands rather than with the number of lines times passes.
+
+        :param parsed_line_list a list of lists, each interior list representing a single line of the Varithon file
+        :param rng the random.Random instance to draw every random decision from, if this is None a new
+            instance seeded by the operating system is used
+        :return a list of lists, each interior list representing a single line of the compiled python file """
+
+    if rng is None:
+        rng = random.Random()
+
+    varithon_state = {}
+    python_state = set()
+
+    line_list = list(parsed_line_list)
+
+    profiler = profiling.active_profiler
+    if profiler is not None:
+        profiler.record_variant()
+
+    # each entry of the worklist is a list of lines, the index of a line within it that contains commands,
+    # and the line number within the Varithon file that the line came from
+    if isinstance(parsed_line_list, FoldedLineList):
+        worklist = [(line_list, i, parsed_line_list.line_numbers[i]) for i in parsed_line_list.command_indices]
+    else:
+        worklist = [(line_list, i, i + 1) for i, line in enumerate(line_list) if contains_command(line)]
+    while len(worklist) > 0:
+        if profiler is not None:
+            profiler.record_pass()
+
+        next_worklist = []
+        for parent, index, line_number in worklist:
+            if profiler is not None:
+                profiler.line_number = line_number
+
+            pre_lines, new_line, post_lines = collapse_line(parent[index], varithon_state, python_state, rng)
+
+            if len(pre_lines) == 0 and len(post_lines) == 0:
+                parent[index] = new_line
+                if contains_command(new_line):
+                    next_worklist.append((parent, index, line_number))
+            else:
+                expansion = LineExpansion(pre_lines)
+                expansion.append(new_line)
+                expansion.extend(post_lines)
+
+                parent[index] = expansion
+                next_worklist.extend([(expansion, i, line_number) for i, line in enumerate(expansion)
+                                      if contains_command(line)])
+
+        worklist = next_worklist
+
+    return flatten_line_list(line_list)
+
+
+def iter_collapsed_lines(parsed_line_list, rng=None):
+    """ Collapses a parsed list of lines depth first, yielding each line of the compiled python file as soon as
+        every command within it has been collapsed. A line is collapsed along with its pre-lines and post-lines
+        before any later line, and the entries of collections built with the -b flag are only collapsed once they
+        are reached, either as the lines appending them, see DeferredLines, or as the literal is written, see
+        StreamedListLiteral. So the memory held at once grows with how deeply commands are nested rather than with
+        the size of the compiled file.
+
+        Commands are collapsed in a different order than by collapse_line_list, so the same random.Random instance
+        gives a different variation. Collections within a streamed literal are always written as literals, as no
+        lines can be added before a line which is already being written.
+
+        :param parsed_line_list a list of lists, each interior list representing a single line of the Varithon file
+        :param rng the random.Random instance to draw every random decision from, if this is None a new
+            instance seeded by the operating system is used
+        :return a generator yielding lists, each representing a single line of the compiled python file """
+
+    if rng is None:
+        rng = random.Random()
+
+    varithon_state = {LAZY_EXPANSION: True}
+    python_state = set()
+
+    profiler = profiling.active_profiler
+    if profiler is not None:
+        profiler.record_variant()
+
+    if isinstance(parsed_line_list, FoldedLineList):
+        line_numbers = parsed_line_list.line_numbers
+    else:
+        line_numbers = range(1, len(parsed_line_list) + 1)
+
+    for line_number, parsed_line in zip(line_numbers, parsed_line_list):
+        if profiler is not None:
+            profiler.line_number = line_number
+
+        # each entry is an iterator of the lines still to be written of a single expansion
+        stack = [iter((parsed_line,))]
+        while len(stack) > 0:
+            line = next(stack[-1], None)
+            if line is None:
+                stack.pop()
+            elif isinstance(line, DeferredLines):
+                stack.append(iter(line))
+            elif not contains_command(line):
+                yield line
+            else:
+                pre_lines, new_line, post_lines = collapse_line(line, varithon_state, python_state, rng)
+                stack.append(itertools.chain(pre_lines, (new_line,), post_lines))
+
+
+def compile_varithon_string(parsed_line_list, rng=None, lazy=False):
+    """ Compiles a parsed list of lines into the source of a single python file. Each compilation is random and
+        independent of any previous compilation.
+
+        :param parsed_line_list a list of lists, each interior list representing a single line of the Varithon file
+        :param rng the random.Random instance to draw every random decision from, if this is None a new
+            instance seeded by the operating system is used
+        :param lazy whether to collapse the lines depth first, see iter_collapsed_lines, which gives a different
+            variation for the same random.Random instance
+        :return a string containing the compiled python source """
+
+    if lazy:
+        return "".join(iter_source_chunks(iter_collapsed_lines(parsed_line_list, rng)))
+
+    return "".join(iter_source_chunks(collapse_line_list(parsed_line_list, rng)))
+
+
+def iter_source_chunks(line_list):
+    """ Converts a collapsed list of lines into the compiled python source in chunks of around SOURCE_CHUNK_SIZE
+        characters, so the source can be written without ever being held in memory as a whole. Small tokens are
+        batched together, while streamed tokens are written out piece by piece.
+
+        :param line_list a list, or any iterable, of lists, each interior list representing a single line of the
+            compiled file
+        :return a generator yielding strings, which joined together are the compiled python source """
+
+    batch = []
+    batch_size = 0
+    for line in line_list:
+        for item in line:
+            if isinstance(item, StreamedToken):
+                if batch:
+                    yield "".join(batch)
+                    batch, batch_size = [], 0
+                yield from item.iter_chunks()
+                continue
+
+            string = str(item)
+            batch.append(string)
+            batch_size += len(string)
+            if batch_size >= SOURCE_CHUNK_SIZE:
+                yield "".join(batch)
+                batch, batch_size = [], 0
+
+    if batch:
+        yield "".join(batch)
+
+
+def compile_variant(parsed_line_list, seed, index, fast_random=False, lazy=False):
+    """ Compiles the variation with the given index of a parsed list of lines, without compiling any of the
+        variations before it. The same seed and index always give the same variation.
+
+        :param parsed_line_list a list of lists, each interior list representing a single line of the Varithon file
+        :param seed an integer seed for the template
+        :param index the integer index of the variation
+        :param fast_random whether to make integers and choices from single random floats, see variant_rng
+        :param lazy whether to collapse the lines depth first, see iter_collapsed_lines
+        :return a string containing the compiled python source """
+
+    return compile_varithon_string(parsed_line_list, variant_rng(seed, index, fast_random), lazy)
+
+
+def iter_variant_chunks(parsed_line_list, seed, index, fast_random=False):
+    """ Compiles the variation with the given index of a parsed list of lines with lazy expansion, see
+        iter_collapsed_lines, yielding its source in chunks as each line is collapsed, so the source is never held
+        as a whole. Joined together, the chunks are the source given by compile_variant with lazy set.
+
+        :param parsed_line_list a list of lists, each interior list representing a single line of the Varithon file
+        :param seed an integer seed for the template
+        :param index the integer index of the variation
+        :param fast_random whether to make integers and choices from single random floats, see variant_rng
+        :return a generator yielding strings, which joined together are the compiled python source """
+
+    return iter_source_chunks(iter_collapsed_lines(parsed_line_list, variant_rng(seed, index, fast_random)))
+
+
+def compile_many(parsed_line_list, count, seed=None, start=0, fast_random=False, lazy=False):
+    """ Compiles a parsed list of lines into many independent variations, without any file I/O. The parsed list
+        of lines is shared by every variation and is never modified, its constant lines are folded once up front.
+
+        :param parsed_line_list a list of lists, each interior list representing a single line of the Varithon file
+        :param count the number of variations to compile
+        :param seed an integer seed for the template, if this is None a seed is chosen by the operating system
+        :param start the index of the first variation to compile
+        :param fast_random whether to make integers and choices from single random floats, see variant_rng
+        :param lazy whether to collapse the lines depth first, see iter_collapsed_lines
+        :return a generator yielding the compiled python source of each variation as a string """
+
+    if seed is None:
+        seed = random.SystemRandom().getrandbits(64)
+
+    parsed_line_list = fold_constants(parsed_line_list)
+
+    for index in range(start, start + count):
+        yield compile_variant(parsed_line_list, seed, index, fast_random, lazy)
+
+
+def compile_varithon_file(destination_filepath, parsed_line_list, rng=None, lazy=False):
     """ Compiles a parsed list of lines into a single python file. Each compilation is random and independent
         of any previous compilation.
 
         :param destination_filepath a string representing a filepath for the destination compiled file
-        :param parsed_line_list a list of lists, each interior list representing a single line of the Varithon file """
+        :param parsed_line_list a list of lists, each interior list representing a single line of the Varithon file
+        :param rng the random.Random instance to draw every random decision from, if this is None a new
+            instance seeded by the operating system is used
+        :param lazy whether to collapse the lines depth first, writing each line as soon as it is collapsed rather
+            than once every line is, see iter_collapsed_lines """
 
-    varithon_state = {}
-    python_state = set()
+    line_list = iter_collapsed_lines(parsed_line_list, rng) if lazy else collapse_line_list(parsed_line_list, rng)
 
-    # continue collapsing until there are no more commands
-    next_line_list = []
-    contains_command = True
-    while contains_command:
-        contains_command = False
-        # first collapse every command in sequence
-        for line in parsed_line_list:
-            pre_lines = []
-            new_line = []
-            post_lines = []
-            for item in line:
-                if isinstance(item, Command):
-                    contains_command = True
-                    item.collapse(varithon_state, python_state, line)
-
-                    pre_lines.extend(item.get_pre_lines())
-                    new_line.append(item.get_result())
-                    post_lines.extend(item.get_post_lines())
-                else:
-                    new_line.append(item)
-
-            next_line_list.extend(pre_lines)
-            next_line_list.append(new_line)
-            next_line_list.extend(post_lines)
-
-        parsed_line_list = next_line_list
-        next_line_list = []
-
-    # then open the file and write each command to it
     with open(destination_filepath, "w") as f:
-        for line in parsed_line_list:
-            for item in line:
-                f.write(str(item))
+        f.writelines(iter_source_chunks(line_list))
 
 
-if __name__ == "__main__" and False:
-    FILE_NAME = "hello"
-    COMPILATION_COUNT = 5
+if __name__ == "__main__":
+    import sys
 
-    parsed = parse_varithon_file("samples/" + FILE_NAME + ".vy")
+    from cli import main
 
-    for i in range(COMPILATION_COUNT):
-        compile_varithon_file("compiled/" + FILE_NAME + "_" + str(i) + ".py", parsed)
+    sys.exit(main())
@@ -0,0 +1,406 @@
+# Behaviour verification of compiled variations. Variations are run within a pool of long-lived worker processes,
+# rather than by starting a new python interpreter for each one. Each variation is run with its own globals and
+# its own captured stdout and stderr, and is stopped if it runs for longer than its timeout.
+#
+# Many variations differ only in the names chosen for their variables, and behave identically. When verifying with
+# a VerifiedCache, each variation is reduced to a fingerprint of its syntax tree with those names replaced in order
+# of appearance, and is only run if no variation with the same fingerprint has been verified, in the same call or
+# in a previous run.
+
+import ast
+import builtins
+import hashlib
+import io
+import multiprocessing
+import os
+import signal
+import sys
+import traceback
+
+import cache
+
+# the default number of seconds a single variation may run for
+DEFAULT_TIMEOUT = 10.0
+
+# the number of variations sent to a worker per task
+CHUNK_SIZE = 16
+
+# the number of variations a worker runs before it is replaced, so changes made by a variation to the
+# interpreter itself, such as imported modules, do not build up
+MAX_TASKS_PER_CHILD = 64
+
+# the version of the fingerprints of variations, changed whenever the fingerprints change
+FINGERPRINT_FORMAT = 1
+
+# the name of the file within the cache directory that verified variations are kept in
+VERIFIED_FILENAME = "verified.txt"
+
+# names through which a variation may depend on the spelling of its other names, a variation using any of these is
+# fingerprinted exactly as written
+INTROSPECTIVE_NAMES = {"globals", "locals", "vars", "dir", "eval", "exec", "compile", "getattr", "setattr",
+                       "hasattr", "delattr", "__import__"}
+
+
+class VariantTimeout(BaseException):
+    """ VariantTimeout is raised within a variation once it has run for longer than its timeout. It is a
+        BaseException, so it is not caught by a bare 'except Exception' within the variation. """
+
+
+class VariantResult(object):
+    """ VariantResult holds the outcome of running a single compiled variation. """
+
+    def __init__(self, stdout, stderr, timed_out):
+        """ Constructs a VariantResult.
+
+            :param stdout everything the variation wrote to stdout, as a string
+            :param stderr everything the variation wrote to stderr, including the traceback of an uncaught
+                exception, as a string
+            :param timed_out True if the variation was stopped for running longer than its timeout """
+
+        self.stdout = stdout
+        self.stderr = stderr
+        self.timed_out = timed_out
+
+    def matches(self, expected_output, expected_error):
+        """ Checks whether this result matches an expected output and error. Surrounding white spacing and the
+            style of line endings are ignored.
+
+            :param expected_output the expected stdout as a string, if this is None stdout is not checked
+            :param expected_error the expected stderr as a string, if this is None stderr is not checked
+            :return True if the result matches, False otherwise """
+
+        if self.timed_out:
+            return False
+        if expected_output is not None and normalize_output(self.stdout) != normalize_output(expected_output):
+            return False
+        if expected_error is not None and normalize_output(self.stderr) != normalize_output(expected_error):
+            return False
+
+        return True
+
+
+def normalize_output(output):
+    """ Normalizes the output of a variation for comparison.
+
+        :param output the output as a string
+        :return the output with surrounding white spacing removed and every line ending as '\\n' """
+
+    return output.replace("\r\n", "\n").strip()
+
+
+def _canonicalize_names(tree):
+    """ Renames every identifier chosen by a variation itself to one given by its order of appearance, so two
+        variations differing only in the names of their variables become identical. Builtins, attribute names,
+        keyword argument names, imported module names, and class names are left as written, as the behaviour of a
+        variation may depend on them. The tree is walked once, and only the nodes holding names are kept.
+
+        :param tree the ast.Module of the variation, which is renamed in place
+        :return True if the tree was renamed, False if the variation may depend on the spelling of its names, in
+            which case the tree is left as written """
+
+    occurrences = []    # tuples of each node holding a name chosen by the variation, and the field holding it
+    kept_names = set()
+    attribute_names = set()
+    for node in ast.walk(tree):
+        node_type = type(node)
+        if node_type is ast.Name:
+            if node.id in INTROSPECTIVE_NAMES or node.id.startswith("__"):
+                return False
+            occurrences.append((node, "id"))
+        elif node_type is ast.Attribute:
+            if node.attr.startswith("__"):
+                return False
+            attribute_names.add(node.attr)
+        elif node_type is ast.keyword:
+            attribute_names.add(node.arg)
+        elif node_type is ast.arg:
+            occurrences.append((node, "arg"))
+        elif node_type is ast.FunctionDef or node_type is ast.AsyncFunctionDef:
+            occurrences.append((node, "name"))
+        elif node_type is ast.ClassDef:
+            kept_names.add(node.name)
+        elif node_type is ast.alias or node_type is ast.ExceptHandler:
+            if (node.asname if node_type is ast.alias else node.name) is not None:
+                occurrences.append((node, "asname" if node_type is ast.alias else "name"))
+        elif node_type is ast.Global or node_type is ast.Nonlocal:
+            occurrences.extend([(node, index) for index in range(len(node.names))])
+        elif node_type is ast.JoinedStr:
+            for value, following in zip(node.values, node.values[1:]):
+                if type(value) is ast.Constant and type(following) is ast.FormattedValue and value.value.endswith("="):
+                    return False    # f"{name=}", which writes the name of the variable
+
+    names = {}
+    for node, field in occurrences:
+        name = node.names[field] if type(field) is int else getattr(node, field)
+        if name not in names and name not in kept_names and not hasattr(builtins, name):
+            names[name] = str(len(names))     # never a valid identifier, so never equal to a kept name
+
+    # a renamed name which is also used as an attribute, such as a method or a keyword argument, must keep its name
+    if not attribute_names.isdisjoint(names):
+        return False
+
+    for node, field in occurrences:
+        if type(field) is int:
+            node.names[field] = names.get(node.names[field], node.names[field])
+        else:
+            name = getattr(node, field)
+            setattr(node, field, names.get(name, name))
+
+    return True
+
+
+def get_fingerprint(source):
+    """ Gets the structural fingerprint of a compiled variation, which is the same for any two variations which
+        differ only in the names of their variables. It is assumed that a variation's behaviour does not depend on
+        the spelling of those names, unless it uses any of INTROSPECTIVE_NAMES, a name beginning with '__', or an
+        f-string which writes the name of a variable, in which case the variation is fingerprinted as written.
+
+        :param source the compiled python source as a string
+        :return the fingerprint as a hexadecimal string, or None if the source is unable to be parsed """
+
+    try:
+        tree = ast.parse(source)
+    except (SyntaxError, ValueError):
+        return None
+
+    _canonicalize_names(tree)
+
+    digest = hashlib.blake2b(f"{FINGERPRINT_FORMAT}\0{sys.version}\0".encode(), digest_size=16)
+    digest.update(ast.dump(tree).encode())
+
+    return digest.hexdigest()
+
+
+class VerifiedCache(object):
+    """ VerifiedCache remembers which fingerprints of variations have been verified to behave as expected, so they
+        need not be run again. Entries may be kept in a file, so they persist across runs, each is appended to the
+        file as a single line, so many processes may add to the same file at once. """
+
+    def __init__(self, path=None):
+        """ Constructs a VerifiedCache, reading the entries already kept in its file.
+
+            :param path a path to the file the entries are kept in, or None to keep them only in memory """
+
+        self.path = path
+        self.keys = set()
+
+        if path is not None:
+            try:
+                with open(path, "r") as f:
+                    self.keys.update(f.read().split())
+            except FileNotFoundError:
+                pass
+
+    def get_key(self, fingerprint, expected_output, expected_error):
+        """ Gets the key of a fingerprint verified against an expected output and error.
+
+            :param fingerprint the fingerprint of the variation, see get_fingerprint
+            :param expected_output the expected stdout as a string, or None if stdout is not checked
+            :param expected_error the expected stderr as a string, or None if stderr is not checked
+            :return the key as a hexadecimal string """
+
+        digest = hashlib.blake2b(fingerprint.encode(), digest_size=16)
+        for expected in [expected_output, expected_error]:
+            digest.update(b"\1" if expected is None else b"\0" + normalize_output(expected).encode() + b"\0")
+
+        return digest.hexdigest()
+
+    def __contains__(self, key):
+        return key in self.keys
+
+    def add(self, keys):
+        """ Adds verified keys to the cache.
+
+            :param keys a list of keys, see get_key """
+
+        keys = [key for key in dict.fromkeys(keys) if key not in self.keys]
+        self.keys.update(keys)
+
+        if self.path is not None and len(keys) > 0:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(self.path, "a") as f:
+                f.write("".join([key + "\n" for key in keys]))
+
+
+def get_verified_cache(cache_dir=None):
+    """ Gets the VerifiedCache kept within the cache directory.
+
+        :param cache_dir a path to the cache directory, see cache.get_cache_dir
+        :return a VerifiedCache """
+
+    return VerifiedCache(os.path.join(cache.get_cache_dir(cache_dir), VERIFIED_FILENAME))
+
+
+def _raise_timeout(signum, frame):
+    raise VariantTimeout()
+
+
+def run_source(source, timeout=DEFAULT_TIMEOUT, filename="<variant>"):
+    """ Runs compiled python source within the current process, as if it were the main module, with its stdout
+        and stderr captured.
+
+        :param source the compiled python source as a string
+        :param timeout the number of seconds the source may run for, or None for no limit
+        :param filename the filename reported within tracebacks
+        :return a VariantResult """
+
+    stdout, stderr = io.StringIO(), io.StringIO()
+    original_stdout, original_stderr = sys.stdout, sys.stderr
+
+    use_alarm = timeout is not None and hasattr(signal, "setitimer")
+    if use_alarm:
+        previous_handler = signal.signal(signal.SIGALRM, _raise_timeout)
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+
+    timed_out = False
+    sys.stdout, sys.stderr = stdout, stderr
+    try:
+        exec(compile(source, filename, "exec"), {"__name__": "__main__", "__builtins__": builtins})
+    except VariantTimeout:
+        timed_out = True
+    except SystemExit as e:
+        if e.code is not None and not isinstance(e.code, int):
+            print(e.code, file=stderr)
+    except BaseException:
+        traceback.print_exc(file=stderr)
+    finally:
+        sys.stdout, sys.stderr = original_stdout, original_stderr
+        if use_alarm:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, previous_handler)
+
+    return VariantResult(stdout.getvalue(), stderr.getvalue(), timed_out)
+
+
+def _run_chunk(task):
+    """ Runs a chunk of variations within a worker process.
+
+        :param task a tuple of a list of compiled python sources, and the timeout of each
+        :return a list of VariantResults """
+
+    sources, timeout = task
+    return [run_source(source, timeout) for source in sources]
+
+
+def _fingerprint_chunk(sources):
+    """ Fingerprints a chunk of variations within a worker process.
+
+        :param sources a list of compiled python sources
+        :return a list of the fingerprint of each source, see get_fingerprint """
+
+    return [get_fingerprint(source) for source in sources]
+
+
+class VerificationPool(object):
+    """ VerificationPool runs compiled variations within a pool of long-lived worker processes, and compares their
+        behaviour against the expected behaviour. Pools should be used as context managers, or closed once
+        finished. """
+
+    def __init__(self, jobs=None, timeout=DEFAULT_TIMEOUT, chunk_size=CHUNK_SIZE):
+        """ Constructs a VerificationPool, starting its worker processes.
+
+            :param jobs the number of worker processes to use, defaults to the number of CPUs
+            :param timeout the number of seconds each variation may run for
+            :param chunk_size the number of variations sent to a worker per task """
+
+        self.jobs = jobs
+        self.timeout = timeout
+        self.chunk_size = chunk_size
+
+        self.run_count = 0      # the number of variations which have actually been run
+
+        self.pool = multiprocessing.Pool(jobs, maxtasksperchild=MAX_TASKS_PER_CHILD)
+
+    def run(self, sources):
+        """ Runs many compiled variations.
+
+            :param sources an iterable of compiled python sources as strings
+            :return a generator yielding the VariantResult of each variation, in order """
+
+        def tasks():
+            chunk = []
+            for source in sources:
+                chunk.append(source)
+                if len(chunk) == self.chunk_size:
+                    yield chunk, self.timeout
+                    chunk = []
+            if len(chunk) > 0:
+                yield chunk, self.timeout
+
+        for results in self.pool.imap(_run_chunk, tasks()):
+            yield from results
+
+    def get_fingerprints(self, sources):
+        """ Fingerprints many compiled variations within the worker processes, each distinct source only once.
+
+            :param sources a list of compiled python sources as strings
+            :return a list of the fingerprint of each source, see get_fingerprint """
+
+        distinct = list(dict.fromkeys(sources))
+        chunks = [distinct[start:start + self.chunk_size] for start in range(0, len(distinct), self.chunk_size)]
+
+        fingerprints = {}
+        for chunk, chunk_fingerprints in zip(chunks, self.pool.imap(_fingerprint_chunk, chunks)):
+            fingerprints.update(zip(chunk, chunk_fingerprints))
+
+        return [fingerprints[source] for source in sources]
+
+    def verify(self, sources, expected_output, expected_error, verified=None):
+        """ Runs many compiled variations, and finds every one which does not behave as expected. If a
+            VerifiedCache is given, only one variation of each fingerprint is run, see get_fingerprint, and every
+            other variation with that fingerprint is given its result. Fingerprinting costs about as much as
+            parsing each variation, so it is only worthwhile when variations take longer than that to run.
+
+            :param sources an iterable of compiled python sources as strings
+            :param expected_output the expected stdout as a string, if this is None stdout is not checked
+            :param expected_error the expected stderr as a string, if this is None stderr is not checked
+            :param verified a VerifiedCache, whose variations are accepted without being run and which is given
+                every variation which behaves as expected, or None to run every variation
+            :return a list of tuples of the index, source, and VariantResult of each variation which failed """
+
+        sources = list(sources)
+
+        # the key of every variation, and the index of the variation run for each key
+        keys = [None] * len(sources)
+        if verified is not None:
+            keys = [None if fingerprint is None else verified.get_key(fingerprint, expected_output, expected_error)
+                    for fingerprint in self.get_fingerprints(sources)]
+
+        run_indices = {}
+        for index, key in enumerate(keys):
+            if key is None:
+                run_indices[index] = index
+            elif key not in verified and key not in run_indices:
+                run_indices[key] = index
+
+        run_results = dict(zip(run_indices.values(), self.run([sources[index] for index in run_indices.values()])))
+        self.run_count += len(run_results)
+
+        passed = []
+        failures = []
+        for index, key in enumerate(keys):
+            if key is not None and key in verified:
+                continue    # verified before this call
+
+            result = run_results[run_indices[index if key is None else key]]
+            if not result.matches(expected_output, expected_error):
+                failures.append((index, sources[index], result))
+            elif key is not None:
+                passed.append(key)
+
+        if verified is not None:
+            verified.add(passed)
+
+        return failures
+
+    def close(self):
+        """ Stops the worker processes of this pool. """
+
+        self.pool.terminate()
+        self.pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,202 @@
+# Watch mode for editing templates, run with 'python -m varithon --watch'. Templates are polled for changes, and
+# whenever one changes only the lines whose text changed are parsed again, after which a small set of preview
+# variations is regenerated straight away. A full run of every template is only started on demand.
+
+import os
+import sys
+import threading
+import time
+
+import varithon as V
+from cli import find_templates, compile_template, RunStats, PREVIEW_COUNT
+from errors import SyntaxException, VarithonSyntaxException
+from parallel import CompilePool
+from writers import PythonFileWriter
+
+
+class WatchedTemplate(object):
+    """ WatchedTemplate is a single template being watched. The parsed form of every line is kept, keyed by the
+        text of the line, so when the template changes only new or edited lines are parsed again. """
+
+    def __init__(self, path, name):
+        """ Constructs a WatchedTemplate, the template is not read until it is first updated.
+
+            :param path the path to the .vy file
+            :param name the name its variations are written under """
+
+        self.path = path
+        self.name = name
+
+        self.signature = None
+        self.line_cache = {}
+        self.parsed = None
+
+    def has_changed(self):
+        """ Checks whether the template has been modified since it was last updated.
+
+            :return True if the template has changed, False otherwise """
+
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return False
+
+        return (stat.st_mtime_ns, stat.st_size) != self.signature
+
+    def update(self):
+        """ Reads the template again, parsing only the lines which are not already parsed. If the template contains
+            a syntax error, the previously parsed template is kept.
+
+            :return the number of lines which were parsed, possibly a VarithonSyntaxException
+                is thrown if the template is unable to be parsed """
+
+        stat = os.stat(self.path)
+        self.signature = (stat.st_mtime_ns, stat.st_size)
+
+        with open(self.path, "r") as f:
+            source = f.read()
+
+        line_cache = {}
+        parsed = []
+        parsed_count = 0
+        for line_number, line in enumerate(V.iter_source_lines(source), 1):
+            parsed_line = line_cache.get(line)
+            if parsed_line is None:
+                parsed_line = self.line_cache.get(line)
+            if parsed_line is None:
+                parsed_line = V.parse_numbered_line(line, self.path, line_number)
+                parsed_count += 1
+
+            line_cache[line] = parsed_line     # parsed lines are never modified, so equal lines can share one
+            parsed.append(parsed_line)
+
+        self.line_cache = line_cache    # lines which were removed are forgotten
+        self.parsed = parsed
+
+        return parsed_count
+
+
+class Watcher(object):
+    """ Watcher watches a set of templates and directories of templates, regenerating the previews of each
+        template that changes. Directories are searched again every poll, so new templates are picked up. """
+
+    def __init__(self, paths, preview_directory, preview_count=PREVIEW_COUNT, seed=0, stream=None,
+                 fast_random=False, lazy=False):
+        """ Constructs a Watcher.
+
+            :param paths a list of paths to .vy files and directories
+            :param preview_directory a path to the directory the previews are written to
+            :param preview_count the number of preview variations to regenerate whenever a template changes
+            :param seed the seed of the previews
+            :param stream the stream to report to, sys.stderr if this is None
+            :param fast_random whether to make integers and choices from single random floats, see V.variant_rng
+            :param lazy whether to collapse the lines depth first, see V.iter_collapsed_lines """
+
+        self.paths = paths
+        self.preview_directory = preview_directory
+        self.preview_count = preview_count
+        self.seed = seed
+        self.stream = stream if stream is not None else sys.stderr
+        self.fast_random = fast_random
+        self.lazy = lazy
+
+        self.templates = {}
+
+    def poll(self):
+        """ Checks every template for changes, parsing and previewing each one which has changed.
+
+            :return a list of the names of the templates which were previewed """
+
+        found = []
+        for path in self.paths:
+            try:
+                found.extend(find_templates([path]))
+            except FileNotFoundError:
+                pass    # a template may be missing for a moment while an editor saves it
+
+        previewed = []
+        for path, name in found:
+            template = self.templates.get(path)
+            if template is None:
+                template = self.templates[path] = WatchedTemplate(path, name)
+
+            if template.has_changed() and self.preview(template):
+                previewed.append(name)
+
+        return previewed
+
+    def preview(self, template):
+        """ Parses the changed lines of a template and regenerates its previews, reporting any errors.
+
+            :param template the WatchedTemplate which has changed
+            :return True if the previews were regenerated, False if there was an error """
+
+        start = time.perf_counter()
+        try:
+            parsed_count = template.update()
+            parsed = time.perf_counter()
+
+            variants = list(V.compile_many(template.parsed, self.preview_count, self.seed,
+                                           fast_random=self.fast_random, lazy=self.lazy))
+        except (VarithonSyntaxException, SyntaxException) as e:
+            print(f"{template.name}: {e}", file=self.stream)
+            return False
+
+        with PythonFileWriter(self.preview_directory, template.name) as writer:
+            for index, source in enumerate(variants):
+                writer.write(template.name, index, self.seed, source, self.lazy)
+
+        print(f"{template.name}: parsed {parsed_count} of {len(template.parsed)} lines in {parsed - start:.3f}s, "
+              f"wrote {len(variants)} previews in {time.perf_counter() - parsed:.3f}s", file=self.stream)
+        return True
+
+    def run_batch(self, args):
+        """ Compiles a full run of every template which parsed successfully, as given by the command line arguments.
+
+            :param args the parsed command line arguments """
+
+        templates = [template for template in self.templates.values() if template.parsed is not None]
+
+        stats = RunStats(args.count * len(templates), self.stream, None if args.quiet else args.progress_interval)
+        with CompilePool({template.name: template.parsed for template in templates}, args.jobs) as pool:
+            for template in templates:
+                try:
+                    compile_template(pool, template.name, args, stats, None)
+                except SyntaxException as e:
+                    print(f"{template.name}: {e}", file=self.stream)
+
+        if stats.live:
+            print(file=self.stream)
+        print(stats.get_summary(len(templates)), file=self.stream)
+
+
+def watch_templates(args):
+    """ Watches the templates given by the command line arguments until interrupted. Entering a line starts a full
+        run of every template.
+
+        :param args the parsed command line arguments
+        :return the exit status """
+
+    watcher = Watcher(args.templates, args.preview_out or os.path.join(args.out, "preview"), args.preview_count,
+                      args.seed, fast_random=args.fast_random, lazy=args.lazy)
+
+    batch_requested = threading.Event()
+
+    def read_requests():
+        for _ in sys.stdin:
+            batch_requested.set()
+
+    threading.Thread(target=read_requests, daemon=True).start()
+
+    print(f"Watching {', '.join(args.templates)}, press enter to start a full run, ctrl-c to stop", file=sys.stderr)
+    try:
+        while True:
+            watcher.poll()
+
+            if batch_requested.is_set():
+                batch_requested.clear()
+                watcher.run_batch(args)
+
+            time.sleep(args.poll_interval)
+    except KeyboardInterrupt:
+        return 0
@@ -0,0 +1,304 @@
+# Streaming output of compiled variations. Instead of one .py file per variation, variations are written into
+# size-bounded shards, each record carrying the template name, variation index, seed, random mode, and expansion
+# mode needed to re-create it.
+# Records are buffered and written in bulk, and nothing is kept once written, so memory use does not grow with
+# the number of variations.
+
+import gzip
+import io
+import json
+import marshal
+import os
+import struct
+import tarfile
+import time
+
+from emit import encode_tokens, SHARD_HEADER
+
+# the default uncompressed size of a shard before a new shard is started
+DEFAULT_SHARD_BYTES = 256 * 1024 * 1024
+
+# the size of the buffer that records are gathered in before being written
+DEFAULT_BUFFER_BYTES = 4 * 1024 * 1024
+
+
+class ShardWriter(object):
+    """ ShardWriter is the base class of every variation writer. Records are gathered in a buffer, which is
+        written to the current shard whenever it is full, and a new shard is started whenever the current
+        one reaches its size limit. Writers should be used as context managers, or closed once finished. """
+
+    extension = ""
+
+    # a function applied to each variation by the worker processes, whose result is written in place of the source
+    emit = None
+
+    def __init__(self, destination, prefix, max_shard_bytes=DEFAULT_SHARD_BYTES, buffer_bytes=DEFAULT_BUFFER_BYTES):
+        """ Constructs a ShardWriter.
+
+            :param destination a path to the directory the shards are written to, it is created if needed
+            :param prefix the string that every shard filename begins with
+            :param max_shard_bytes the uncompressed size in bytes after which a new shard is started
+            :param buffer_bytes the size in bytes of records to gather before writing them """
+
+        self.destination = destination
+        self.prefix = prefix
+        self.max_shard_bytes = max_shard_bytes
+        self.buffer_bytes = buffer_bytes
+
+        self.shard_paths = []
+        self.record_count = 0
+        self.byte_count = 0
+
+        self.shard = None
+        self.shard_bytes = 0
+        self.buffer = []
+        self.buffered_bytes = 0
+
+        os.makedirs(destination, exist_ok=True)
+
+    def write(self, template, index, seed, source, lazy=False):
+        """ Writes a single compiled variation.
+
+            :param template the name of the template the variation was compiled from
+            :param index the integer index of the variation
+            :param seed the integer seed of the template the variation was compiled with
+            :param source the compiled python source of the variation as a string
+            :param lazy whether the variation was compiled with lazy expansion, see V.iter_collapsed_lines """
+
+        record = self.encode_record(template, index, seed, source, lazy)
+
+        if self.shard is None or (self.shard_bytes > 0 and self.shard_bytes + len(record[1]) > self.max_shard_bytes):
+            self.start_shard()
+
+        self.buffer.append(record)
+        self.buffered_bytes += len(record[1])
+        self.shard_bytes += len(record[1])
+        self.record_count += 1
+        self.byte_count += len(record[1])
+
+        if self.buffered_bytes >= self.buffer_bytes:
+            self.flush()
+
+    def write_chunks(self, template, index, seed, chunks, lazy=False):
+        """ Writes a single compiled variation given as chunks of its source, such as those of V.iter_variant_chunks.
+            Formats which can be written as the source is compiled override this, so the source is never held as
+            a whole, every other format joins the chunks and writes the source.
+
+            :param template the name of the template the variation was compiled from
+            :param index the integer index of the variation
+            :param seed the integer seed of the template the variation was compiled with
+            :param chunks an iterable of strings, which joined together are the compiled python source
+            :param lazy whether the variation was compiled with lazy expansion, see V.iter_collapsed_lines
+            :return the size of the compiled python source in bytes """
+
+        source = "".join(chunks)
+        self.write(template, index, seed, source, lazy)
+        return len(source.encode())
+
+    def start_shard(self):
+        """ Finishes the current shard, if there is one, and opens the next. """
+
+        self.finish_shard()
+
+        path = os.path.join(self.destination, f"{self.prefix}-{len(self.shard_paths):05d}{self.extension}")
+        self.shard_paths.append(path)
+        self.shard = self.open_shard(path)
+        self.shard_bytes = 0
+
+    def finish_shard(self):
+        """ Writes any buffered records and closes the current shard, if there is one. """
+
+        if self.shard is not None:
+            self.flush()
+            self.shard.close()
+            self.shard = None
+
+    def flush(self):
+        """ Writes every buffered record to the current shard. """
+
+        if len(self.buffer) > 0:
+            self.write_records(self.buffer)
+            self.buffer = []
+            self.buffered_bytes = 0
+
+    def close(self):
+        """ Writes any buffered records and closes the writer. """
+
+        self.finish_shard()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def encode_record(self, template, index, seed, source, lazy):
+        """ Encodes a single variation.
+
+            :return a tuple of the record's metadata and its encoded bytes """
+
+        raise NotImplementedError
+
+    def open_shard(self, path):
+        """ Opens a new shard at the given path.
+
+            :return a file-like object that is closed once the shard is finished """
+
+        raise NotImplementedError
+
+    def write_records(self, records):
+        """ Writes a list of encoded records to the current shard. """
+
+        raise NotImplementedError
+
+
+class JSONLShardWriter(ShardWriter):
+    """ Writes variations as gzip compressed JSON lines, one object per variation with the keys
+        template, index, seed, lazy, and source. """
+
+    extension = ".jsonl.gz"
+
+    def encode_record(self, template, index, seed, source, lazy):
+        line = json.dumps({"template": template, "index": index, "seed": seed, "lazy": lazy,
+                           "source": source}) + "\n"
+        return None, line.encode()
+
+    def write_chunks(self, template, index, seed, chunks, lazy=False):
+        # the source is the last key of the object, so each chunk is escaped and written as it is compiled
+        self.flush()
+        if self.shard is None or self.shard_bytes >= self.max_shard_bytes:
+            self.start_shard()
+
+        head = json.dumps({"template": template, "index": index, "seed": seed, "lazy": lazy, "source": ""})
+        data = head[:-2].encode()
+        self.shard.write(data)
+        record_bytes = len(data)
+
+        source_bytes = 0
+        for chunk in chunks:
+            data = json.dumps(chunk)[1:-1].encode()
+            self.shard.write(data)
+            record_bytes += len(data)
+            source_bytes += len(chunk.encode())
+
+        self.shard.write(b'"}\n')
+        record_bytes += 3
+
+        self.shard_bytes += record_bytes
+        self.record_count += 1
+        self.byte_count += record_bytes
+        return source_bytes
+
+    def open_shard(self, path):
+        return gzip.open(path, "wb", compresslevel=6)
+
+    def write_records(self, records):
+        self.shard.write(b"".join([data for _, data in records]))
+
+
+class TarShardWriter(ShardWriter):
+    """ Writes variations as members of tar files, named <template>/<index>.py. The template, index, seed, random
+        mode, and expansion mode of each variation are also stored as a JSON object in the pax comment header of its
+        member. """
+
+    extension = ".tar"
+
+    def encode_record(self, template, index, seed, source, lazy):
+        return (template, index, seed, lazy), source.encode()
+
+    def open_shard(self, path):
+        return tarfile.open(path, "w", format=tarfile.PAX_FORMAT)
+
+    def write_records(self, records):
+        modified = int(time.time())
+        for (template, index, seed, lazy), data in records:
+            info = tarfile.TarInfo(f"{template}/{index}.py")
+            info.size = len(data)
+            info.mtime = modified
+            info.pax_headers = {"comment": json.dumps({"template": template, "index": index, "seed": seed,
+                                                       "lazy": lazy})}
+            self.shard.addfile(info, io.BytesIO(data))
+
+
+class TokenShardWriter(ShardWriter):
+    """ Writes variations as records of their source and python tokens, see emit.encode_tokens, so consumers can
+        read the tokens back rather than tokenizing every variation. Each record is the length of the record as a
+        4 byte little endian integer, followed by the marshalled tuple of its template, index, seed, whether it was
+        compiled with lazy expansion, and the encoded tokens.
+        A variation which is unable to be tokenized is written with the error in place of its tokens, rather than
+        ending the run, as the template itself compiled. Each shard starts with emit.SHARD_HEADER, recording the
+        token format and python version it was written with, as marshal is only guaranteed to be readable by the
+        same python version. Shards may be joined by simply concatenating them. """
+
+    extension = ".vyt"
+
+    emit = staticmethod(encode_tokens)
+
+    def encode_record(self, template, index, seed, source, lazy):
+        if isinstance(source, str):     # not already encoded by a worker
+            source = encode_tokens(source)
+
+        data = marshal.dumps((template, index, seed, lazy, source))
+        return None, struct.pack("<I", len(data)) + data
+
+    def open_shard(self, path):
+        shard = open(path, "wb")
+        shard.write(SHARD_HEADER)
+        return shard
+
+    def write_records(self, records):
+        self.shard.write(b"".join([data for _, data in records]))
+
+
+class PythonFileWriter(ShardWriter):
+    """ Writes every variation to its own .py file named <template>_<index>.py, with no size limit. This is
+        intended only for small runs, such as previewing a template. """
+
+    def __init__(self, destination, prefix, max_shard_bytes=DEFAULT_SHARD_BYTES, buffer_bytes=DEFAULT_BUFFER_BYTES):
+        super().__init__(destination, prefix, max_shard_bytes, buffer_bytes)
+
+        self.shard = self   # there are no shards, each record is written to its own file
+
+    def encode_record(self, template, index, seed, source, lazy):
+        return (template, index), source.encode()
+
+    def write_chunks(self, template, index, seed, chunks, lazy=False):
+        self.flush()    # the files are written in order of their index
+
+        path = os.path.join(self.destination, f"{template}_{index}.py")
+        source_bytes = 0
+        with open(path, "wb") as f:
+            for chunk in chunks:
+                data = chunk.encode()
+                f.write(data)
+                source_bytes += len(data)
+        self.shard_paths.append(path)
+
+        self.record_count += 1
+        self.byte_count += source_bytes
+        return source_bytes
+
+    def open_shard(self, path):
+        return self
+
+    def write_records(self, records):
+        for (template, index), data in records:
+            path = os.path.join(self.destination, f"{template}_{index}.py")
+            with open(path, "wb") as f:
+                f.write(data)
+            self.shard_paths.append(path)
+
+    def start_shard(self):
+        pass
+
+    def close(self):
+        self.flush()
+
+
+# the writer class for each output format
+WRITERS = {
+    "py": PythonFileWriter,
+    "jsonl": JSONLShardWriter,
+    "tar": TarShardWriter,
+    "tokens": TokenShardWriter,
+}